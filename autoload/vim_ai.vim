@@ -13,27 +13,47 @@ let s:last_config = {}
 let s:scratch_buffer_name = ">>> AI chat"
 let s:chat_redraw_interval = 250 " milliseconds
 
-function! s:ImportPythonModules()
-  " Add plugin vim_ai directory to Python path for imports
-  py3 import sys
-  py3 import os
-  execute "py3 plugin_py_path = '" . s:plugin_root . "/vim_ai'"
-  py3 plugin_py_path = os.path.abspath(plugin_py_path)
-  py3 if plugin_py_path not in sys.path: sys.path.insert(0, plugin_py_path)
-  
-  for py_module in ['ai_types', 'utils', 'context', 'chat', 'complete', 'roles', 'image']
-    if !py3eval("'" . py_module . "_py_imported' in globals()")
+let s:python_path_initialized = 0
+let s:imported_python_modules = {}
+
+" Imports vim_ai as a regular python package, so compiled modules are reused
+" from __pycache__. Only the core modules are imported upfront, command specific
+" modules (a:000, e.g. 'chat', 'image') are imported on their first use.
+function! s:ImportPythonModules(...)
+  if !s:python_path_initialized
+    py3 import sys
+    execute "py3 vim_ai_plugin_root = '" . s:plugin_root . "'"
+    py3 if vim_ai_plugin_root not in sys.path: sys.path.insert(0, vim_ai_plugin_root)
+    let s:python_path_initialized = 1
+  endif
+
+  for l:py_module in ['utils', 'context'] + a:000
+    if !has_key(s:imported_python_modules, l:py_module)
       try
-        execute "py3file " . s:plugin_root . "/vim_ai/" . py_module . ".py"
+        execute "py3 import vim_ai." . l:py_module
+        let s:imported_python_modules[l:py_module] = 1
       catch
         echohl ErrorMsg
-        echo "vim-ai: Failed to load " . py_module . ".py: " . v:exception
+        echo "vim-ai: Failed to load " . l:py_module . ".py: " . v:exception
         echohl None
       endtry
     endif
   endfor
 endfunction
 
+let s:config_snapshot = {}
+
+" Pushes g:vim_ai_* variables to Python when any of them changed, so that
+" Python reads plain dicts instead of calling vim.eval on every request
+function! s:SyncConfigSnapshot() abort
+  let l:snapshot = filter(copy(g:), 'v:key =~# "^vim_ai_"')
+  if l:snapshot ==# s:config_snapshot
+    return
+  endif
+  let s:config_snapshot = deepcopy(l:snapshot)
+  py3 vim_ai.config_snapshot.load_config_snapshot(vim_ai.utils.unwrap('l:snapshot'))
+endfunction
+
 function! s:StartsWith(longer, shorter) abort
   return a:longer[0:len(a:shorter)-1] ==# a:shorter
 endfunction
@@ -147,7 +167,8 @@ endfunction
 " - config       - function scoped vim_ai_complete config
 " - a:1          - optional instruction prompt
 function! vim_ai#AIRun(uses_range, config, ...) range abort
-  call s:ImportPythonModules()
+  call s:ImportPythonModules('complete')
+  call s:SyncConfigSnapshot()
   let l:instruction = a:0 > 0 ? a:1 : ""
   let l:is_selection = a:uses_range && a:firstline == line("'<") && a:lastline == line("'>")
   let l:selection = s:GetSelectionOrRange(l:is_selection, a:uses_range, a:firstline, a:lastline)
@@ -160,7 +181,7 @@ function! vim_ai#AIRun(uses_range, config, ...) range abort
   \  "is_selection": l:is_selection,
   \  "command_type": 'complete',
   \}
-  let l:context = py3eval("make_ai_context(unwrap('l:config_input'))")
+  let l:context = py3eval("vim_ai.context.make_ai_context(vim_ai.utils.unwrap('l:config_input'))")
   let l:config = l:context['config']
 
   let s:last_command = "complete"
@@ -178,7 +199,7 @@ function! vim_ai#AIRun(uses_range, config, ...) range abort
     else
       execute "normal! " . a:lastline . "Go"
     endif
-    py3 run_ai_completition(unwrap('l:context'))
+    py3 vim_ai.complete.run_ai_completition(vim_ai.utils.unwrap('l:context'))
     execute "normal! " . a:lastline . "G"
   finally
     call s:set_nopaste(l:config)
@@ -190,7 +211,8 @@ endfunction
 " - config       - function scoped vim_ai_edit config
 " - a:1          - optional instruction prompt
 function! vim_ai#AIEditRun(uses_range, config, ...) range abort
-  call s:ImportPythonModules()
+  call s:ImportPythonModules('complete')
+  call s:SyncConfigSnapshot()
   let l:instruction = a:0 > 0 ? a:1 : ""
   let l:is_selection = a:uses_range && a:firstline == line("'<") && a:lastline == line("'>")
   let l:selection = s:GetSelectionOrRange(l:is_selection, a:uses_range, a:firstline, a:lastline)
@@ -203,7 +225,7 @@ function! vim_ai#AIEditRun(uses_range, config, ...) range abort
   \  "is_selection": l:is_selection,
   \  "command_type": 'edit',
   \}
-  let l:context = py3eval("make_ai_context(unwrap('l:config_input'))")
+  let l:context = py3eval("vim_ai.context.make_ai_context(vim_ai.utils.unwrap('l:config_input'))")
   let l:config = l:context['config']
 
   let s:last_command = "edit"
@@ -217,7 +239,7 @@ function! vim_ai#AIEditRun(uses_range, config, ...) range abort
     call s:set_paste(l:config)
     call s:SelectSelectionOrRange(l:is_selection, a:firstline, a:lastline)
     execute "normal! c"
-    py3 run_ai_completition(unwrap('l:context'))
+    py3 vim_ai.complete.run_ai_completition(vim_ai.utils.unwrap('l:context'))
   finally
     call s:set_nopaste(l:config)
   endtry
@@ -228,7 +250,8 @@ endfunction
 " - config       - function scoped vim_ai_image config
 " - a:1          - optional instruction prompt
 function! vim_ai#AIImageRun(uses_range, config, ...) range abort
-  call s:ImportPythonModules()
+  call s:ImportPythonModules('image')
+  call s:SyncConfigSnapshot()
   let l:instruction = a:0 > 0 ? a:1 : ""
   let l:is_selection = a:uses_range && a:firstline == line("'<") && a:lastline == line("'>")
   let l:selection = s:GetSelectionOrRange(l:is_selection, a:uses_range, a:firstline, a:lastline)
@@ -241,7 +264,7 @@ function! vim_ai#AIImageRun(uses_range, config, ...) range abort
   \  "is_selection": l:is_selection,
   \  "command_type": 'image',
   \}
-  let l:context = py3eval("make_ai_context(unwrap('l:config_input'))")
+  let l:context = py3eval("vim_ai.context.make_ai_context(vim_ai.utils.unwrap('l:config_input'))")
   let l:config = l:context['config']
 
   let s:last_command = "image"
@@ -251,7 +274,29 @@ function! vim_ai#AIImageRun(uses_range, config, ...) range abort
   let s:last_firstline = a:firstline
   let s:last_lastline = a:lastline
 
-  py3 run_ai_image(unwrap('l:context'))
+  let l:batch_id = py3eval("vim_ai.image.run_ai_image(vim_ai.utils.unwrap('l:context'))")
+  if l:batch_id
+    call timer_start(0, function('vim_ai#AIImageWatch', [l:batch_id, 0]))
+  endif
+endfunction
+
+" Function called in a timer that reports progress of background image jobs.
+" It ends when all images of the batch are saved (or failed).
+function! vim_ai#AIImageWatch(batch_id, anim_index, timerid) abort
+  let l:status = py3eval("vim_ai.image.ai_image_job_pool.get_status(vim_ai.utils.unwrap('a:batch_id'))")
+  if l:status['done'] == 0
+    call timer_start(s:chat_redraw_interval, function('vim_ai#AIImageWatch', [a:batch_id, a:anim_index + 1]))
+    let l:animations = ['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏']
+    let l:current_animation = l:animations[a:anim_index % len(l:animations)]
+    echo "Generating " . l:current_animation . " " . l:status['finished'] . "/" . l:status['total']
+  else
+    redraw
+    if l:status['error']
+      echohl ErrorMsg
+    endif
+    echo join(l:status['messages'], "\n")
+    echohl None
+  endif
 endfunction
 
 function! s:ReuseOrCreateChatWindow(config)
@@ -299,7 +344,7 @@ endfunction
 " therefore working around with undoing and pasting changes manually.
 function! s:AIChatUndoCleanup()
   let l:bufnr = bufnr()
-  let l:done = py3eval("ai_job_pool.is_job_done(unwrap('l:bufnr'))")
+  let l:done = py3eval("vim_ai.chat.ai_job_pool.is_job_done(vim_ai.utils.unwrap('l:bufnr'))")
   let l:undo_cleaned = getbufvar('%', 'vim_ai_chat_undo_cleaned', 1)
   if !l:done || l:undo_cleaned
     return
@@ -329,7 +374,8 @@ endfunction
 " - config       - function scoped vim_ai_chat config
 " - a:1          - optional instruction prompt
 function! vim_ai#AIChatRun(uses_range, config, ...) range abort
-  call s:ImportPythonModules()
+  call s:ImportPythonModules('chat')
+  call s:SyncConfigSnapshot()
   let l:instruction = a:0 > 0 ? a:1 : ""
   let l:is_selection = a:uses_range && a:firstline == line("'<") && a:lastline == line("'>")
   let l:selection = s:GetSelectionOrRange(l:is_selection, a:uses_range, a:firstline, a:lastline)
@@ -343,7 +389,7 @@ function! vim_ai#AIChatRun(uses_range, config, ...) range abort
   \  "is_selection": l:is_selection,
   \  "command_type": 'chat',
   \}
-  let l:context = py3eval("make_ai_context(unwrap('l:config_input'))")
+  let l:context = py3eval("vim_ai.context.make_ai_context(vim_ai.utils.unwrap('l:config_input'))")
   let l:config = l:context['config']
   let l:context['prompt'] = a:0 > 0 || a:uses_range ? l:context['prompt'] : ''
   let l:context['started_from_chat'] = l:started_from_chat
@@ -355,7 +401,7 @@ function! vim_ai#AIChatRun(uses_range, config, ...) range abort
     let l:context['bufnr'] = bufnr()
     let l:bufnr = bufnr()
 
-    if py3eval("ai_job_pool.is_job_done(unwrap('l:bufnr'))") == 0
+    if py3eval("vim_ai.chat.ai_job_pool.is_job_done(vim_ai.utils.unwrap('l:bufnr'))") == 0
       echoerr "Operation in progress, wait or stop it with :AIStopChat"
       return
     endif
@@ -363,7 +409,7 @@ function! vim_ai#AIChatRun(uses_range, config, ...) range abort
     let s:last_command = "chat"
     let s:last_config = a:config
 
-    if py3eval("run_ai_chat(unwrap('l:context'))")
+    if py3eval("vim_ai.chat.run_ai_chat(vim_ai.utils.unwrap('l:context'))")
       if g:vim_ai_async_chat == 1
 
         call setbufvar(l:bufnr, 'vim_ai_chat_undo_cleaned', 0)
@@ -389,8 +435,8 @@ function! vim_ai#AIChatStopRun() abort
     return
   endif
   let l:bufnr = bufnr('%')
-  call s:ImportPythonModules() " Ensure chat.py is loaded
-  py3 ai_job_pool.cancel_job(unwrap('l:bufnr'))
+  call s:ImportPythonModules('chat')
+  py3 vim_ai.chat.ai_job_pool.cancel_job(vim_ai.utils.unwrap('l:bufnr'))
   call s:AIChatUndoCleanup()
 endfunction
 
@@ -401,8 +447,8 @@ endfunction
 function! vim_ai#AIChatWatch(bufnr, anim_index, timerid) abort
   " inject new lines, first check if it is done to avoid data race, we do not
   " mind if we run the timer one more time, but we want all the data
-  let l:done = py3eval("ai_job_pool.is_job_done(unwrap('a:bufnr'))")
-  let l:result = py3eval("ai_job_pool.pickup_lines(unwrap('a:bufnr'))")
+  let l:done = py3eval("vim_ai.chat.ai_job_pool.is_job_done(vim_ai.utils.unwrap('a:bufnr'))")
+  let l:result = py3eval("vim_ai.chat.ai_job_pool.pickup_lines(vim_ai.utils.unwrap('a:bufnr'))")
 
   " if user scroling over chat while answering, do not auto-scroll
   let l:should_prevent_autoscroll = bufnr('%') == a:bufnr && line('.') != line('$')
@@ -419,7 +465,10 @@ function! vim_ai#AIChatWatch(bufnr, anim_index, timerid) abort
     let l:current_animation = l:animations[a:anim_index % len(l:animations)]
     call appendbufline(a:bufnr, '$', "<<< answering " . l:current_animation)
   else
+    let l:cleanup_start = reltime()
     call s:AIChatUndoCleanup()
+    let l:cleanup_time = reltimefloat(reltime(l:cleanup_start))
+    py3 vim_ai.chat.ai_job_pool.finish_trace(vim_ai.utils.unwrap('a:bufnr'), vim_ai.utils.unwrap('l:cleanup_time'))
     " Clear message
     " https://neovim.discourse.group/t/how-to-clear-the-echo-message-in-the-command-line/268/3
     call feedkeys(':','nx')
@@ -457,10 +506,12 @@ endfunction
 
 function! s:RoleCompletion(A, command_type) abort
   if a:A !~# '^/' | return [] | endif
-  call s:ImportPythonModules()
-  let l:role_list = py3eval("load_ai_role_names(unwrap('a:command_type'))")
-  call map(l:role_list, '"/" . v:val')
-  return filter(l:role_list, 'v:val =~ "^' . a:A . '"')
+  call s:ImportPythonModules('roles')
+  call s:SyncConfigSnapshot()
+  let l:prefix = a:A[1:]
+  let l:ignore_case = &ignorecase
+  let l:role_list = py3eval("vim_ai.roles.complete_ai_role_names(vim_ai.utils.unwrap('a:command_type'), vim_ai.utils.unwrap('l:prefix'), vim_ai.utils.unwrap('l:ignore_case') == '1')")
+  return map(l:role_list, '"/" . v:val')
 endfunction
 
 function! vim_ai#RoleCompletionComplete(A,L,P) abort
@@ -483,6 +534,62 @@ function! vim_ai#AIUtilRolesOpen() abort
   execute "e " . g:vim_ai_roles_config_file
 endfunction
 
+" Summarize request metrics recorded in g:vim_ai_metrics_file
+function! vim_ai#AIStatsRun() abort
+  call s:ImportPythonModules('metrics')
+  call s:SyncConfigSnapshot()
+  echo join(py3eval("vim_ai.metrics.get_stats_lines()"), "\n")
+endfunction
+
 function! vim_ai#AIUtilSetDebug(is_debug) abort
   let g:vim_ai_debug = a:is_debug
+  call vim_ai#AIUtilReloadConfig()
+endfunction
+
+function! vim_ai#AIUtilSetProfile(is_profile) abort
+  let g:vim_ai_profile = a:is_profile
+  call vim_ai#AIUtilReloadConfig()
+endfunction
+
+function! vim_ai#AIUtilSetTrace(is_trace) abort
+  let g:vim_ai_trace = a:is_trace
+  call vim_ai#AIUtilReloadConfig()
+endfunction
+
+" Open top functions by cumulative time of the latest profile in a scratch buffer
+" a:1 - optional number of functions
+function! vim_ai#AIUtilProfileReport(...) abort
+  call s:ImportPythonModules('profiling')
+  call s:SyncConfigSnapshot()
+  let l:limit = a:0 > 0 ? a:1 : 0
+  let l:lines = py3eval("vim_ai.profiling.get_profile_report_lines(vim_ai.utils.unwrap('l:limit'))")
+  call s:OpenScratchBuffer('[AI Profile]', l:lines)
+endfunction
+
+" Start tracemalloc, snapshot vim_ai allocations or stop it
+" a:1 - optional action: start, snapshot or stop
+function! vim_ai#AIUtilMemStats(...) abort
+  call s:ImportPythonModules('memstats')
+  let l:action = a:0 > 0 ? a:1 : ''
+  let l:lines = py3eval("vim_ai.memstats.run_mem_stats(vim_ai.utils.unwrap('l:action'))")
+  call s:OpenScratchBuffer('[AI Memory]', l:lines)
+endfunction
+
+function! vim_ai#MemStatsCompletion(A,L,P) abort
+  return filter(['start', 'snapshot', 'stop'], 'v:val =~# "^" . a:A')
+endfunction
+
+function! s:OpenScratchBuffer(name, lines) abort
+  execute "new " . fnameescape(a:name)
+  setlocal buftype=nofile bufhidden=wipe noswapfile nobuflisted modifiable
+  silent %delete _
+  call setline(1, a:lines)
+  setlocal nomodifiable
+endfunction
+
+" Forces Python to re-read all g:vim_ai_* variables
+function! vim_ai#AIUtilReloadConfig() abort
+  call s:ImportPythonModules()
+  let s:config_snapshot = {}
+  call s:SyncConfigSnapshot()
 endfunction
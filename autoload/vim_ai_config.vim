@@ -88,6 +88,12 @@ endif
 if !exists("g:vim_ai_debug")
   let g:vim_ai_debug = 0
 endif
+if !exists("g:vim_ai_debug_level")
+  let g:vim_ai_debug_level = "debug"
+endif
+if !exists("g:vim_ai_debug_log_max_size")
+  let g:vim_ai_debug_log_max_size = 10 * 1024 * 1024
+endif
 
 if has("win32") || has("win64")
   let s:temp_dir = exists('$TEMP')? $TEMP: expand("$WINDIR") . '\Temp'
@@ -99,6 +105,24 @@ let g:vim_ai_temp_dir = s:temp_dir
 if !exists("g:vim_ai_debug_log_file")
   let g:vim_ai_debug_log_file = g:vim_ai_temp_dir . '/vim_ai_debug.log'
 endif
+if !exists("g:vim_ai_profile")
+  let g:vim_ai_profile = 0
+endif
+if !exists("g:vim_ai_profile_dir")
+  let g:vim_ai_profile_dir = g:vim_ai_temp_dir . '/vim_ai_profiles'
+endif
+if !exists("g:vim_ai_trace")
+  let g:vim_ai_trace = 0
+endif
+if !exists("g:vim_ai_trace_dir")
+  let g:vim_ai_trace_dir = g:vim_ai_temp_dir . '/vim_ai_traces'
+endif
+if !exists("g:vim_ai_metrics")
+  let g:vim_ai_metrics = 0
+endif
+if !exists("g:vim_ai_metrics_file")
+  let g:vim_ai_metrics_file = g:vim_ai_temp_dir . '/vim_ai_metrics.jsonl'
+endif
 if !exists("g:vim_ai_token_file_path")
   let g:vim_ai_token_file_path = expand("~/.config/openai.token")
 endif
@@ -108,9 +132,24 @@ endif
 if !exists("g:vim_ai_roles_config_file")
   let g:vim_ai_roles_config_file = s:plugin_root . "/roles-example.ini"
 endif
+if !exists("g:vim_ai_roles_config_function_ttl")
+  let g:vim_ai_roles_config_function_ttl = 1
+endif
 if !exists("g:vim_ai_async_chat")
   let g:vim_ai_async_chat = 1
 endif
+if !exists("g:vim_ai_async_image")
+  let g:vim_ai_async_image = 1
+endif
+if !exists("g:vim_ai_git_context_async")
+  let g:vim_ai_git_context_async = 1
+endif
+if !exists("g:vim_ai_context_retrieval")
+  let g:vim_ai_context_retrieval = 0
+endif
+if !exists("g:vim_ai_context_retrieval_budget")
+  let g:vim_ai_context_retrieval_budget = 1500
+endif
 
 function! vim_ai_config#ExtendDeep(defaults, override) abort
   let l:result = a:defaults
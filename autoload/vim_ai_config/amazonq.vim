@@ -37,4 +37,6 @@ let g:vim_ai_amazonq_chat = {
 \  "token_file_path": expand("~/.config/amazonq.token"),
 \  "token_load_fn": "",
 \  "initial_prompt": s:amazonq_chat_prompt,
+\  "q_chat_command": "q chat",
+\  "persistent_session": 1,
 \}
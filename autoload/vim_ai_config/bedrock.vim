@@ -21,9 +21,11 @@ let g:vim_ai_bedrock_complete = {
 \  "model": g:vim_ai_bedrock_text_model,
 \  "max_tokens": g:vim_ai_bedrock_max_tokens,
 \  "temperature": 0.1,
+\  "stream": 1,
 \  "region": g:vim_ai_bedrock_region,
 \  "profile": g:vim_ai_bedrock_profile,
 \  "request_timeout": 30,
+\  "availability_ttl": 300,
 \  "initial_prompt": s:bedrock_complete_prompt,
 \}
 let g:vim_ai_bedrock_edit = g:vim_ai_bedrock_complete
@@ -31,9 +33,11 @@ let g:vim_ai_bedrock_chat = {
 \  "model": g:vim_ai_bedrock_text_model,
 \  "max_tokens": g:vim_ai_bedrock_max_tokens,
 \  "temperature": 0.7,
+\  "stream": 1,
 \  "region": g:vim_ai_bedrock_region,
 \  "profile": g:vim_ai_bedrock_profile,
 \  "request_timeout": 30,
+\  "availability_ttl": 300,
 \  "initial_prompt": s:bedrock_chat_prompt,
 \}
 let g:vim_ai_bedrock_image = {
@@ -42,5 +46,7 @@ let g:vim_ai_bedrock_image = {
 \  "profile": g:vim_ai_bedrock_profile,
 \  "width": 1024,
 \  "height": 1024,
+\  "number_of_images": 1,
 \  "request_timeout": 60,
+\  "availability_ttl": 300,
 \}
@@ -31,3 +31,11 @@ command! AIStopChat call vim_ai#AIChatStopRun()
 command! AIUtilRolesOpen call vim_ai#AIUtilRolesOpen()
 command! AIUtilDebugOn call vim_ai#AIUtilSetDebug(1)
 command! AIUtilDebugOff call vim_ai#AIUtilSetDebug(0)
+command! AIUtilReloadConfig call vim_ai#AIUtilReloadConfig()
+command! AIStats call vim_ai#AIStatsRun()
+command! AIUtilProfileOn call vim_ai#AIUtilSetProfile(1)
+command! AIUtilProfileOff call vim_ai#AIUtilSetProfile(0)
+command! AIUtilTraceOn call vim_ai#AIUtilSetTrace(1)
+command! AIUtilTraceOff call vim_ai#AIUtilSetTrace(0)
+command! -nargs=? AIUtilProfileReport call vim_ai#AIUtilProfileReport(<f-args>)
+command! -nargs=? -complete=customlist,vim_ai#MemStatsCompletion AIUtilMemStats call vim_ai#AIUtilMemStats(<f-args>)
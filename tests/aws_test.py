@@ -0,0 +1,307 @@
+import datetime
+import json
+import os
+import sys
+import tempfile
+import struct
+import threading
+import zlib
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch
+
+from vim_ai import aws
+from vim_ai.aws import (
+    AWSCredentials, AWSError, AWSCredentialsError, BedrockRuntimeClient, STSClient,
+    EventStreamDecoder, sign_request, resolve_credentials, resolve_region, parse_expiration,
+)
+
+CLEAN_ENV = {
+    'AWS_ACCESS_KEY_ID': '',
+    'AWS_SECRET_ACCESS_KEY': '',
+    'AWS_SESSION_TOKEN': '',
+    'AWS_PROFILE': '',
+    'AWS_REGION': '',
+    'AWS_DEFAULT_REGION': '',
+}
+
+def write_aws_files(tmpdir, credentials='', config=''):
+    credentials_path = os.path.join(tmpdir, 'credentials')
+    config_path = os.path.join(tmpdir, 'config')
+    with open(credentials_path, 'w') as f:
+        f.write(credentials)
+    with open(config_path, 'w') as f:
+        f.write(config)
+    env = dict(CLEAN_ENV)
+    env['AWS_SHARED_CREDENTIALS_FILE'] = credentials_path
+    env['AWS_CONFIG_FILE'] = config_path
+    return env
+
+def test_sign_request_vanilla():
+    # get-vanilla case of the AWS SigV4 test suite
+    credentials = AWSCredentials('AKIDEXAMPLE', 'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY')
+    headers = sign_request(
+        'GET', 'https://example.amazonaws.com/', {}, b'',
+        credentials, 'us-east-1', 'service',
+        now=datetime.datetime(2015, 8, 30, 12, 36, 0),
+    )
+    assert headers['X-Amz-Date'] == '20150830T123600Z'
+    assert headers['Authorization'] == (
+        'AWS4-HMAC-SHA256 Credential=AKIDEXAMPLE/20150830/us-east-1/service/aws4_request, '
+        'SignedHeaders=host;x-amz-date, '
+        'Signature=5fa00fa31553b73ebf1942676e86291e8372ff2a2260956d9b8aae1d763fbf31'
+    )
+
+def test_sign_request_session_token():
+    credentials = AWSCredentials('AKID', 'SECRET', 'TOKEN')
+    headers = sign_request('POST', 'https://bedrock-runtime.us-east-1.amazonaws.com/model/a%3A0/converse',
+                           {'Content-Type': 'application/json'}, b'{}', credentials, 'us-east-1', 'bedrock')
+    assert headers['X-Amz-Security-Token'] == 'TOKEN'
+    assert 'SignedHeaders=content-type;host;x-amz-date;x-amz-security-token,' in headers['Authorization']
+
+def test_resolve_credentials_env_and_profiles():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = write_aws_files(
+            tmpdir,
+            credentials='[default]\naws_access_key_id = DEFAULTKEY\naws_secret_access_key = DEFAULTSECRET\n',
+            config='[profile work]\nregion = eu-west-1\naws_access_key_id = WORKKEY\naws_secret_access_key = WORKSECRET\n',
+        )
+        with patch.dict(os.environ, env):
+            aws.invalidate_credentials()
+            assert resolve_credentials().access_key == 'DEFAULTKEY'
+            assert resolve_credentials('work').access_key == 'WORKKEY'
+            assert resolve_region('work') == 'eu-west-1'
+            assert resolve_region('work', 'us-west-2') == 'us-west-2'
+
+            os.environ['AWS_ACCESS_KEY_ID'] = 'ENVKEY'
+            os.environ['AWS_SECRET_ACCESS_KEY'] = 'ENVSECRET'
+            assert resolve_credentials().access_key == 'ENVKEY'
+            # explicit profile takes precedence over the environment
+            assert resolve_credentials('work').access_key == 'WORKKEY'
+
+            try:
+                resolve_credentials('missing')
+                assert False, 'expected AWSCredentialsError'
+            except AWSCredentialsError:
+                pass
+        aws.invalidate_credentials()
+
+def test_resolve_region_cache():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = write_aws_files(tmpdir, config='[profile work]\nregion = eu-west-1\n')
+        with patch.dict(os.environ, env):
+            aws.invalidate_credentials()
+            with patch('vim_ai.aws.load_profile_config', wraps=aws.load_profile_config) as mock_load:
+                assert resolve_region('work') == 'eu-west-1'
+                assert resolve_region('work') == 'eu-west-1'
+                assert mock_load.call_count == 1
+
+                with open(env['AWS_CONFIG_FILE'], 'w') as f:
+                    f.write('[profile work]\nregion = eu-central-1\n')
+                assert resolve_region('work') == 'eu-central-1'
+                assert mock_load.call_count == 2
+        aws.invalidate_credentials()
+
+def test_resolve_credentials_process():
+    output = json.dumps({
+        'Version': 1,
+        'AccessKeyId': 'PROCESSKEY',
+        'SecretAccessKey': 'PROCESSSECRET',
+        'SessionToken': 'PROCESSTOKEN',
+        'Expiration': '2100-01-01T00:00:00Z',
+    })
+    with tempfile.TemporaryDirectory() as tmpdir:
+        script = os.path.join(tmpdir, 'creds.py')
+        with open(script, 'w') as f:
+            f.write('print({!r})\n'.format(output))
+        env = write_aws_files(
+            tmpdir,
+            config='[profile sso]\ncredential_process = "{}" "{}"\n'.format(sys.executable, script),
+        )
+        with patch.dict(os.environ, env):
+            aws.invalidate_credentials()
+            credentials = resolve_credentials('sso')
+            assert credentials.token == 'PROCESSTOKEN'
+            assert credentials.expiration == parse_expiration('2100-01-01T00:00:00Z')
+            with patch('vim_ai.aws.subprocess_run_compat') as mock_run:
+                assert resolve_credentials('sso') is credentials
+                mock_run.assert_not_called()
+        aws.invalidate_credentials()
+
+def test_parse_expiration():
+    assert parse_expiration('1970-01-01T00:00:10Z') == 10
+    assert parse_expiration('1970-01-01T01:00:10+01:00') == 10
+    assert parse_expiration('1970-01-01T00:00:10.123Z') == 10
+
+def encode_event_stream_message(headers, payload):
+    """Encodes a message with string headers"""
+    encoded_headers = b''
+    for name, value in headers.items():
+        name = name.encode('utf-8')
+        value = value.encode('utf-8')
+        encoded_headers += struct.pack('>B', len(name)) + name + struct.pack('>BH', 7, len(value)) + value
+    total_length = 12 + len(encoded_headers) + len(payload) + 4
+    prelude = struct.pack('>II', total_length, len(encoded_headers))
+    message = prelude + struct.pack('>I', zlib.crc32(prelude)) + encoded_headers + payload
+    return message + struct.pack('>I', zlib.crc32(message))
+
+
+def make_event(event_type, event):
+    headers = {':message-type': 'event', ':event-type': event_type, ':content-type': 'application/json'}
+    return encode_event_stream_message(headers, json.dumps(event).encode('utf-8'))
+
+def test_event_stream_decoder():
+    data = make_event('contentBlockDelta', {'delta': {'text': 'Hello'}}) + make_event('messageStop', {})
+    decoder = EventStreamDecoder()
+    messages = []
+    # feed byte by byte to exercise partial preludes, headers and payloads
+    for i in range(len(data)):
+        messages.extend(decoder.feed(data[i:i + 1]))
+    assert decoder.pending == 0
+    assert [headers[':event-type'] for headers, _ in messages] == ['contentBlockDelta', 'messageStop']
+    assert json.loads(messages[0][1].decode('utf-8')) == {'delta': {'text': 'Hello'}}
+
+    corrupted = bytearray(make_event('messageStop', {}))
+    corrupted[-5] ^= 0xff
+    try:
+        EventStreamDecoder().feed(bytes(corrupted))
+        assert False, 'expected AWSError'
+    except AWSError as e:
+        assert e.code == 'EventStreamError'
+
+class BedrockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        if self.headers['Content-Type'] == 'application/json':
+            body = json.loads(body)
+        self.server.requests.append((self.path, dict(self.headers), body, self.client_address))
+        if self.path == '/':
+            response = (
+                '<ErrorResponse><Error><Type>Sender</Type><Code>InvalidClientTokenId</Code>'
+                '<Message>The security token included in the request is invalid.</Message></Error></ErrorResponse>'
+            ).encode('utf-8')
+            self.send_response(403)
+        elif self.path.endswith('/converse-stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/vnd.amazon.eventstream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            events = [make_event('contentBlockDelta', {'delta': {'text': text}}) for text in ('Hel', 'lo')]
+            if 'throttled' in self.path:
+                events.append(encode_event_stream_message({
+                    ':message-type': 'exception',
+                    ':exception-type': 'throttlingException',
+                }, json.dumps({'message': 'Too many requests'}).encode('utf-8')))
+            else:
+                events.append(make_event('metadata', {'usage': {'totalTokens': 2}}))
+            for event in events:
+                self.wfile.write('{:x}\r\n'.format(len(event)).encode('ascii') + event + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        elif 'denied' in self.path:
+            response = json.dumps({'message': 'The security token included in the request is invalid.'}).encode('utf-8')
+            self.send_response(403)
+            self.send_header('x-amzn-ErrorType', 'UnrecognizedClientException:http://internal.amazon.com/coral/')
+        else:
+            response = json.dumps({'output': {'message': {'content': [{'text': 'Hello'}]}}}).encode('utf-8')
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+def start_server():
+    server = HTTPServer(('127.0.0.1', 0), BedrockHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def test_bedrock_runtime_client():
+    server = start_server()
+    try:
+        env = dict(CLEAN_ENV)
+        env['AWS_ACCESS_KEY_ID'] = 'AKID'
+        env['AWS_SECRET_ACCESS_KEY'] = 'SECRET'
+        with patch.dict(os.environ, env):
+            client = BedrockRuntimeClient(region='us-east-1', endpoint_url='http://127.0.0.1:{}'.format(server.server_port))
+            payload = {'messages': [{'role': 'user', 'content': [{'text': 'Hi'}]}]}
+            assert client.converse('amazon.nova-micro-v1:0', payload)['output']['message']['content'][0]['text'] == 'Hello'
+            assert client.converse('amazon.nova-micro-v1:0', payload)['output']['message']['content'][0]['text'] == 'Hello'
+
+            try:
+                client.converse('denied', payload)
+                assert False, 'expected AWSError'
+            except AWSError as e:
+                assert e.status == 403
+                assert e.code == 'UnrecognizedClientException'
+                assert e.is_auth_error
+
+        path, headers, body, client_address = server.requests[0]
+        assert path == '/model/amazon.nova-micro-v1%3A0/converse'
+        assert headers['Authorization'].startswith('AWS4-HMAC-SHA256 Credential=AKID/')
+        assert '/us-east-1/bedrock/aws4_request' in headers['Authorization']
+        assert body == payload
+        # keep-alive connection is reused from the pool
+        assert server.requests[1][3] == client_address
+    finally:
+        aws.close_connections()
+        server.shutdown()
+        server.server_close()
+
+def test_sts_xml_error():
+    server = start_server()
+    try:
+        env = dict(CLEAN_ENV)
+        env['AWS_ACCESS_KEY_ID'] = 'AKID'
+        env['AWS_SECRET_ACCESS_KEY'] = 'SECRET'
+        with patch.dict(os.environ, env):
+            client = STSClient(region='us-east-1', endpoint_url='http://127.0.0.1:{}'.format(server.server_port))
+            try:
+                client.get_caller_identity()
+                assert False, 'expected AWSError'
+            except AWSError as e:
+                assert e.code == 'InvalidClientTokenId'
+                assert e.message == 'The security token included in the request is invalid.'
+                assert e.is_auth_error
+        assert server.requests[0][2] == 'Action=GetCallerIdentity&Version=2011-06-15'
+        assert '/us-east-1/sts/aws4_request' in server.requests[0][1]['Authorization']
+    finally:
+        aws.close_connections()
+        server.shutdown()
+        server.server_close()
+
+def test_converse_stream():
+    server = start_server()
+    try:
+        env = dict(CLEAN_ENV)
+        env['AWS_ACCESS_KEY_ID'] = 'AKID'
+        env['AWS_SECRET_ACCESS_KEY'] = 'SECRET'
+        with patch.dict(os.environ, env):
+            client = BedrockRuntimeClient(region='us-east-1', endpoint_url='http://127.0.0.1:{}'.format(server.server_port))
+            events = list(client.converse_stream('amazon.nova-micro-v1:0', {'messages': []}))
+            assert events == [
+                ('contentBlockDelta', {'delta': {'text': 'Hel'}}),
+                ('contentBlockDelta', {'delta': {'text': 'lo'}}),
+                ('metadata', {'usage': {'totalTokens': 2}}),
+            ]
+            received = []
+            try:
+                for event in client.converse_stream('throttled', {'messages': []}):
+                    received.append(event)
+                assert False, 'expected AWSError'
+            except AWSError as e:
+                assert e.code == 'ThrottlingException'
+                assert e.message == 'Too many requests'
+            assert len(received) == 2
+        assert server.requests[0][0] == '/model/amazon.nova-micro-v1%3A0/converse-stream'
+        assert server.requests[0][1]['Accept'] == 'application/vnd.amazon.eventstream'
+    finally:
+        aws.close_connections()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,198 @@
+"""Local stand-in for an OpenAI compatible API used by the benchmarks.
+
+Serves `/chat/completions` (streaming and non-streaming) and
+`/images/generations` on a random localhost port. Latency, streaming
+rate, errors and stalls are configurable. It can also run as a separate
+process, so that its CPU time does not count towards the client's:
+
+    python tests/benchmarks/mock_server.py --tokens 2000 --tokens-per-second 100
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+# words of the generated responses, one word is one token
+WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit']
+WORDS_PER_LINE = 12
+
+def make_stream_chunk(content):
+    return { 'choices': [{ 'delta': { 'content': content } }] }
+
+def make_error(message, status):
+    return { 'error': { 'message': message, 'type': 'mock_error', 'code': status } }
+
+def make_token_chunks(tokens, chunk_size=1):
+    """Splits a response of `tokens` words into chunks of chunk_size tokens"""
+    words = []
+    for i in range(tokens):
+        separator = '\n' if i and i % WORDS_PER_LINE == 0 else ' '
+        words.append((separator if i else '') + WORDS[i % len(WORDS)])
+    return [''.join(words[i:i + chunk_size]) for i in range(0, tokens, chunk_size)]
+
+class MockOpenAIServer(object):
+    """Serves canned responses, options:
+
+    - latency: seconds before the response headers are sent
+    - first_chunk_delay: seconds between the headers and the first chunk
+    - chunk_delay: fixed pause between chunks
+    - tokens_per_second: paces the stream, each chunk counts as chunk_tokens tokens
+    - error_every: every n-th request fails with error_status
+    - stall_after/stall_time: pauses the stream once after that many chunks
+    - abort_after: closes the connection after that many chunks, without [DONE]
+    """
+    def __init__(self, chunks=None, first_chunk_delay=0.0, chunk_delay=0.0, image_b64='aGVsbG8=',
+                 latency=0.0, tokens_per_second=0, chunk_tokens=1, error_every=0, error_status=500,
+                 stall_after=None, stall_time=0.0, abort_after=None):
+        self.chunks = chunks if chunks is not None else ['Hello', ' world', '!']
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_delay = chunk_delay
+        self.image_b64 = image_b64
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.chunk_tokens = chunk_tokens
+        self.error_every = error_every
+        self.error_status = error_status
+        self.stall_after = stall_after
+        self.stall_time = stall_time
+        self.abort_after = abort_after
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def _register_request(self, path, body):
+        """Records the request, returns True if it should fail"""
+        with self._lock:
+            self.requests.append({ 'path': path, 'body': body })
+            count = len(self.requests)
+        return bool(self.error_every) and count % self.error_every == 0
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+                should_fail = server._register_request(self.path, body)
+                time.sleep(server.latency)
+                if should_fail:
+                    self._send_json(make_error('injected error', server.error_status), server.error_status)
+                elif self.path.endswith('/images/generations'):
+                    self._send_json({ 'data': [{ 'b64_json': server.image_b64 }] })
+                elif body.get('stream'):
+                    self._send_stream()
+                else:
+                    content = ''.join(server.chunks)
+                    self._send_json({ 'choices': [{ 'message': { 'content': content } }] })
+
+            def _send_json(self, data, status=200):
+                payload = json.dumps(data).encode('utf-8')
+                time.sleep(server.first_chunk_delay)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_stream(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                time.sleep(server.first_chunk_delay)
+                started = time.perf_counter()
+                for i, content in enumerate(server.chunks):
+                    if i == server.abort_after:
+                        self.close_connection = True
+                        return
+                    if i and i == server.stall_after:
+                        time.sleep(server.stall_time)
+                        started += server.stall_time
+                    if i and server.chunk_delay:
+                        time.sleep(server.chunk_delay)
+                    if i and server.tokens_per_second:
+                        # sleeps until the chunk is due, so slow writes do not lower the rate
+                        due = started + i * server.chunk_tokens / server.tokens_per_second
+                        time.sleep(max(due - time.perf_counter(), 0))
+                    line = 'data: ' + json.dumps(make_stream_chunk(content)) + '\n\n'
+                    self.wfile.write(line.encode('utf-8'))
+                    self.wfile.flush()
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self):
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local OpenAI compatible mock server')
+    parser.add_argument('--tokens', type=int, default=1000, help='tokens (words) of each response')
+    parser.add_argument('--chunk-size', type=int, default=1, help='tokens per streamed chunk')
+    parser.add_argument('--tokens-per-second', type=float, default=0, help='0 streams as fast as possible')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--first-chunk-delay', type=float, default=0.0)
+    parser.add_argument('--error-every', type=int, default=0)
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--stall-after', type=int)
+    parser.add_argument('--stall-time', type=float, default=0.0)
+    parser.add_argument('--abort-after', type=int)
+    args = parser.parse_args(argv)
+
+    server = MockOpenAIServer(
+        chunks=make_token_chunks(args.tokens, args.chunk_size),
+        first_chunk_delay=args.first_chunk_delay,
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        chunk_tokens=args.chunk_size,
+        error_every=args.error_every,
+        error_status=args.error_status,
+        stall_after=args.stall_after,
+        stall_time=args.stall_time,
+        abort_after=args.abort_after,
+    ).start()
+    # the first line tells the parent process where to connect
+    print(server.url)
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
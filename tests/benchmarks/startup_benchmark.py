@@ -0,0 +1,214 @@
+"""Startup and first-command latency benchmarks.
+
+Uses the `tests/vim.py` mock and a local stand-in OpenAI server, results are
+written as JSON so that they can be compared across commits:
+
+    python tests/benchmarks/startup_benchmark.py --output before.json
+    python tests/benchmarks/startup_benchmark.py --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+tests_dir = os.path.dirname(benchmarks_dir)
+root_dir = os.path.dirname(tests_dir)
+for path in (root_dir, tests_dir):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from benchmarks.mock_server import MockOpenAIServer
+
+IMPORT_SCENARIOS = [
+    ('core', ['vim_ai.utils', 'vim_ai.context']),
+    ('complete', ['vim_ai.utils', 'vim_ai.context', 'vim_ai.complete']),
+    ('chat', ['vim_ai.utils', 'vim_ai.context', 'vim_ai.chat']),
+    ('image', ['vim_ai.utils', 'vim_ai.context', 'vim_ai.image']),
+    ('roles', ['vim_ai.utils', 'vim_ai.roles']),
+    ('provider-openai', ['vim_ai.providers.openai']),
+]
+
+ROLE_SCENARIOS = [
+    ('no-roles', 'hello'),
+    ('one-role', '/test-role hello'),
+    ('four-roles', '/test-role /test-role-simple /deprecated-test-role /all_params hello'),
+]
+
+INCLUDE_SCENARIOS = [
+    ('no-include', []),
+    ('one-file', ['tests/resources/test1.include.txt']),
+    ('glob', ['tests/resources/*.txt']),
+    ('image', ['tests/resources/image_file.jpg']),
+]
+
+CHAT_CONFIG = {
+    'options': {
+        'model': 'gpt-4o',
+        'endpoint_url': 'http://localhost/chat/completions',
+        'max_tokens': '0',
+        'temperature': '1',
+        'request_timeout': '20',
+        'stream': '1',
+        'auth_type': 'none',
+        'token_file_path': '',
+        'token_load_fn': '',
+        'selection_boundary': '',
+        'initial_prompt': '>>> system\nYou are a general assistant.',
+    },
+    'ui': {
+        'open_chat_command': 'preset_below',
+        'paste_mode': '1',
+    },
+}
+
+def summarize(samples):
+    samples = sorted(samples)
+    middle = len(samples) // 2
+    median = samples[middle] if len(samples) % 2 else (samples[middle - 1] + samples[middle]) / 2
+    return {
+        'min_ms': samples[0] * 1000,
+        'median_ms': median * 1000,
+        'mean_ms': sum(samples) / len(samples) * 1000,
+        'samples': len(samples),
+    }
+
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def bench_cold_imports(repeat):
+    results = {}
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join([root_dir, tests_dir])
+    for name, modules in IMPORT_SCENARIOS:
+        code = (
+            "import time\n"
+            "start = time.perf_counter()\n"
+            "import {}\n"
+            "print(time.perf_counter() - start)\n"
+        ).format(', '.join(modules))
+        samples = []
+        for _ in range(repeat):
+            output = subprocess.check_output([sys.executable, '-c', code], cwd=root_dir, env=env)
+            samples.append(float(output.decode('utf-8').strip().splitlines()[-1]))
+        results['import.cold.' + name] = summarize(samples)
+    return results
+
+def _reset_caches():
+    from vim_ai import context, utils
+    context._role_config_cache.clear()
+    context._final_config_cache.clear()
+    utils._role_files_cache['key'] = None
+
+def bench_context_build(repeat):
+    from vim_ai.context import make_ai_context
+    from vim_ai.utils import parse_chat_messages
+
+    results = {}
+    for name, instruction in ROLE_SCENARIOS:
+        params = {
+            'config_default': CHAT_CONFIG,
+            'config_extension': {},
+            'user_instruction': instruction,
+            'user_selection': 'selected text',
+            'command_type': 'chat',
+        }
+        def cold():
+            _reset_caches()
+            make_ai_context(params)
+        results['context.cold.' + name] = summarize(measure(cold, repeat))
+        results['context.warm.' + name] = summarize(measure(lambda: make_ai_context(params), repeat))
+
+    for name, paths in INCLUDE_SCENARIOS:
+        chat_content = ">>> user\n\nexplain the files\n"
+        if paths:
+            chat_content += "\n>>> include\n\n" + "\n".join(os.path.join(root_dir, p) for p in paths) + "\n"
+        results['messages.' + name] = summarize(measure(lambda: parse_chat_messages(chat_content), repeat))
+    return results
+
+def bench_first_chunk(repeat):
+    from vim_ai.config_snapshot import load_config_snapshot
+    from vim_ai.providers.openai import OpenAIProvider
+    from vim_ai.utils import AIProviderUtils
+
+    first_chunk_samples = []
+    total_samples = []
+    messages = [{ 'role': 'user', 'content': [{ 'type': 'text', 'text': 'hello' }] }]
+    with MockOpenAIServer(chunks=['token '] * 50) as server:
+        options = dict(CHAT_CONFIG['options'])
+        options['endpoint_url'] = server.url + '/chat/completions'
+        load_config_snapshot({ 'vim_ai_openai_chat': options })
+        for _ in range(repeat):
+            start = time.perf_counter()
+            provider = OpenAIProvider('chat', {}, AIProviderUtils())
+            first_chunk_at = None
+            for chunk in provider.request([dict(m) for m in messages]):
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+            first_chunk_samples.append(first_chunk_at - start)
+            total_samples.append(time.perf_counter() - start)
+    return {
+        'openai.first_chunk': summarize(first_chunk_samples),
+        'openai.total': summarize(total_samples),
+    }
+
+def run_benchmarks(repeat=10, import_repeat=5):
+    results = {}
+    results.update(bench_cold_imports(import_repeat))
+    results.update(bench_context_build(repeat))
+    results.update(bench_first_chunk(repeat))
+    return {
+        'python': platform.python_version(),
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'results': results,
+    }
+
+def _git_commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root_dir, stderr=subprocess.DEVNULL)
+        return output.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def format_report(report, baseline=None):
+    lines = []
+    baseline_results = baseline['results'] if baseline else {}
+    for name in sorted(report['results']):
+        median = report['results'][name]['median_ms']
+        line = '{:<32} {:>10.3f} ms'.format(name, median)
+        if name in baseline_results:
+            before = baseline_results[name]['median_ms']
+            change = (median - before) / before * 100 if before else 0.0
+            line += '  {:>10.3f} ms  {:+7.1f}%'.format(before, change)
+        lines.append(line)
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--import-repeat', type=int, default=5)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.repeat, args.import_repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
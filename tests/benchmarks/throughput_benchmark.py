@@ -0,0 +1,189 @@
+"""End-to-end chat streaming throughput benchmark.
+
+Streams responses of the local mock server through OpenAIProvider,
+AI_chat_job and the pool's pickup_lines, the way the chat watcher timer
+does, and reports sustained chunks per second and CPU time per token.
+The server runs in a separate process unless --in-process is given:
+
+    python tests/benchmarks/throughput_benchmark.py --tokens 5000 --chunk-size 1
+    python tests/benchmarks/throughput_benchmark.py --tokens-per-second 200 --stall-after 100 --stall-time 1
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+tests_dir = os.path.dirname(benchmarks_dir)
+root_dir = os.path.dirname(tests_dir)
+for path in (root_dir, tests_dir):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from benchmarks.mock_server import MockOpenAIServer, make_token_chunks
+from benchmarks.startup_benchmark import CHAT_CONFIG, summarize
+
+# s:chat_redraw_interval of the chat watcher
+REDRAW_INTERVAL = 0.25
+
+def summarize_rate(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    median = values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+    return { 'min': values[0], 'median': median, 'max': values[-1], 'samples': len(values) }
+
+class ServerProcess(object):
+    """Runs mock_server.py in a child process, its CPU time is not measured"""
+    def __init__(self, server_args):
+        self.server_args = server_args
+        self.process = None
+        self.url = None
+
+    def __enter__(self):
+        command = [sys.executable, os.path.join(benchmarks_dir, 'mock_server.py')] + self.server_args
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        self.url = self.process.stdout.readline().decode('utf-8').strip()
+        if not self.url:
+            self.process.kill()
+            raise RuntimeError('mock server did not start')
+        return self
+
+    def __exit__(self, *args):
+        self.process.terminate()
+        self.process.wait()
+        self.process.stdout.close()
+
+class CountingProvider(object):
+    """Counts chunks the job receives from the wrapped provider"""
+    def __init__(self, provider):
+        self.provider = provider
+        self.chunks = 0
+        self.first_chunk_at = None
+        self.last_chunk_at = None
+
+    def request(self, messages):
+        for chunk in self.provider.request(messages):
+            now = time.perf_counter()
+            if self.first_chunk_at is None:
+                self.first_chunk_at = now
+            self.last_chunk_at = now
+            self.chunks += 1
+            yield chunk
+
+def run_chat_stream(url, redraw_interval=REDRAW_INTERVAL, bufnr=1):
+    """Streams a single chat response, returns its measurements"""
+    from vim_ai.chat import AI_chat_jobs_pool
+    from vim_ai.config_snapshot import load_config_snapshot
+    from vim_ai.providers.openai import OpenAIProvider
+    from vim_ai.utils import AIProviderUtils
+
+    options = dict(CHAT_CONFIG['options'])
+    options['endpoint_url'] = url + '/chat/completions'
+    load_config_snapshot({ 'vim_ai_openai_chat': options, 'vim_ai_debug': '0' })
+    messages = [{ 'role': 'user', 'content': [{ 'type': 'text', 'text': 'hello' }] }]
+
+    pool = AI_chat_jobs_pool()
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    provider = CountingProvider(OpenAIProvider('chat', {}, AIProviderUtils()))
+    pool.new_job({ 'bufnr': bufnr }, messages, provider)
+    lines = []
+    flushes = 0
+    while True:
+        time.sleep(redraw_interval)
+        # the watcher checks the job first, so no lines are lost
+        done = pool.is_job_done(bufnr)
+        lines.extend(pool.pickup_lines(bufnr))
+        flushes += 1
+        if done:
+            break
+    end = time.perf_counter()
+    cpu_time = time.process_time() - cpu_start
+
+    stream_time = None
+    if provider.first_chunk_at is not None and provider.last_chunk_at > provider.first_chunk_at:
+        stream_time = provider.last_chunk_at - provider.first_chunk_at
+    return {
+        'chunks': provider.chunks,
+        'lines': len(lines),
+        'flushes': flushes,
+        'error': any(line.startswith('<<< error') for line in lines),
+        'first_chunk_time': provider.first_chunk_at - start if provider.first_chunk_at else None,
+        'stream_time': stream_time,
+        'total_time': end - start,
+        'cpu_time': cpu_time,
+    }
+
+def run_throughput(url, repeat, chunk_size=1, redraw_interval=REDRAW_INTERVAL):
+    runs = [run_chat_stream(url, redraw_interval) for _ in range(repeat)]
+    ok_runs = [run for run in runs if not run['error'] and run['chunks']]
+    report = {
+        'runs': len(runs),
+        'errors': len(runs) - len(ok_runs),
+    }
+    rated = [run for run in ok_runs if run['stream_time']]
+    if rated:
+        report['chunks_per_second'] = summarize_rate([run['chunks'] / run['stream_time'] for run in rated])
+    if ok_runs:
+        report['cpu_us_per_token'] = summarize_rate([run['cpu_time'] * 1000000 / (run['chunks'] * chunk_size) for run in ok_runs])
+        report['first_chunk'] = summarize([run['first_chunk_time'] for run in ok_runs])
+        report['total'] = summarize([run['total_time'] for run in ok_runs])
+        report['chunks'] = ok_runs[-1]['chunks']
+        report['lines'] = ok_runs[-1]['lines']
+    return report
+
+def format_report(report):
+    lines = ['runs: {}, errors: {}'.format(report['runs'], report['errors'])]
+    if 'chunks_per_second' in report:
+        lines.append('sustained chunks/s: {:.0f} (min {:.0f})'.format(
+            report['chunks_per_second']['median'], report['chunks_per_second']['min']))
+    if 'cpu_us_per_token' in report:
+        lines.append('CPU per token:      {:.1f} us'.format(report['cpu_us_per_token']['median']))
+        lines.append('first chunk:        {:.1f} ms'.format(report['first_chunk']['median_ms']))
+        lines.append('total:              {:.1f} ms'.format(report['total']['median_ms']))
+        lines.append('chunks/lines:       {}/{}'.format(report['chunks'], report['lines']))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tokens', type=int, default=2000)
+    parser.add_argument('--chunk-size', type=int, default=1)
+    parser.add_argument('--tokens-per-second', type=float, default=0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-every', type=int, default=0)
+    parser.add_argument('--stall-after', type=int)
+    parser.add_argument('--stall-time', type=float, default=0.0)
+    parser.add_argument('--redraw-interval', type=float, default=REDRAW_INTERVAL)
+    parser.add_argument('--in-process', action='store_true', help='run the server in this process')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    server_options = {
+        'tokens_per_second': args.tokens_per_second,
+        'latency': args.latency,
+        'error_every': args.error_every,
+        'stall_after': args.stall_after,
+        'stall_time': args.stall_time,
+    }
+    if args.in_process:
+        server = MockOpenAIServer(
+            chunks=make_token_chunks(args.tokens, args.chunk_size), chunk_tokens=args.chunk_size, **server_options)
+    else:
+        server_args = ['--tokens', str(args.tokens), '--chunk-size', str(args.chunk_size)]
+        for key, value in server_options.items():
+            if value is not None:
+                server_args.extend(['--' + key.replace('_', '-'), str(value)])
+        server = ServerProcess(server_args)
+
+    with server:
+        report = run_throughput(server.url, args.repeat, args.chunk_size, args.redraw_interval)
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+from benchmarks import startup_benchmark, throughput_benchmark
+from benchmarks.mock_server import MockOpenAIServer, make_stream_chunk, make_token_chunks
+from vim_ai import config_snapshot
+import json
+import time
+import urllib.error
+import urllib.request
+
+def post_stream(server):
+    req = urllib.request.Request(
+        server.url + '/chat/completions',
+        data=json.dumps({ 'stream': True }).encode('utf-8'),
+        headers={ 'Content-Type': 'application/json' },
+        method='POST',
+    )
+    with urllib.request.urlopen(req) as response:
+        return response.read().decode('utf-8')
+
+def test_mock_server_streams_chunks():
+    with MockOpenAIServer(chunks=['Hello', ' world']) as server:
+        body = post_stream(server)
+    assert 'data: ' + json.dumps(make_stream_chunk('Hello')) in body
+    assert body.rstrip().endswith('data: [DONE]')
+    assert len(server.requests) == 1
+
+def test_startup_benchmark_smoke():
+    try:
+        results = {}
+        results.update(startup_benchmark.bench_context_build(1))
+        results.update(startup_benchmark.bench_first_chunk(1))
+    finally:
+        config_snapshot._snapshot = None
+    assert 'context.warm.one-role' in results
+    assert 'messages.glob' in results
+    assert results['openai.first_chunk']['median_ms'] <= results['openai.total']['median_ms']
+
+def test_make_token_chunks():
+    chunks = make_token_chunks(26, 4)
+    assert len(chunks) == 7
+    text = ''.join(chunks)
+    assert len(text.split()) == 26
+    assert text.count('\n') == 2
+
+def test_mock_server_paces_stalls_and_aborts():
+    chunks = make_token_chunks(10)
+    with MockOpenAIServer(chunks=chunks, tokens_per_second=200, stall_after=5, stall_time=0.05, abort_after=8) as server:
+        start = time.perf_counter()
+        body = post_stream(server)
+        elapsed = time.perf_counter() - start
+    # 7 paced intervals of 5 ms and the stall
+    assert elapsed >= 0.08
+    assert body.count('data: ') == 8
+    assert '[DONE]' not in body
+
+def test_mock_server_injects_errors():
+    with MockOpenAIServer(error_every=2, error_status=429) as server:
+        post_stream(server)
+        try:
+            post_stream(server)
+            assert False, 'expected HTTPError'
+        except urllib.error.HTTPError as error:
+            assert error.code == 429
+            assert json.loads(error.read().decode('utf-8'))['error']['message'] == 'injected error'
+    assert len(server.requests) == 2
+
+def test_throughput_benchmark_smoke():
+    try:
+        with MockOpenAIServer(chunks=make_token_chunks(100, 2), chunk_tokens=2, error_every=2) as server:
+            report = throughput_benchmark.run_throughput(server.url, 2, chunk_size=2, redraw_interval=0.01)
+    finally:
+        config_snapshot._snapshot = None
+    assert report['runs'] == 2
+    assert report['errors'] == 1
+    assert report['chunks'] == 50
+    assert report['lines'] > 8
+    assert report['chunks_per_second']['median'] > 0
+    assert report['cpu_us_per_token']['median'] > 0
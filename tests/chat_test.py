@@ -1,4 +1,4 @@
-from vim_ai.utils import parse_chat_messages
+from vim_ai.utils import parse_chat_messages, parse_chat_header_config, find_last_chat_role
 import os
 
 dirname = os.path.dirname(__file__)
@@ -386,3 +386,53 @@ def test_parse_include_unsupported_binary_file():
             ],
         },
     ] == actual_messages
+
+def test_find_last_chat_role():
+    lines = strip_text("""
+    >>> user
+
+    generate lorem ipsum
+
+    <<< assistant
+
+    bla >>> user is not a role
+    bla bla bla
+    """).splitlines()
+    assert 'assistant' == find_last_chat_role(lines)
+    assert 'user' == find_last_chat_role(lines[:3])
+    assert None == find_last_chat_role(['just some text'])
+
+def test_parse_chat_header_config_from_lines():
+    lines = strip_text("""
+    [chat]
+    provider=bedrock
+    options.model=gpt-4o
+    options.initial_prompt=>>> system\\nbe brief
+    ui.paste_mode=0
+
+    >>> user
+
+    hello
+    """).splitlines()
+    config = parse_chat_header_config(lines)
+    assert 'bedrock' == config['provider']
+    assert 'gpt-4o' == config['options']['model']
+    assert ['>>> system', 'be brief'] == config['options']['initial_prompt']
+    assert '0' == config['ui']['paste_mode']
+
+def test_chat_job_pool_releases_finished_job():
+    from vim_ai.chat import AI_chat_jobs_pool
+
+    class FakeProvider():
+        def request(self, messages):
+            yield { 'type': 'assistant', 'content': 'Hello\nworld' }
+
+    pool = AI_chat_jobs_pool()
+    job = pool.new_job({ 'bufnr': 7 }, [], FakeProvider())
+    job.join(5)
+    assert pool.is_job_done(7) is True
+    lines = pool.pickup_lines(7)
+    assert lines == ['', '<<< assistant', '', 'Hello', 'world', '', '>>> user', '', '']
+    assert 7 not in pool.pool
+    assert pool.pickup_lines(7) == []
+    assert pool.is_job_done(7) is True
@@ -0,0 +1,27 @@
+from vim_ai import config_snapshot
+from vim_ai.config_snapshot import load_config_snapshot, get_config_version, get_vim_global
+from unittest.mock import patch
+
+def test_snapshot_values():
+    original_snapshot = config_snapshot._snapshot
+    try:
+        version = get_config_version()
+        load_config_snapshot({ 'vim_ai_debug': '1', 'vim_ai_chat': { 'options': {} } })
+        assert get_config_version() == version + 1
+        with patch('vim_ai.config_snapshot.vim.eval') as mock_eval:
+            assert get_vim_global('g:vim_ai_debug') == '1'
+            assert get_vim_global('g:vim_ai_chat') == { 'options': {} }
+            assert get_vim_global('g:vim_ai_missing', 'default') == 'default'
+            mock_eval.assert_not_called()
+    finally:
+        config_snapshot._snapshot = original_snapshot
+
+def test_fallback_without_snapshot():
+    original_snapshot = config_snapshot._snapshot
+    try:
+        config_snapshot._snapshot = None
+        with patch('vim_ai.config_snapshot.vim.eval', return_value='0') as mock_eval:
+            assert get_vim_global('g:vim_ai_missing', {}) == {}
+            mock_eval.assert_called_once_with("exists('g:vim_ai_missing')")
+    finally:
+        config_snapshot._snapshot = original_snapshot
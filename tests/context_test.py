@@ -1,4 +1,4 @@
-from vim_ai.context import make_ai_context, make_prompt
+from vim_ai.context import make_ai_context, make_prompt, merge_deep
 from unittest.mock import patch
 import vim
 
@@ -244,3 +244,68 @@ def test_role_config_all_params():
     assert actual_options['top_logprobs'] == '5'
     assert actual_options['top_p'] == '0.9'
 
+
+def test_merge_deep_copy_on_write():
+    first = {'options': {'model': 'a', 'nested': {'x': '1'}}, 'ui': {'paste_mode': '1'}}
+    second = {'options': {'nested': {'y': '2'}}}
+    result = merge_deep([first, second])
+    assert result == {'options': {'model': 'a', 'nested': {'x': '1', 'y': '2'}}, 'ui': {'paste_mode': '1'}}
+    # inputs are not modified, untouched branches are shared
+    assert first == {'options': {'model': 'a', 'nested': {'x': '1'}}, 'ui': {'paste_mode': '1'}}
+    assert second == {'options': {'nested': {'y': '2'}}}
+    assert result['ui'] is first['ui']
+
+def test_memoized_config():
+    params = {
+        'config_default': default_config,
+        'config_extension': {},
+        'user_instruction': '/test-role /test-role-simple hello',
+        'user_selection': '',
+        'command_type': 'chat',
+    }
+    first_config = make_ai_context(params)['config']
+    assert first_config is make_ai_context(params)['config']
+
+    params['config_extension'] = {'options': {'max_tokens': '1000'}}
+    extended_config = make_ai_context(params)['config']
+    assert extended_config is not first_config
+    assert '1000' == extended_config['options']['max_tokens']
+    assert 'o1-preview' == extended_config['options']['model']
+
+def test_role_config_memoized_across_roles_function_ttl():
+    from vim_ai import context, utils
+    from vim_ai.context import resolve_role_config
+    role_files = context.read_role_files()
+    options = { 'g:vim_ai_roles_config_function': 'CustomRoles', 'g:vim_ai_roles_config_function_ttl': '1' }
+    # vim returns an equal, but new dict on every call of the roles function
+    evals = lambda cmd: '1' if cmd.startswith('exists') else { 'custom': { 'options.model': 'custom-model' } }
+    now = [1000.0]
+    utils._roles_config_function_cache.update({ 'name': None, 'expires_at': 0, 'roles': {} })
+    context._role_config_cache.clear()
+    with patch('vim_ai.context.read_role_files', return_value=role_files), \
+         patch('vim_ai.utils.get_vim_global', side_effect=lambda name, default=None: options.get(name, default)), \
+         patch('vim_ai.utils.vim.eval', side_effect=evals) as vim_eval, \
+         patch('vim_ai.utils.time.time', side_effect=lambda: now[0]), \
+         patch('vim_ai.context.load_role_config', wraps=context.load_role_config) as load_role:
+        first = resolve_role_config(['custom'], 'chat')
+        now[0] += 2
+        assert resolve_role_config(['custom'], 'chat') is first
+    assert vim_eval.call_count == 4  # the roles function was called again
+    assert load_role.call_count == 2  # default and custom role, merged once
+    assert first['options']['model'] == 'custom-model'
+    utils._roles_config_function_cache.update({ 'name': None, 'expires_at': 0, 'roles': {} })
+    context._role_config_cache.clear()
+
+def test_retrieval_query_excludes_role_prompt():
+    from vim_ai.context import enhance_prompt_with_context
+    evals = { 'expand("%:p")': '/project/app.py', '&filetype': 'python', 'getcwd()': '/project' }
+    with patch('vim_ai.context.vim.eval', side_effect=lambda cmd: evals.get(cmd, '0')), \
+         patch('vim_ai.context.get_project_index') as project_index, \
+         patch('vim_ai.context.get_vim_global', side_effect=lambda name, default=None: '1' if name == 'g:vim_ai_context_retrieval' else default), \
+         patch('vim_ai.context.find_relevant_chunks', return_value=[]) as find_chunks:
+        project_index.return_value.find_files.return_value = []
+        prompt = 'You are a code assistant, help with refactoring:\nfix the parser\nselected code'
+        enhance_prompt_with_context(prompt, ['codebase'], 'chat', 'fix the parser\nselected code')
+    args, kwargs = find_chunks.call_args
+    assert args[1] == 'fix the parser\nselected code'
+    assert kwargs['exclude_text'] == prompt
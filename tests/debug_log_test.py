@@ -0,0 +1,70 @@
+import base64
+import os
+import tempfile
+
+from vim_ai import debug_log
+from vim_ai.debug_log import format_message, redact, write_log, flush_log, close_log
+
+def test_redact_base64_and_long_values():
+    image = 'data:image/png;base64,' + base64.b64encode(os.urandom(3000)).decode()
+    payload = {
+        'messages': [{ 'content': [{ 'image_url': { 'url': image } }, { 'text': 'hi' }] }],
+        'body': b'raw',
+        'long': 'x' * 50,
+    }
+    redacted = redact(payload, max_length=20)
+    assert redacted['messages'][0]['content'][0]['image_url']['url'] == '<base64 redacted, {} chars>'.format(len(image))
+    assert redacted['messages'][0]['content'][1]['text'] == 'hi'
+    assert redacted['body'] == '<3 bytes>'
+    assert redacted['long'] == 'x' * 20 + '... <truncated, 50 chars>'
+    # the original payload is untouched
+    assert payload['long'] == 'x' * 50
+
+def test_format_message_is_lazy():
+    calls = []
+    def expensive():
+        calls.append(1)
+        return 'value'
+    assert format_message('a {} b', [expensive]) == 'a value b'
+    assert calls == [1]
+    # braces in the text are kept when there is nothing to format
+    assert format_message('{literal}', []) == '{literal}'
+
+def test_print_debug_skips_formatting_when_off():
+    import vim_ai.utils
+    original_debug = vim_ai.utils._vimai_thread_is_debug_active
+    vim_ai.utils._vimai_thread_is_debug_active = False
+    try:
+        vim_ai.utils.print_debug('{}', lambda: 1 / 0)
+    finally:
+        vim_ai.utils._vimai_thread_is_debug_active = original_debug
+
+def test_debug_level_filter():
+    import vim_ai.utils
+    original = (vim_ai.utils._vimai_thread_is_debug_active, vim_ai.utils._vimai_thread_debug_level)
+    try:
+        vim_ai.utils._vimai_thread_is_debug_active = True
+        vim_ai.utils._vimai_thread_debug_level = debug_log.LEVELS['error']
+        assert not vim_ai.utils.is_debug_enabled('debug')
+        assert vim_ai.utils.is_debug_enabled('error')
+    finally:
+        vim_ai.utils._vimai_thread_is_debug_active, vim_ai.utils._vimai_thread_debug_level = original
+
+def test_writer_buffers_and_rotates():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'debug.log')
+        try:
+            # lines queued together are written in one batch, each round rotates the log
+            for round in range(4):
+                for i in range(15):
+                    write_log(path, 'info', 'message {}', [i], max_size=500, backups=2)
+                flush_log()
+        finally:
+            close_log()
+        assert os.path.exists(path + '.1')
+        assert os.path.exists(path + '.2')
+        assert not os.path.exists(path + '.3')
+        with open(path + '.1') as f:
+            lines = f.read().splitlines()
+        assert all('] INFO: message ' in line for line in lines)
+        assert os.path.getsize(path + '.1') >= 500
@@ -0,0 +1,77 @@
+import os
+import subprocess
+import tempfile
+import time
+
+import vim_ai.git_context as git_context
+from vim_ai.git_context import find_git_dir, get_git_context, run_git_lines
+
+def git(cwd, *args):
+    subprocess.check_call(
+        ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + list(args),
+        cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+def write(root, name, content):
+    with open(os.path.join(root, name), 'w') as f:
+        f.write(content)
+
+def make_repo(root):
+    git(root, 'init', '-q', '-b', 'main')
+    write(root, 'a.txt', 'a\n')
+    git(root, 'add', 'a.txt')
+    git(root, 'commit', '-q', '-m', 'init')
+
+def test_find_git_dir_from_subdirectory():
+    with tempfile.TemporaryDirectory() as root:
+        make_repo(root)
+        os.makedirs(os.path.join(root, 'sub', 'dir'))
+        work_tree, git_dir = find_git_dir(os.path.join(root, 'sub', 'dir'))
+        assert work_tree == os.path.abspath(root)
+        assert git_dir == os.path.join(os.path.abspath(root), '.git')
+
+def test_run_git_lines_stops_reading_at_limit():
+    with tempfile.TemporaryDirectory() as root:
+        make_repo(root)
+        for i in range(30):
+            write(root, 'untracked{:02}.txt'.format(i), '')
+        lines = run_git_lines(['ls-files', '--others'], root, max_lines=5)
+        assert lines == ['untracked{:02}.txt'.format(i) for i in range(5)]
+
+def test_git_context_is_cached_until_index_changes():
+    git_context.invalidate_git_context()
+    with tempfile.TemporaryDirectory() as root:
+        make_repo(root)
+        write(root, 'a.txt', 'changed\n')
+        write(root, 'new.txt', 'new\n')
+
+        lines = get_git_context(root)
+        assert lines[0] == 'Git branch: main'
+        assert 'Git changes:' in lines
+        assert any(line.startswith('  a.txt') for line in lines)
+        assert lines[-2:] == ['Untracked files:', '  new.txt']
+
+        write(root, 'other.txt', 'other\n')
+        assert get_git_context(root) is lines
+
+        git(root, 'add', 'other.txt')
+        assert '  other.txt' not in get_git_context(root)
+    git_context.invalidate_git_context()
+
+def test_git_context_background_refresh():
+    git_context.invalidate_git_context()
+    with tempfile.TemporaryDirectory() as root:
+        make_repo(root)
+        # nothing cached yet, the command does not wait for git
+        assert get_git_context(root, background=True) is None
+        deadline = time.time() + 5
+        lines = None
+        while lines is None and time.time() < deadline:
+            time.sleep(0.01)
+            lines = get_git_context(root, background=True)
+        assert lines == ['Git branch: main']
+    git_context.invalidate_git_context()
+
+def test_no_git_context_outside_repository():
+    with tempfile.TemporaryDirectory() as root:
+        assert get_git_context(root) is None
@@ -0,0 +1,92 @@
+import base64
+import os
+import tempfile
+import threading
+import time
+
+import vim_ai.image as image
+from vim_ai.image import ai_image_job_pool, make_image_path
+from vim_ai.utils import KnownError
+
+class FakeImageProvider():
+    def __init__(self, images=1, error=None, gate=None):
+        self.images = images
+        self.error = error
+        self.gate = gate
+
+    def request_image(self, prompt):
+        if self.gate:
+            self.gate.wait(5)
+        if self.error:
+            raise self.error
+        for index in range(self.images):
+            yield { 'b64_data': base64.b64encode('{}:{}'.format(prompt, index).encode()).decode() }
+
+def wait_for_batch(batch_id):
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        status = ai_image_job_pool.get_status(batch_id)
+        if status['done']:
+            return status
+        time.sleep(0.01)
+    raise AssertionError('image batch did not finish')
+
+def test_make_image_path_index_suffix():
+    ui = { 'download_dir': '/tmp' }
+    assert make_image_path(ui, '20250101T000000Z') == '/tmp/vim_ai_20250101T000000Z.png'
+    assert make_image_path(ui, '20250101T000000Z', 2) == '/tmp/vim_ai_20250101T000000Z_3.png'
+
+def test_image_batch_runs_jobs_concurrently():
+    gate = threading.Event()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        providers = [FakeImageProvider(images=2, gate=gate) for _ in range(3)]
+        batch_id = ai_image_job_pool.new_batch({ 'download_dir': tmp_dir }, 'fake', 'cat', providers)
+
+        status = ai_image_job_pool.get_status(batch_id)
+        assert status['done'] == 0
+        assert status['total'] == 3
+        gate.set()
+
+        status = wait_for_batch(batch_id)
+        assert status['finished'] == 3
+        assert status['error'] == 0
+        assert len(status['messages']) == 6
+        files = sorted(os.listdir(tmp_dir))
+        assert len(files) == 6
+        assert not any(name.endswith('.part') for name in files)
+        contents = set()
+        for name in files:
+            with open(os.path.join(tmp_dir, name), 'rb') as f:
+                contents.add(f.read())
+        assert contents == { 'cat:0'.encode(), 'cat:1'.encode() }
+
+def test_image_batches_of_several_prompts_run_concurrently():
+    # both requests have to be in flight at once to pass the barrier
+    gate = threading.Barrier(2, timeout=5)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ui = { 'download_dir': tmp_dir }
+        batch_ids = [ai_image_job_pool.new_batch(ui, 'fake', prompt, [FakeImageProvider(gate=gate)]) for prompt in ('cat', 'dog')]
+        for batch_id in batch_ids:
+            assert wait_for_batch(batch_id)['error'] == 0
+        contents = set()
+        for name in os.listdir(tmp_dir):
+            with open(os.path.join(tmp_dir, name), 'rb') as f:
+                contents.add(f.read())
+        assert contents == { 'cat:0'.encode(), 'dog:0'.encode() }
+
+def test_image_batch_reports_errors():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        providers = [FakeImageProvider(), FakeImageProvider(error=KnownError('quota exceeded'))]
+        batch_id = ai_image_job_pool.new_batch({ 'download_dir': tmp_dir }, 'fake', 'dog', providers)
+
+        status = wait_for_batch(batch_id)
+        assert status['error'] == 1
+        assert 'quota exceeded' in status['messages']
+        assert len(os.listdir(tmp_dir)) == 1
+
+def test_image_batch_is_forgotten_when_done():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        batch_id = ai_image_job_pool.new_batch({ 'download_dir': tmp_dir }, 'fake', 'owl', [FakeImageProvider()])
+        wait_for_batch(batch_id)
+        assert batch_id not in ai_image_job_pool.pool
+        assert not [path for path in image._reserved_image_paths if path.startswith(tmp_dir)]
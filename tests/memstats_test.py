@@ -0,0 +1,67 @@
+import threading
+import tracemalloc
+from unittest.mock import patch
+
+import vim_ai.memstats as memstats
+from vim_ai.memstats import deep_sizeof, format_structures, run_mem_stats
+
+# keeps allocations made inside the vim_ai package alive between snapshots
+from vim_ai import image
+
+def test_deep_sizeof_follows_containers_and_instances():
+    class Holder(object):
+        def __init__(self):
+            self.payload = 'x' * 10000
+
+    size, complete = deep_sizeof({ 'items': [Holder(), Holder()] })
+    assert complete
+    assert size > 20000
+
+    shared = 'y' * 10000
+    size_shared, _ = deep_sizeof([shared, shared])
+    assert size_shared < 20000
+
+    _, complete = deep_sizeof(list(range(100)), max_objects=10)
+    assert not complete
+
+def test_format_structures_lists_loaded_modules():
+    lines = format_structures()
+    assert lines[0] == 'Internal structures:'
+    assert any('image job pool' in line for line in lines)
+
+def test_format_structures_survives_concurrent_changes():
+    def changed():
+        raise RuntimeError('dictionary changed size during iteration')
+    structures = [('changing', None, changed), ('stable', threading.Lock(), lambda: (1, { 'a': 'b' }))]
+    with patch('vim_ai.memstats._internal_structures', return_value=iter(structures)):
+        lines = format_structures()
+    assert 'changed while measured' in lines[1]
+    assert lines[2].split()[:3] == ['stable', '1', 'items']
+
+def test_mem_stats_start_snapshot_stop():
+    was_tracing = tracemalloc.is_tracing()
+    try:
+        lines = run_mem_stats('start')
+        assert lines[0].startswith('tracemalloc started')
+        assert tracemalloc.is_tracing()
+
+        first = run_mem_stats()
+        assert first[0].startswith('Traced memory:')
+        assert 'Growth since the previous snapshot:' not in first
+
+        kept = [image.make_image_timestamp() + str(i) for i in range(1000)]
+        second = run_mem_stats('snapshot')
+        assert 'Growth since the previous snapshot:' in second
+        assert any('vim_ai/image.py' in line for line in second)
+        assert kept
+
+        assert run_mem_stats('stop')[0] == 'tracemalloc stopped'
+        assert not tracemalloc.is_tracing()
+        assert run_mem_stats('snapshot')[0].startswith('tracemalloc is not running')
+        assert run_mem_stats('unknown')[0].startswith('Unknown action')
+    finally:
+        memstats._last_snapshot = None
+        if was_tracing and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not was_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
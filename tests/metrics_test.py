@@ -0,0 +1,143 @@
+import json
+import os
+import tempfile
+
+from vim_ai.metrics import (
+    RequestMetrics, add_request_bytes, instrument_chunks, mark_request_event, percentile,
+    read_metrics, set_request_usage, summarize_metrics, write_metrics,
+)
+
+def fake_provider_request():
+    mark_request_event('connected')
+    add_request_bytes(sent=100)
+    add_request_bytes(received=10)
+    yield { 'type': 'thinking', 'content': '' }
+    yield { 'type': 'assistant', 'content': 'Hello ' }
+    yield { 'type': 'assistant', 'content': 'world!' }
+    add_request_bytes(received=20)
+
+def test_instrument_chunks_records_request():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'metrics.jsonl')
+        metrics = RequestMetrics('openai', 'gpt-4o', 'chat', context_time=0.01, path=path)
+        chunks = list(instrument_chunks(metrics, fake_provider_request()))
+        assert [c['content'] for c in chunks] == ['', 'Hello ', 'world!']
+
+        records = read_metrics(path)
+        assert len(records) == 1
+        record = records[0]
+        assert record['provider'] == 'openai'
+        assert record['model'] == 'gpt-4o'
+        assert record['context_time'] == 0.01
+        assert record['request_bytes'] == 100
+        assert record['response_bytes'] == 30
+        assert record['output_tokens'] == 3
+        assert record['tokens_estimated'] is True
+        assert record['error'] is None
+        assert record['connect_time'] <= record['first_byte_time'] <= record['first_token_time'] <= record['total_time']
+
+        # provider events outside of an instrumented request are ignored
+        add_request_bytes(received=10)
+        assert metrics.response_bytes == 30
+
+def test_openai_request_records_connect_time():
+    from benchmarks.mock_server import MockOpenAIServer
+    from benchmarks.startup_benchmark import CHAT_CONFIG
+    from vim_ai import config_snapshot
+    from vim_ai.providers.openai import OpenAIProvider
+    from vim_ai.utils import AIProviderUtils
+
+    messages = [{ 'role': 'user', 'content': [{ 'type': 'text', 'text': 'hello' }] }]
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir, MockOpenAIServer(chunks=['Hello', ' world']) as server:
+            options = dict(CHAT_CONFIG['options'])
+            options['endpoint_url'] = server.url + '/chat/completions'
+            config_snapshot.load_config_snapshot({ 'vim_ai_openai_chat': options })
+            path = os.path.join(tmp_dir, 'metrics.jsonl')
+            provider = OpenAIProvider('chat', {}, AIProviderUtils())
+            list(instrument_chunks(RequestMetrics('openai', 'gpt-4o', 'chat', path=path), provider.request(messages)))
+            record = read_metrics(path)[0]
+    finally:
+        config_snapshot._snapshot = None
+    assert record['error'] is None
+    assert record['connect_time'] is not None
+    assert record['connect_time'] <= record['first_byte_time'] <= record['first_token_time']
+
+def test_instrument_chunks_reported_usage_and_errors():
+    def failing_request():
+        set_request_usage(input_tokens=5, output_tokens=42)
+        yield { 'type': 'assistant', 'content': 'partial' }
+        raise IOError('connection reset')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'metrics.jsonl')
+        metrics = RequestMetrics('bedrock', 'claude', 'complete', path=path)
+        try:
+            list(instrument_chunks(metrics, failing_request()))
+            assert False, 'expected an error'
+        except IOError:
+            pass
+        record = read_metrics(path)[0]
+        assert record['output_tokens'] == 42
+        assert record['input_tokens'] == 5
+        assert record['tokens_estimated'] is False
+        assert record['error'] == 'OSError'
+
+def test_instrument_chunks_cancelled():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'metrics.jsonl')
+        chunks = instrument_chunks(RequestMetrics('openai', 'm', 'chat', path=path), fake_provider_request())
+        next(chunks)
+        chunks.close()
+        assert read_metrics(path)[0]['error'] == 'cancelled'
+
+def test_instrument_chunks_disabled():
+    chunks = list(instrument_chunks(None, fake_provider_request()))
+    assert len(chunks) == 3
+
+def test_percentile():
+    values = [5, 1, 4, 2, 3]
+    assert percentile(values, 0.5) == 3
+    assert percentile(values, 0.95) == 5
+    assert percentile([7], 0.5) == 7
+
+def test_summarize_metrics():
+    records = [
+        { 'provider': 'openai', 'model': 'a', 'command_type': 'chat', 'first_token_time': t, 'total_time': t * 2, 'tokens_per_second': 10.0, 'error': None }
+        for t in (0.1, 0.2, 0.3, 0.4)
+    ] + [
+        { 'provider': 'openai', 'model': 'a', 'command_type': 'chat', 'first_token_time': None, 'total_time': 9.0, 'error': 'HTTPError' },
+        { 'provider': 'bedrock', 'model': 'b', 'command_type': 'edit', 'first_token_time': 1.0, 'total_time': 2.0, 'tokens_per_second': None, 'error': None },
+    ]
+    lines = summarize_metrics(records)
+    assert lines[0].split()[:5] == ['provider', 'model', 'command', 'count', 'errors']
+    assert lines[1].split() == ['bedrock', 'b', 'edit', '1', '0', '1.00s', '1.00s', '2.00s', '2.00s', '-', '-']
+    assert lines[2].split() == ['openai', 'a', 'chat', '5', '1', '0.20s', '0.40s', '0.40s', '0.80s', '10.0', '10.0']
+    assert summarize_metrics([]) == ['No metrics recorded yet']
+
+def test_read_metrics_skips_broken_lines():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'metrics.jsonl')
+        with open(path, 'w') as f:
+            f.write(json.dumps({ 'provider': 'x' }) + '\n{broken\n')
+        assert read_metrics(path) == [{ 'provider': 'x' }]
+        assert read_metrics(os.path.join(tmp_dir, 'missing.jsonl')) == []
+
+def test_read_metrics_keeps_only_the_tail():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'metrics.jsonl')
+        with open(path, 'w') as f:
+            for i in range(10):
+                f.write(json.dumps({ 'index': i }) + '\n')
+        assert [r['index'] for r in read_metrics(path, limit=3)] == [7, 8, 9]
+
+def test_write_metrics_rotates_large_file():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'metrics.jsonl')
+        metrics = RequestMetrics('openai', 'gpt-4o', 'chat', path=path)
+        write_metrics(metrics, max_size=100)
+        write_metrics(metrics, max_size=100)
+        assert os.path.exists(path + '.1')
+        assert not os.path.exists(path)
+        write_metrics(metrics, max_size=100000)
+        assert len(read_metrics(path)) == 1
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import threading
+
+import vim_ai.profiling as profiling
+from vim_ai.profiling import find_latest_profile, format_profile_report, profiled, run_profiled
+
+def busy_function(n):
+    return sum(i * i for i in range(n))
+
+def test_run_profiled_writes_profile():
+    with tempfile.TemporaryDirectory() as profile_dir:
+        result = run_profiled(profile_dir, 'chat', busy_function, 1000)
+        assert result == busy_function(1000)
+        path = find_latest_profile(profile_dir)
+        assert path.endswith('.prof')
+        assert '_chat_' in os.path.basename(path)
+
+        lines = format_profile_report(path, 5)
+        assert lines[0] == 'Profile: {}'.format(path)
+        assert any('cumulative' in line for line in lines)
+        assert any('busy_function' in line for line in lines)
+
+def test_profiled_thread_entry_uses_setting_of_command():
+    started = []
+
+    @profiled('command')
+    def command():
+        thread = threading.Thread(target=job)
+        started.append(thread)
+
+    @profiled('job', in_thread=True)
+    def job():
+        busy_function(100)
+
+    with tempfile.TemporaryDirectory() as profile_dir:
+        original = profiling._read_profile_dir
+        profiling._read_profile_dir = lambda: profile_dir
+        try:
+            command()
+            # Python 3.12+ allows a single active profiler, do not overlap them
+            started[0].start()
+            started[0].join()
+        finally:
+            profiling._read_profile_dir = original
+        names = sorted(name.split('_')[1] for name in os.listdir(profile_dir))
+        assert names == ['command', 'job']
+
+def test_command_profiler_is_stopped_before_job_starts():
+    @profiled('command')
+    def command():
+        busy_function(100)
+        profiling.stop_command_profiler()
+        thread = threading.Thread(target=job)
+        thread.start()
+        thread.join()
+
+    @profiled('job', in_thread=True)
+    def job():
+        busy_function(100)
+
+    with tempfile.TemporaryDirectory() as profile_dir:
+        original = profiling._read_profile_dir
+        profiling._read_profile_dir = lambda: profile_dir
+        try:
+            command()
+        finally:
+            profiling._read_profile_dir = original
+        names = sorted(name.split('_')[1] for name in os.listdir(profile_dir))
+        assert names == ['command', 'job']
+        assert profiling._command_profiler is None
+
+def test_profiled_disabled_by_default():
+    calls = []
+
+    @profiled('command')
+    def command():
+        calls.append(1)
+        return 'done'
+
+    assert command() == 'done'
+    assert calls == [1]
+    assert profiling._profile_dir is None
+
+def test_no_profiles():
+    with tempfile.TemporaryDirectory() as profile_dir:
+        assert find_latest_profile(profile_dir) is None
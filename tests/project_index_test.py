@@ -0,0 +1,89 @@
+import os
+import tempfile
+
+import vim_ai.project_index as project_index
+from vim_ai.project_index import ProjectIndex, parse_gitignore, is_ignored, get_project_index
+
+def write(root, rel, content=''):
+    path = os.path.join(root, *rel.split('/'))
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+
+def touch_dir(root, rel, offset):
+    # directory mtime granularity may be coarse, make the change visible
+    path = os.path.join(root, *rel.split('/')) if rel else root
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + offset))
+
+def test_gitignore_rules():
+    rules = parse_gitignore('', "# comment\n*.log\n!keep.log\nbuild/\n/dist\ndocs/**/*.tmp\n")
+    assert is_ignored(rules, 'a/debug.log', 'debug.log', False)
+    assert not is_ignored(rules, 'a/keep.log', 'keep.log', False)
+    assert is_ignored(rules, 'src/build', 'build', True)
+    assert not is_ignored(rules, 'src/build', 'build', False)
+    assert is_ignored(rules, 'dist', 'dist', True)
+    assert not is_ignored(rules, 'src/dist', 'dist', True)
+    assert is_ignored(rules, 'docs/a/b/x.tmp', 'x.tmp', False)
+    assert is_ignored(rules, 'docs/x.tmp', 'x.tmp', False)
+    assert not is_ignored(rules, 'src/x.tmp', 'x.tmp', False)
+
+def test_nested_gitignore_is_relative_to_its_directory():
+    rules = parse_gitignore('', "*.log\n") + parse_gitignore('pkg', "/generated\n!important.log\n")
+    assert is_ignored(rules, 'pkg/generated', 'generated', True)
+    assert not is_ignored(rules, 'generated', 'generated', True)
+    assert not is_ignored(rules, 'pkg/important.log', 'important.log', False)
+
+def test_project_index_lists_files_honouring_gitignore():
+    with tempfile.TemporaryDirectory() as root:
+        write(root, '.gitignore', "build/\n*.pyc\n")
+        write(root, 'main.py')
+        write(root, 'main.pyc')
+        write(root, 'src/util.py')
+        write(root, 'src/lib.c')
+        write(root, 'build/out.py')
+        write(root, 'node_modules/dep/index.js')
+        write(root, '.hidden/secret.py')
+        write(root, 'src/pkg/.gitignore', "*.c\n")
+        write(root, 'src/pkg/gen.c')
+        write(root, 'src/pkg/mod.py')
+
+        index = ProjectIndex(root)
+        assert index.list_files() == ['main.py', 'src/lib.c', 'src/pkg/mod.py', 'src/util.py']
+        assert index.find_files(['*.c', '*.py'], limit_per_pattern=2) == ['src/lib.c', 'main.py', 'src/pkg/mod.py']
+
+def test_project_index_updates_changed_directories():
+    with tempfile.TemporaryDirectory() as root:
+        write(root, 'a.py')
+        write(root, 'sub/b.py')
+        index = ProjectIndex(root)
+        assert index.list_files() == ['a.py', 'sub/b.py']
+
+        write(root, 'sub/c.py')
+        write(root, 'sub/new/d.py')
+        touch_dir(root, 'sub', 10 ** 9)
+        # served from the index until the refresh interval elapses
+        assert index.list_files() == ['a.py', 'sub/b.py']
+        index.refresh(force=True)
+        assert index.list_files() == ['a.py', 'sub/b.py', 'sub/c.py', 'sub/new/d.py']
+
+        write(root, '.gitignore', "new/\n")
+        index.refresh(force=True)
+        assert index.list_files() == ['a.py', 'sub/b.py', 'sub/c.py']
+
+        os.remove(os.path.join(root, 'sub', 'c.py'))
+        os.remove(os.path.join(root, 'sub', 'b.py'))
+        os.remove(os.path.join(root, 'sub', 'new', 'd.py'))
+        os.rmdir(os.path.join(root, 'sub', 'new'))
+        os.rmdir(os.path.join(root, 'sub'))
+        touch_dir(root, '', 10 ** 9)
+        index.refresh(force=True)
+        assert index.list_files() == ['a.py']
+        assert index.files_count == 1
+
+def test_get_project_index_is_persistent():
+    with tempfile.TemporaryDirectory() as root:
+        project_index.invalidate_project_indexes()
+        assert get_project_index(root) is get_project_index(root + '/')
+        project_index.invalidate_project_indexes()
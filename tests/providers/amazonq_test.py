@@ -9,7 +9,9 @@ sys.modules['vim'] = MagicMock()
 # Set dummy import environment
 os.environ["VIMAI_DUMMY_IMPORT"] = "1"
 
-from vim_ai.providers.amazonq import AmazonQProvider
+from vim_ai.providers import amazonq
+from vim_ai.providers.amazonq import AmazonQProvider, AnsiStripper, AnswerFilter
+import time
 
 class TestAmazonQProvider(unittest.TestCase):
 
@@ -85,6 +87,7 @@ class TestAmazonQProvider(unittest.TestCase):
             mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
             provider = AmazonQProvider('chat', {}, self.utils)
             
+            amazonq.invalidate_q_cli_availability()
             with patch('vim_ai.providers.amazonq.subprocess_run_compat') as mock_run:
                 mock_run.side_effect = FileNotFoundError("q command not found")
                 
@@ -104,9 +107,124 @@ class TestAmazonQProvider(unittest.TestCase):
             
             with patch('vim_ai.providers.amazonq.subprocess_run_compat') as mock_run:
                 # Test when Q CLI is available
+                amazonq.invalidate_q_cli_availability()
                 mock_run.return_value.returncode = 0
                 self.assertTrue(provider._is_q_cli_available())
+
+                # the result is cached
+                self.assertTrue(provider._is_q_cli_available())
+                self.assertEqual(mock_run.call_count, 1)
                 
                 # Test when Q CLI is not available
+                amazonq.invalidate_q_cli_availability()
                 mock_run.side_effect = FileNotFoundError()
                 self.assertFalse(provider._is_q_cli_available())
+            amazonq.invalidate_q_cli_availability()
+
+def test_ansi_stripper_split_sequences():
+    stripper = AnsiStripper()
+    pieces = ['\x1b[3', '2mHel', 'lo\x1b', ']0;title\x07 wor', 'ld\x1b[0', 'm\r', '\n', '\x1b(Bdone\r', 'x']
+    assert ''.join(stripper.feed(piece) for piece in pieces) == 'Hello world\ndone\rx'
+
+def test_answer_filter():
+    answer_filter = AnswerFilter()
+    pieces = ['\u280b Thinking...', '\r\u2819 Thinking...\r', '\n> ', 'Hello', ' world\n']
+    assert ''.join(answer_filter.feed(piece) for piece in pieces) + answer_filter.finish() == 'Hello world\n'
+
+    answer_filter = AnswerFilter(hold_prompt=True)
+    pieces = ['> Hi', ' there', '\n', '\n', '[profile] ', '> ']
+    chunks = [answer_filter.feed(piece) for piece in pieces]
+    assert chunks[:2] == ['Hi', ' there']
+    assert ''.join(chunks) + answer_filter.finish() == 'Hi there'
+
+    answer_filter = AnswerFilter()
+    pieces = ['\n', '    indented = True\n', 'done\n']
+    assert ''.join(answer_filter.feed(piece) for piece in pieces) + answer_filter.finish() == '    indented = True\ndone\n'
+
+FAKE_Q_COMMAND = '{} {}'.format(
+    sys.executable,
+    os.path.join(os.path.dirname(__file__), '..', 'resources', 'fake_q.py'),
+)
+
+@unittest.skipIf(amazonq.pty is None, 'pseudo-terminals are not available')
+class TestAmazonQSession(unittest.TestCase):
+
+    def setUp(self):
+        self.utils = Mock()
+        self.utils.print_debug = Mock()
+        amazonq.invalidate_q_cli_availability()
+
+    def tearDown(self):
+        amazonq.close_sessions()
+        amazonq.invalidate_q_cli_availability()
+
+    def make_provider(self):
+        with patch('vim.eval') as mock_eval:
+            mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
+            return AmazonQProvider('chat', {'q_chat_command': FAKE_Q_COMMAND, 'request_timeout': 10}, self.utils)
+
+    def ask(self, messages):
+        chunks = list(self.make_provider().request(messages))
+        self.assertTrue(all(chunk['type'] == 'assistant' for chunk in chunks))
+        # answer is streamed as q prints it
+        self.assertGreater(len(chunks), 1)
+        return ''.join(chunk['content'] for chunk in chunks)
+
+    def test_session_is_reused_across_turns(self):
+        user = lambda text: {'role': 'user', 'content': [{'type': 'text', 'text': text}]}
+        assistant = lambda text: {'role': 'assistant', 'content': [{'type': 'text', 'text': text}]}
+        system = {'role': 'system', 'content': [{'type': 'text', 'text': 'Be brief'}]}
+
+        first = self.ask([system, user('hello')])
+        self.assertEqual(first.strip(), 'Echo(turn 1): hello')
+
+        second = self.ask([system, user('hello'), assistant(first.strip()), user('again')])
+        self.assertEqual(second.strip(), 'Echo(turn 2): again')
+        self.assertEqual(len(amazonq._sessions), 1)
+
+        # edited history starts a new conversation
+        edited = self.ask([system, user('hi'), assistant(first.strip()), user('again')])
+        self.assertEqual(edited.strip(), 'Echo(turn 1): again')
+        self.assertEqual(len(amazonq._sessions), 2)
+
+    def test_session_with_output_after_prompt_is_discarded(self):
+        user = lambda text: {'role': 'user', 'content': [{'type': 'text', 'text': text}]}
+        assistant = lambda text: {'role': 'assistant', 'content': [{'type': 'text', 'text': text}]}
+        with patch('vim.eval') as mock_eval:
+            mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
+            options = {'q_chat_command': FAKE_Q_COMMAND + ' --quote-pause', 'request_timeout': 10}
+            make_provider = lambda: AmazonQProvider('chat', options, self.utils)
+            first = ''.join(chunk['content'] for chunk in make_provider().request([user('hello')]))
+        self.assertEqual(first.strip(), 'Echo(turn 1): hello')
+        session = amazonq._sessions[0]
+        # the rest of the cut answer arrives
+        time.sleep(0.6)
+
+        messages = [user('hello'), assistant(first.strip()), user('again')]
+        second = ''.join(chunk['content'] for chunk in make_provider().request(messages))
+        self.assertEqual(second.strip(), 'Echo(turn 1): again')
+        self.assertEqual(len(amazonq._sessions), 1)
+        self.assertIsNot(amazonq._sessions[0], session)
+        self.assertFalse(session.is_alive())
+
+    def test_one_shot_streams_chunks(self):
+        with patch('vim.eval') as mock_eval:
+            mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
+            provider = AmazonQProvider('complete', {
+                'q_chat_command': FAKE_Q_COMMAND + ' --flood-stderr',
+                'request_timeout': 10,
+            }, self.utils)
+        chunks = list(provider.request([{'role': 'user', 'content': [{'type': 'text', 'text': 'hello'}]}]))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunk['content'] for chunk in chunks).strip(), 'Echo(turn 1): hello')
+
+    def test_prepare_starts_session(self):
+        provider = self.make_provider()
+        provider.prepare()
+        deadline = time.time() + 10
+        while not any(s.ready and not s.busy for s in amazonq._sessions) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(amazonq._sessions), 1)
+
+        self.assertEqual(self.ask([{'role': 'user', 'content': [{'type': 'text', 'text': 'hello'}]}]).strip(), 'Echo(turn 1): hello')
+        self.assertEqual(len(amazonq._sessions), 1)
@@ -10,7 +10,25 @@ sys.modules['vim'] = MagicMock()
 # Set dummy import environment
 os.environ["VIMAI_DUMMY_IMPORT"] = "1"
 
+from vim_ai.providers import bedrock
 from vim_ai.providers.bedrock import BedrockProvider
+from vim_ai.aws import AWSError, AWSCredentials
+import io
+import time
+
+class FakeResponse(io.BytesIO):
+    """InvokeModel response body, remembers how much of it was read"""
+    def __init__(self, data):
+        super().__init__(json.dumps(data).encode('utf-8'))
+        self.read_size = 0
+
+    def read(self, amt=None):
+        data = super().read(amt)
+        self.read_size += len(data)
+        return data
+
+def collect_images(chunks):
+    return [{'b64_data': ''.join(chunk['b64_data'])} for chunk in chunks]
 
 class TestBedrockProvider(unittest.TestCase):
 
@@ -59,32 +77,32 @@ class TestBedrockProvider(unittest.TestCase):
             self.assertIn('user', roles)
             self.assertIn('assistant', roles)
 
-    def test_aws_cli_availability_check(self):
-        """Test AWS CLI availability check"""
+    def test_aws_availability_check(self):
+        """Test AWS availability check"""
         with patch('vim.eval') as mock_eval:
             mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
             
             provider = BedrockProvider('chat', {}, self.utils)
             
             # Test that the method exists and can be called
-            self.assertTrue(hasattr(provider, '_is_aws_cli_available'))
-            self.assertTrue(callable(provider._is_aws_cli_available))
+            self.assertTrue(hasattr(provider, '_is_aws_available'))
+            self.assertTrue(callable(provider._is_aws_available))
 
-    def test_request_handling_without_cli(self):
-        """Test request handling when AWS CLI is not available"""
+    def test_request_handling_without_credentials(self):
+        """Test request handling when AWS credentials are not available"""
         with patch('vim.eval') as mock_eval:
             mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
             
             provider = BedrockProvider('chat', {}, self.utils)
             
-            # Test when AWS CLI is not available
-            with patch.object(provider, '_is_aws_cli_available', return_value=False):
+            # Test when AWS credentials are not available
+            with patch.object(provider, '_is_aws_available', return_value=False):
                 messages = [{"role": "user", "content": "Hello"}]
                 responses = list(provider.request(messages))
                 
                 self.assertEqual(len(responses), 1)
                 self.assertEqual(responses[0]['type'], 'assistant')
-                self.assertIn('Bedrock provider requires AWS CLI', responses[0]['content'])
+                self.assertIn('Bedrock provider requires AWS credentials', responses[0]['content'])
 
     def test_image_generation_support(self):
         """Test Bedrock image generation functionality"""
@@ -100,23 +118,211 @@ class TestBedrockProvider(unittest.TestCase):
             provider = BedrockProvider('image', options, self.utils)
             
             # Test image request structure
-            with patch.object(provider, '_is_aws_cli_available', return_value=True):
-                with patch('vim_ai.utils.subprocess_run_compat') as mock_run:
-                    # Mock successful image generation
-                    mock_response = {
-                        'images': [{'source': {'bytes': 'base64encodeddata'}}]
+            with patch.object(provider, '_is_aws_available', return_value=True):
+                with patch('vim_ai.providers.bedrock.BedrockRuntimeClient.invoke_model_stream') as mock_invoke:
+                    mock_invoke.return_value = FakeResponse({
+                        'images': ['base64encodeddata']
+                    })
+                    result = collect_images(provider.request_image("test prompt"))
+                    self.assertEqual(result, [{'b64_data': 'base64encodeddata'}])
+                    model_id, payload = mock_invoke.call_args[0]
+                    self.assertEqual(model_id, 'amazon.nova-canvas-v1:0')
+                    self.assertEqual(payload['taskType'], 'TEXT_IMAGE')
+                    self.assertEqual(payload['textToImageParams'], {'text': 'test prompt'})
+                    self.assertEqual(payload['imageGenerationConfig']['width'], 1024)
+
+    def test_multiple_images(self):
+        """Test that number_of_images generates several images in a single call"""
+        with patch('vim.eval') as mock_eval:
+            mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
+
+            options = {'model': 'stability.stable-diffusion-xl-v1', 'number_of_images': '3'}
+            provider = BedrockProvider('image', options, self.utils)
+            with patch.object(provider, '_is_aws_available', return_value=True):
+                with patch('vim_ai.providers.bedrock.BedrockRuntimeClient.invoke_model_stream') as mock_invoke:
+                    mock_invoke.return_value = FakeResponse({
+                        'artifacts': [{'seed': 1, 'base64': 'one'}, {'base64': 'two'}, {'base64': 'three'}]
+                    })
+                    result = collect_images(provider.request_image("test prompt"))
+            self.assertEqual(result, [{'b64_data': 'one'}, {'b64_data': 'two'}, {'b64_data': 'three'}])
+            self.assertEqual(mock_invoke.call_count, 1)
+            self.assertEqual(mock_invoke.call_args[0][1]['samples'], 3)
+
+    def test_images_are_decoded_from_the_response_stream(self):
+        """Test that each image is handed over before the rest of the response is read"""
+        with patch('vim.eval') as mock_eval:
+            mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
+
+            provider = BedrockProvider('image', {'model': 'amazon.nova-canvas-v1:0'}, self.utils)
+            images = ['A' * 300000, 'B' * 300000]
+            response = FakeResponse({'images': images, 'error': None})
+            with patch.object(provider, '_is_aws_available', return_value=True):
+                with patch('vim_ai.providers.bedrock.BedrockRuntimeClient.invoke_model_stream', return_value=response):
+                    chunks = provider.request_image("test prompt")
+                    first = next(chunks)
+                    pieces = iter(first['b64_data'])
+                    first_piece = next(pieces)
+                    self.assertLess(response.read_size, 2 * bedrock.IMAGE_READ_SIZE)
+                    self.assertEqual(first_piece + ''.join(pieces), images[0])
+                    second = next(chunks)
+                    self.assertLess(response.read_size, len(response.getvalue()))
+                    self.assertEqual(''.join(second['b64_data']), images[1])
+                    self.assertEqual(list(chunks), [])
+
+    def test_image_error_in_response(self):
+        """Test that an error reported in the response body is raised"""
+        with patch('vim.eval') as mock_eval:
+            mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
+
+            provider = BedrockProvider('image', {'model': 'amazon.nova-canvas-v1:0'}, self.utils)
+            response = FakeResponse({'images': [], 'error': 'content filtered'})
+            with patch.object(provider, '_is_aws_available', return_value=True):
+                with patch('vim_ai.providers.bedrock.BedrockRuntimeClient.invoke_model_stream', return_value=response):
+                    with self.assertRaises(Exception):
+                        list(provider.request_image("test prompt"))
+            self.utils.make_known_error.assert_called_with('Bedrock image error: content filtered')
+
+    def test_chat_request_via_runtime_api(self):
+        """Test that chat requests go through the converse API"""
+        with patch('vim.eval') as mock_eval:
+            mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
+
+            provider = BedrockProvider('chat', {'model': 'amazon.nova-lite-v1:0', 'region': 'eu-west-1', 'stream': '0'}, self.utils)
+            messages = [
+                {"role": "system", "content": "Be brief"},
+                {"role": "user", "content": [{"type": "text", "text": "Hello"}]},
+            ]
+            with patch.object(provider, '_is_aws_available', return_value=True):
+                with patch('vim_ai.providers.bedrock.BedrockRuntimeClient.converse') as mock_converse:
+                    mock_converse.return_value = {
+                        'output': {'message': {'content': [{'text': 'Hi!'}]}},
+                        'usage': {'inputTokens': 3, 'outputTokens': 1, 'totalTokens': 4},
                     }
-                    mock_run.return_value.returncode = 0
-                    mock_run.return_value.stdout = json.dumps(mock_response)
-                    
-                    # This should not raise an exception
-                    try:
-                        result = list(provider.request_image("test prompt"))
-                        # Should return some result
-                        self.assertTrue(len(result) >= 0)
-                    except Exception as e:
-                        # Expected to fail in test environment, but should not crash
-                        self.assertIsInstance(e, Exception)
+                    responses = list(provider.request(messages))
+
+            self.assertEqual(responses, [{'type': 'assistant', 'content': 'Hi!'}])
+            model_id, payload = mock_converse.call_args[0]
+            self.assertEqual(model_id, 'amazon.nova-lite-v1:0')
+            self.assertEqual(payload['system'], [{'text': 'Be brief'}])
+            self.assertEqual(payload['messages'], [{'role': 'user', 'content': [{'text': 'Hello'}]}])
+            self.assertEqual(provider.usage['totalTokens'], 4)
+
+    def test_chat_request_via_converse_stream(self):
+        """Test that streamed deltas are yielded as they arrive"""
+        with patch('vim.eval') as mock_eval:
+            mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
+
+            provider = BedrockProvider('chat', {'model': 'amazon.nova-lite-v1:0', 'region': 'eu-west-1'}, self.utils)
+            events = [
+                ('messageStart', {'role': 'assistant'}),
+                ('contentBlockDelta', {'contentBlockIndex': 0, 'delta': {'reasoningContent': {'text': 'Hmm'}}}),
+                ('contentBlockDelta', {'contentBlockIndex': 1, 'delta': {'text': 'Hello'}}),
+                ('contentBlockDelta', {'contentBlockIndex': 1, 'delta': {'text': ' there'}}),
+                ('contentBlockStop', {'contentBlockIndex': 1}),
+                ('messageStop', {'stopReason': 'end_turn'}),
+                ('metadata', {'usage': {'inputTokens': 3, 'outputTokens': 2, 'totalTokens': 5}}),
+            ]
+            with patch.object(provider, '_is_aws_available', return_value=True):
+                with patch('vim_ai.providers.bedrock.BedrockRuntimeClient.converse_stream', return_value=iter(events)):
+                    responses = list(provider.request([{"role": "user", "content": "Hello"}]))
+
+            self.assertEqual(responses, [
+                {'type': 'thinking', 'content': 'Hmm'},
+                {'type': 'assistant', 'content': 'Hello'},
+                {'type': 'assistant', 'content': ' there'},
+            ])
+            self.assertEqual(provider.usage, {'inputTokens': 3, 'outputTokens': 2, 'totalTokens': 5})
+
+    def test_availability_cache(self):
+        """Test that availability is cached per profile and region and invalidated on auth errors"""
+        with patch('vim.eval') as mock_eval:
+            mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
+            bedrock.invalidate_availability()
+            provider = BedrockProvider('chat', {'region': 'us-east-1', 'profile': 'work'}, self.utils)
+            other_region = BedrockProvider('chat', {'region': 'eu-west-1', 'profile': 'work'}, self.utils)
+
+            with patch('vim_ai.providers.bedrock.resolve_credentials') as mock_resolve:
+                mock_resolve.return_value = AWSCredentials('AKID', 'SECRET', source='profile')
+                self.assertTrue(provider._is_aws_available())
+                self.assertTrue(provider._is_aws_available())
+                self.assertEqual(mock_resolve.call_count, 1)
+
+                self.assertTrue(other_region._is_aws_available())
+                self.assertEqual(mock_resolve.call_count, 2)
+
+                provider._handle_aws_error(AWSError('throttled', 429, 'ThrottlingException'))
+                self.assertTrue(provider._is_aws_available())
+                self.assertEqual(mock_resolve.call_count, 2)
+
+                provider._handle_aws_error(AWSError('expired', 403, 'ExpiredTokenException'))
+                self.assertTrue(provider._is_aws_available())
+                self.assertEqual(mock_resolve.call_count, 3)
+            bedrock.invalidate_availability()
+
+    def test_prepare_probes_in_background(self):
+        """Test that opening a chat probes availability in the background"""
+        with patch('vim.eval') as mock_eval:
+            mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
+            bedrock.invalidate_availability()
+            provider = BedrockProvider('chat', {'region': 'us-east-1', 'profile': 'work'}, self.utils)
+            key = provider._availability_key()
+
+            with patch('vim_ai.providers.bedrock.STSClient.get_caller_identity') as mock_identity:
+                mock_identity.side_effect = AWSError('invalid', 403, 'InvalidClientTokenId')
+                provider.prepare()
+                deadline = time.time() + 5
+                while bedrock.get_cached_availability(key) is None and time.time() < deadline:
+                    time.sleep(0.01)
+
+            self.assertFalse(bedrock.get_cached_availability(key))
+            with patch('vim_ai.providers.bedrock.resolve_credentials') as mock_resolve:
+                self.assertFalse(provider._is_aws_available())
+                mock_resolve.assert_not_called()
+            bedrock.invalidate_availability()
+
+    def test_probe_does_not_cache_network_errors(self):
+        """Test that a failed connection leaves the availability unknown"""
+        with patch('vim.eval') as mock_eval:
+            mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
+            bedrock.invalidate_availability()
+            options = {'region': 'us-east-1', 'profile': 'work', 'endpoint_url': 'https://vpce.example.com'}
+            provider = BedrockProvider('chat', options, self.utils)
+            key = provider._availability_key()
+
+            with patch('vim_ai.providers.bedrock.STSClient') as mock_sts:
+                mock_sts.return_value.get_caller_identity.side_effect = ConnectionResetError('reset')
+                self.assertIsNone(provider._probe_availability(key))
+                mock_sts.assert_called_with(region='us-east-1', profile='work', endpoint_url=None)
+
+            self.assertIsNone(bedrock.get_cached_availability(key))
+            bedrock.invalidate_availability()
+
+    def test_probe_uses_sts_endpoint(self):
+        """Test that the probe does not send STS requests to the Bedrock endpoint"""
+        with patch('vim.eval') as mock_eval:
+            mock_eval.side_effect = lambda x: "0" if "exists" in x else {}
+            bedrock.invalidate_availability()
+            options = {'region': 'us-east-1', 'profile': 'work', 'endpoint_url': 'https://vpce.example.com'}
+            provider = BedrockProvider('chat', options, self.utils)
+            key = provider._availability_key()
+
+            with patch('vim_ai.aws.AWSClient._send', autospec=True) as mock_send:
+                mock_send.side_effect = AWSError('invalid', 403, 'InvalidSignatureException')
+                self.assertFalse(provider._probe_availability(key))
+                client = mock_send.call_args[0][0]
+                self.assertEqual(client.endpoint_url, 'https://sts.us-east-1.amazonaws.com')
+                self.assertEqual(client._signing_service, 'sts')
+            self.assertFalse(bedrock.get_cached_availability(key))
+            bedrock.invalidate_availability()
+
+            options['sts_endpoint_url'] = 'https://sts-proxy.example.com'
+            provider = BedrockProvider('chat', options, self.utils)
+            with patch('vim_ai.aws.AWSClient._send', autospec=True) as mock_send:
+                mock_send.side_effect = AWSError('invalid', 403, 'InvalidSignatureException')
+                self.assertIsNone(provider._probe_availability(key))
+                self.assertEqual(mock_send.call_args[0][0].endpoint_url, 'https://sts-proxy.example.com')
+            self.assertIsNone(bedrock.get_cached_availability(key))
+            bedrock.invalidate_availability()
 
     def test_option_parsing(self):
         """Test that provider parses options correctly"""
@@ -0,0 +1,40 @@
+# Stand-in for the `q` CLI used by the Amazon Q provider tests
+import sys
+import time
+
+def write(text, delay=0.0):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+    time.sleep(delay)
+
+def answer(prompt, turn):
+    write('\r\x1b[32m⠋ Thinking...\x1b[0m\r\x1b[2K')
+    write('\x1b[32m> \x1b[0m', 0.01)
+    for word in 'Echo(turn {}): {}'.format(turn, prompt).split(' '):
+        write(word + ' ', 0.01)
+    write('\n')
+    if '--quote-pause' in sys.argv:
+        # a markdown quote line followed by a streaming pause looks like the prompt
+        write('> ', 0.5)
+        write('quoted\n')
+
+if len(sys.argv) > 1 and sys.argv[1] == '--help':
+    sys.exit(0)
+
+if '--no-interactive' in sys.argv:
+    if '--flood-stderr' in sys.argv:
+        # more than a pipe buffer, blocks unless stderr is drained concurrently
+        sys.stderr.write('warning\n' * 100000)
+        sys.stderr.flush()
+    answer(sys.argv[-1], 1)
+    sys.exit(0)
+
+write('\x1b[1mWelcome to fake q\x1b[0m\n')
+turn = 0
+while True:
+    write('\n\x1b[35m> \x1b[0m')
+    line = sys.stdin.readline()
+    if not line:
+        break
+    turn += 1
+    answer(line.strip(), turn)
@@ -0,0 +1,140 @@
+import os
+import tempfile
+import threading
+
+import vim_ai.retrieval as retrieval
+from vim_ai.retrieval import (
+    RetrievalIndex, chunk_file, find_relevant_chunks, select_within_budget, tokenize,
+)
+
+CODE = '''import os
+
+def parse_config(path):
+    with open(path) as f:
+        return f.read()
+
+class TokenBucket(object):
+    def __init__(self, rate):
+        self.rate = rate
+
+    def consume(self, tokens):
+        return tokens <= self.rate
+'''
+
+def write(root, rel, content):
+    path = os.path.join(root, *rel.split('/'))
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+
+def test_tokenize_splits_identifiers():
+    assert tokenize('parseConfig of the token_bucket') == [
+        'parseconfig', 'parse', 'config', 'token_bucket', 'token', 'bucket',
+    ]
+
+def test_chunk_file_by_definitions():
+    chunks = chunk_file(CODE)
+    assert [(c['start'], c['end']) for c in chunks] == [(1, 2), (3, 6), (7, 12)]
+    assert 'text' not in chunks[1]
+    assert chunks[1]['terms']['parse_config'] == 1
+    assert chunks[2]['terms']['bucket'] == 1
+
+def test_chunk_prose_by_paragraphs():
+    text = '\n'.join(['line {}'.format(i) for i in range(6)] + [''] + ['more {}'.format(i) for i in range(3)])
+    chunks = chunk_file(text, is_prose=True)
+    assert [(c['start'], c['end']) for c in chunks] == [(1, 6), (7, 10)]
+
+def test_search_ranks_relevant_chunks_and_persists():
+    with tempfile.TemporaryDirectory() as root:
+        write(root, 'src/config.py', CODE)
+        write(root, 'src/other.py', 'def unrelated():\n    return 42\n')
+        write(root, 'README.md', 'Rate limiting uses a token bucket.\n')
+        index_path = os.path.join(root, '.index', 'index.json')
+
+        index = RetrievalIndex(root, index_path)
+        index.refresh()
+        results = index.search('how does the TokenBucket consume tokens?')
+        assert results[0]['path'] == 'src/config.py'
+        assert results[0]['start'] == 7
+        assert results[0]['text'].startswith('class TokenBucket(object):')
+        assert [r['path'] for r in results] == ['src/config.py', 'README.md']
+        with open(index_path) as f:
+            assert 'TokenBucket' not in f.read()
+
+        # a new instance loads chunks from disk, changed files are appended to the log
+        write(root, 'src/other.py', 'def bucket_size():\n    return 42\n')
+        os.utime(os.path.join(root, 'src', 'other.py'), ns=(1, 1))
+        reloaded = RetrievalIndex(root, index_path)
+        reloaded.files = reloaded._load()
+        assert reloaded.files['src/config.py']['chunks'] == index.files['src/config.py']['chunks']
+        records = reloaded.log_records
+        reloaded.refresh(force=True)
+        assert reloaded.log_records == records + 1
+        paths = [r['path'] for r in reloaded.search('bucket')]
+        assert 'src/other.py' in paths
+        assert RetrievalIndex(root, index_path)._load()['src/other.py']['mtime'] == 1
+
+def test_search_builds_index_in_background():
+    with tempfile.TemporaryDirectory() as root:
+        write(root, 'config.py', CODE)
+        index = RetrievalIndex(root, os.path.join(root, '.index.jsonl'))
+        original_update = index._update
+        started = threading.Event()
+        release = threading.Event()
+        def slow_update():
+            started.set()
+            release.wait(5)
+            original_update()
+        index._update = slow_update
+
+        assert index.search('parse_config') == []
+        assert started.wait(5)
+        assert index.search('parse_config') == []
+        release.set()
+        index._refresh_thread.join(5)
+        assert index.search('parse_config')[0]['start'] == 3
+
+def test_search_skips_chunks_of_changed_files():
+    with tempfile.TemporaryDirectory() as root:
+        write(root, 'config.py', CODE)
+        index = RetrievalIndex(root, os.path.join(root, '.index.jsonl'))
+        index.refresh()
+        os.utime(os.path.join(root, 'config.py'), ns=(1, 1))
+        assert index.search('parse_config') == []
+
+def test_search_python_and_numpy_scores_match():
+    with tempfile.TemporaryDirectory() as root:
+        write(root, 'a.py', CODE)
+        write(root, 'b.py', 'def config_loader():\n    return parse_config("x")\n')
+        index = RetrievalIndex(root, os.path.join(root, '.index.json'))
+        index.refresh()
+        terms = ['config', 'parse']
+        python_scores = index._score_python(terms)
+        assert sorted(chunk_id for chunk_id, _ in python_scores) == [1, 3]
+        if retrieval.numpy is not None:
+            numpy_scores = index._score_numpy(terms)
+            assert [c for c, _ in numpy_scores] == [c for c, _ in python_scores]
+
+def test_select_within_budget_skips_large_and_known_chunks():
+    results = [
+        { 'text': 'x' * 400 },
+        { 'text': 'already in prompt' },
+        { 'text': 'small chunk' },
+    ]
+    selected = select_within_budget(results, 50, exclude_text='... already in prompt ...')
+    assert selected == [{ 'text': 'small chunk' }]
+
+def test_find_relevant_chunks_formats_include_headers():
+    with tempfile.TemporaryDirectory() as root:
+        write(root, 'config.py', CODE)
+        retrieval._retrieval_indexes.clear()
+        original_dir = retrieval.get_index_dir
+        retrieval.get_index_dir = lambda: os.path.join(root, '.cache')
+        try:
+            retrieval.get_retrieval_index(root).refresh()
+            chunks = find_relevant_chunks(root, 'parse_config', 1000)
+        finally:
+            retrieval.get_index_dir = original_dir
+            retrieval._retrieval_indexes.clear()
+        assert chunks[0].startswith('==> config.py:3-6 <==\ndef parse_config(path):')
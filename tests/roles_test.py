@@ -1,4 +1,11 @@
-from vim_ai.roles import load_ai_role_names
+from vim_ai.roles import load_ai_role_names, complete_ai_role_names
+from vim_ai.utils import read_role_files
+from unittest.mock import patch
+import os
+import shutil
+import tempfile
+
+dirname = os.path.dirname(__file__)
 
 def test_role_completion():
     role_names = load_ai_role_names('complete')
@@ -49,3 +56,36 @@ def test_role_chat_only():
 def test_explicit_image_roles():
     role_names = load_ai_role_names('image')
     assert set(role_names) == { 'hd-image', 'hd', 'natural' }
+
+def test_role_prefix_completion():
+    assert complete_ai_role_names('chat', 'test') == ['test', 'test-role', 'test-role-simple']
+    assert complete_ai_role_names('image', 'h') == ['hd', 'hd-image']
+    assert complete_ai_role_names('complete', 'chat') == []
+    assert 'default' not in complete_ai_role_names('chat', '')
+
+def test_role_prefix_completion_ignore_case():
+    assert complete_ai_role_names('chat', 'Test') == []
+    assert complete_ai_role_names('chat', 'Test', ignore_case=True) == ['test', 'test-role', 'test-role-simple']
+    assert complete_ai_role_names('image', 'HD-', ignore_case=True) == ['hd-image']
+
+def test_role_files_cache():
+    tmp_dir = tempfile.mkdtemp()
+    roles_path = os.path.join(tmp_dir, 'roles.ini')
+    shutil.copy(os.path.join(dirname, 'resources/roles.ini'), roles_path)
+
+    def eval_mock(cmd):
+        if cmd == 'g:vim_ai_roles_config_file':
+            return roles_path
+        return os.path.abspath(os.path.join(dirname, '..'))
+
+    try:
+        with patch('vim_ai.utils.vim.eval', side_effect=eval_mock):
+            roles = read_role_files()
+            assert roles is read_role_files()
+            assert 'new-role' not in roles
+
+            with open(roles_path, 'a') as f:
+                f.write('\n[new-role]\nprompt = new\n')
+            assert 'new-role' in read_role_files()
+    finally:
+        shutil.rmtree(tmp_dir)
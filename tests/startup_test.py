@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+
+dirname = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(dirname, '..'))
+
+# what the first :AI command imports, its timing is measured by tests/benchmarks/startup_benchmark.py
+PACKAGE_STARTUP = """
+import json, sys
+import vim_ai.utils, vim_ai.context, vim_ai.complete
+print(json.dumps({
+    'modules': sorted(m for m in sys.modules if m.startswith('vim_ai')),
+}))
+"""
+
+def _run_startup(code):
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join([root_dir, dirname])
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=root_dir, env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+def test_lazy_package_imports():
+    result = _run_startup(PACKAGE_STARTUP)
+    assert 'vim_ai.complete' in result['modules']
+    assert 'vim_ai.image' not in result['modules']
+    assert 'vim_ai.chat' not in result['modules']
+    assert not [m for m in result['modules'] if m.startswith('vim_ai.providers')]
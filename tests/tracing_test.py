@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+import threading
+
+import vim_ai.tracing as tracing
+from vim_ai.chat import AI_chat_jobs_pool
+from vim_ai.tracing import Trace, bind_trace, current_trace, finish_trace, span, trace_chunks
+from vim_ai.utils import parse_chat_messages
+
+def make_trace(trace_dir):
+    trace = Trace('chat', trace_dir)
+    tracing._active_trace = trace
+    return trace
+
+def events_by_name(data):
+    return { event['name']: event for event in data['traceEvents'] if event['ph'] != 'M' }
+
+def test_trace_exports_chrome_trace_events():
+    with tempfile.TemporaryDirectory() as trace_dir:
+        trace = make_trace(trace_dir)
+        with span('make_ai_context'):
+            with span('role loading', roles=2):
+                pass
+        chunks = list(trace_chunks(iter([{ 'content': 'a' }, { 'content': 'b' }])))
+        assert len(chunks) == 2
+
+        path = finish_trace()
+        assert current_trace() is None
+        assert os.path.basename(path).endswith('_chat_{}.json'.format(trace.request_id))
+        with open(path) as f:
+            data = json.load(f)
+
+    assert data['otherData']['request_id'] == trace.request_id
+    events = events_by_name(data)
+    context_span = events['make_ai_context']
+    role_span = events['role loading']
+    assert context_span['ph'] == 'X'
+    assert context_span['ts'] <= role_span['ts']
+    assert role_span['ts'] + role_span['dur'] <= context_span['ts'] + context_span['dur']
+    assert role_span['args'] == { 'request_id': trace.request_id, 'roles': 2 }
+    assert events['provider request']['args']['chunks'] == 2
+    assert events['first chunk']['ph'] == 'i'
+    thread_names = [e for e in data['traceEvents'] if e['ph'] == 'M']
+    assert thread_names[0]['args']['name'] == threading.current_thread().name
+
+def test_spans_are_noop_without_trace():
+    tracing._active_trace = None
+    with span('make_ai_context') as s:
+        assert s is tracing._NO_SPAN
+    assert list(trace_chunks(iter([1, 2]))) == [1, 2]
+    assert finish_trace() is None
+
+def test_job_threads_record_into_bound_trace_only():
+    with tempfile.TemporaryDirectory() as trace_dir:
+        trace = Trace('chat', trace_dir)
+        tracing._active_trace = None
+        seen = []
+
+        def job():
+            seen.append(current_trace())
+            with bind_trace(trace):
+                with span('network wait'):
+                    seen.append(current_trace())
+
+        thread = threading.Thread(target=job)
+        thread.start()
+        thread.join()
+        assert seen == [None, trace]
+        assert [e['name'] for e in trace.events] == ['network wait']
+        assert trace.events[0]['tid'] == thread.ident
+
+def test_finished_trace_ignores_late_events():
+    with tempfile.TemporaryDirectory() as trace_dir:
+        trace = Trace('complete', trace_dir)
+        assert trace.write() is not None
+        assert trace.write() is None
+        with span('late', trace):
+            pass
+        assert trace.events == []
+
+def test_include_and_exec_are_traced():
+    with tempfile.TemporaryDirectory() as trace_dir:
+        trace = make_trace(trace_dir)
+        path = os.path.join(trace_dir, 'included.txt')
+        with open(path, 'w') as f:
+            f.write('hello')
+        parse_chat_messages('>>> include\n\n{}\n\n>>> exec\n\necho hi'.format(path))
+        finish_trace()
+    events = events_by_name(trace.to_json())
+    assert events['include']['args']['path'] == path
+    assert events['exec']['args']['cmd'] == 'echo hi'
+
+class FinishedJob(object):
+    def __init__(self, trace):
+        self.trace = trace
+
+    def pickup(self):
+        return ['answer'], True
+
+def test_chat_pool_traces_watcher_flush_and_undo_cleanup():
+    with tempfile.TemporaryDirectory() as trace_dir:
+        trace = Trace('chat', trace_dir)
+        pool = AI_chat_jobs_pool()
+        pool.pool[3] = FinishedJob(trace)
+        assert pool.pickup_lines(3) == ['answer']
+        assert pool.traces == { 3: trace }
+
+        pool.finish_trace(3, '0.002')
+        assert pool.traces == {}
+        assert trace.finished
+        assert len(os.listdir(trace_dir)) == 1
+
+    events = events_by_name(trace.to_json())
+    assert events['watcher flush']['args']['lines'] == 1
+    assert abs(events['undo cleanup']['dur'] - 2000) <= 1
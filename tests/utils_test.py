@@ -1,5 +1,6 @@
 import os
 import sys
+import json
 import tempfile
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
@@ -7,7 +8,8 @@ from vim_ai.utils import (
     load_module_compat, handle_completion_error, KnownError, 
     make_options, parse_include_paths, is_image_path, print_debug,
     load_token_from_env_variable, load_token_from_file_path, 
-    load_token_from_fn, encode_image, AIProviderUtils, subprocess_run_compat
+    load_token_from_fn, encode_image, AIProviderUtils, subprocess_run_compat,
+    save_b64_to_file, B64_DECODE_BLOCK_SIZE, iter_json_strings
 )
 
 # Debug tests
@@ -22,6 +24,9 @@ def test_print_debug():
         
         try:
             print_debug("test message")
+            vim_ai.utils.debug_log.flush_log()
+            with open(f.name) as log:
+                assert log.read().endswith("DEBUG: test message\n")
         finally:
             vim_ai.utils._vimai_thread_is_debug_active = original_debug
             os.unlink(f.name)
@@ -135,3 +140,121 @@ def test_ai_provider_utils():
     error = utils.make_known_error('test error')
     assert isinstance(error, KnownError)
     assert str(error) == 'test error'
+
+# Request body streaming tests
+def test_json_body_stream_matches_json_dumps():
+    """Test that streamed body is byte-identical to json.dumps"""
+    import json
+    from vim_ai.utils import JSONBodyStream
+    data = {
+        'model': 'gpt-4o',
+        'stream': True,
+        'temperature': 0.5,
+        'logit_bias': {2435: -100},
+        'stop': None,
+        'messages': [
+            {'role': 'user', 'content': [
+                {'type': 'text', 'text': 'příliš "žluťoučký"\n\tkůň 🐴 ' * 500},
+                {'type': 'image_url', 'image_url': {'url': 'data:image/png;base64,' + 'QUJD' * 50000}},
+            ]},
+        ],
+    }
+    body = JSONBodyStream(data, chunk_size=1024)
+    streamed = b''.join(body)
+    assert streamed == json.dumps(data).encode('utf-8')
+    assert len(body) == len(streamed)
+
+def test_json_body_stream_bounded_chunks():
+    """Test that large strings are not sent as a single chunk"""
+    from vim_ai.utils import JSONBodyStream
+    body = JSONBodyStream({'url': 'A' * 100000}, chunk_size=4096)
+    chunks = list(body)
+    assert len(chunks) > 1
+    assert max(len(chunk) for chunk in chunks) <= 2 * 4096
+
+# Provider registry tests
+def test_load_provider_registry():
+    """Test that provider scripts are imported once and reloaded on change"""
+    from unittest.mock import patch
+    from vim_ai.utils import load_provider
+    tmp_dir = tempfile.mkdtemp()
+    script_path = os.path.join(tmp_dir, 'custom_provider.py')
+    with open(script_path, 'w') as f:
+        f.write('class CustomProvider():\n    version = 1\n')
+    providers = { 'custom': { 'script_path': script_path, 'class_name': 'CustomProvider' } }
+
+    try:
+        with patch('vim_ai.utils.get_vim_global', return_value=providers):
+            provider_class = load_provider('custom')
+            assert provider_class.version == 1
+            assert load_provider('custom') is provider_class
+
+            with open(script_path, 'w') as f:
+                f.write('class CustomProvider():\n    version = 22\n')
+            assert load_provider('custom').version == 22
+    finally:
+        import shutil
+        shutil.rmtree(tmp_dir)
+
+def test_load_builtin_provider_from_package():
+    """Test that built-in providers are imported as package modules"""
+    from unittest.mock import patch
+    from vim_ai.utils import load_provider
+    script_path = os.path.join(os.path.dirname(__file__), '..', 'vim_ai', 'providers', 'bedrock.py')
+    providers = { 'bedrock': { 'script_path': script_path, 'class_name': 'BedrockProvider' } }
+    with patch('vim_ai.utils.get_vim_global', return_value=providers):
+        provider_class = load_provider('bedrock')
+    assert provider_class.__module__ == 'vim_ai.providers.bedrock'
+
+def test_save_b64_to_file_decodes_in_blocks():
+    import base64
+    data = os.urandom(B64_DECODE_BLOCK_SIZE * 2 + 7)
+    encoded = base64.b64encode(data).decode('ascii')
+    # wrapped base64 as returned by some APIs
+    wrapped = "\n".join(encoded[i:i + 76] for i in range(0, len(encoded), 76))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'image.png')
+        save_b64_to_file(path, wrapped)
+        with open(path, 'rb') as f:
+            assert f.read() == data
+        assert os.listdir(tmp_dir) == ['image.png']
+
+def test_save_b64_to_file_decodes_pieces():
+    import base64
+    data = os.urandom(B64_DECODE_BLOCK_SIZE * 2 + 7)
+    encoded = base64.b64encode(data).decode('ascii')
+    # pieces of arbitrary length, as read from a response stream
+    pieces = (encoded[i:i + 1001] for i in range(0, len(encoded), 1001))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'image.png')
+        save_b64_to_file(path, pieces)
+        with open(path, 'rb') as f:
+            assert f.read() == data
+
+def test_json_string_scanner_in_chunks():
+    document = json.dumps({
+        'images': ['ab/cd', 'e"f\\g\u00e9'],
+        'error': None,
+        'artifacts': [{ 'seed': 1, 'base64': 'QUJD' }],
+    }).replace('/', '\\/').encode('utf-8')
+    for size in (1, 2, 3, 7, len(document)):
+        chunks = (document[i:i + size] for i in range(0, len(document), size))
+        values = {}
+        for path, piece, last in iter_json_strings(chunks):
+            assert path not in values or not values[path][1]
+            values[path] = (values.get(path, ('', False))[0] + piece, last)
+        assert values == {
+            ('images', 0): ('ab/cd', True),
+            ('images', 1): ('e"f\\g\u00e9', True),
+            ('artifacts', 0, 'base64'): ('QUJD', True),
+        }
+
+def test_save_b64_to_file_removes_partial_file():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'image.png')
+        try:
+            save_b64_to_file(path, 'not base64!')
+            assert False, 'expected a decoding error'
+        except Exception:
+            pass
+        assert os.listdir(tmp_dir) == []
@@ -0,0 +1,587 @@
+# Minimal AWS client for the Bedrock runtime API: credential resolution,
+# SigV4 request signing and pooled HTTP(S) connections. Only the standard
+# library is used so that Bedrock works without the aws CLI.
+import calendar
+import configparser
+import datetime
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from urllib.parse import quote, urlsplit
+
+from vim_ai.metrics import add_request_bytes, mark_request_event
+from vim_ai.tracing import span
+from vim_ai.utils import subprocess_run_compat
+
+AUTH_ERROR_CODES = set([
+    'ExpiredToken',
+    'ExpiredTokenException',
+    'InvalidClientTokenId',
+    'InvalidSignatureException',
+    'SignatureDoesNotMatch',
+    'UnrecognizedClientException',
+])
+
+class AWSError(Exception):
+    def __init__(self, message, status=None, code=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.code = code
+
+    @property
+    def is_auth_error(self):
+        return self.code in AUTH_ERROR_CODES
+
+class AWSCredentialsError(AWSError):
+    def __init__(self, message):
+        super().__init__(message, code='NoCredentials')
+
+    @property
+    def is_auth_error(self):
+        return True
+
+class AWSCredentials(object):
+    def __init__(self, access_key, secret_key, token=None, expiration=None, source=None):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.token = token
+        self.expiration = expiration
+        self.source = source
+
+    def is_expired(self, margin=300):
+        return self.expiration is not None and time.time() + margin >= self.expiration
+
+# credentials resolution
+
+# profile -> (files cache key, credentials)
+_credentials_cache = {}
+_credentials_lock = threading.Lock()
+# profile -> (files cache key, region from the profile config)
+_region_cache = {}
+
+def _shared_credentials_path():
+    return os.path.expanduser(os.environ.get('AWS_SHARED_CREDENTIALS_FILE', '~/.aws/credentials'))
+
+def _config_path():
+    return os.path.expanduser(os.environ.get('AWS_CONFIG_FILE', '~/.aws/config'))
+
+def credentials_files_key():
+    key = []
+    for path in (_shared_credentials_path(), _config_path()):
+        try:
+            stat = os.stat(path)
+            key.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            key.append((path, None, None))
+    return tuple(key)
+
+def _read_ini(path):
+    parser = configparser.ConfigParser(interpolation=None)
+    try:
+        parser.read(path)
+    except configparser.Error:
+        pass
+    return parser
+
+def _section(parser, name):
+    if parser.has_section(name):
+        return dict(parser.items(name))
+    return {}
+
+def load_profile_config(profile):
+    """Returns merged settings of a profile from ~/.aws/config and ~/.aws/credentials"""
+    config = _read_ini(_config_path())
+    section_name = 'default' if profile == 'default' else 'profile ' + profile
+    settings = _section(config, section_name)
+    if not settings and profile != 'default':
+        settings = _section(config, profile)
+    settings.update(_section(_read_ini(_shared_credentials_path()), profile))
+    return settings
+
+_iso8601_re = re.compile(r"(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.\d+)?(Z|[+-]\d{2}:?\d{2})?\Z")
+
+def parse_expiration(value):
+    match = _iso8601_re.match(value.strip())
+    if not match:
+        raise AWSCredentialsError("Invalid credentials expiration: {}".format(value))
+    parts = [int(part) for part in match.groups()[:6]]
+    timestamp = calendar.timegm(tuple(parts) + (0, 0, 0))
+    offset = match.group(7)
+    if offset and offset != 'Z':
+        sign = -1 if offset[0] == '-' else 1
+        digits = offset[1:].replace(':', '')
+        timestamp -= sign * (int(digits[:2]) * 3600 + int(digits[2:]) * 60)
+    return timestamp
+
+def _run_credential_process(command):
+    result = subprocess_run_compat(command, shell=True, capture_output=True, text=True, timeout=60)
+    if result.returncode != 0:
+        raise AWSCredentialsError("credential_process failed: {}".format((result.stderr or '').strip()))
+    try:
+        data = json.loads(result.stdout)
+    except ValueError:
+        raise AWSCredentialsError("credential_process returned invalid JSON")
+    if data.get('Version') != 1 or not data.get('AccessKeyId') or not data.get('SecretAccessKey'):
+        raise AWSCredentialsError("credential_process returned unsupported credentials")
+    expiration = data.get('Expiration')
+    return AWSCredentials(
+        data['AccessKeyId'],
+        data['SecretAccessKey'],
+        data.get('SessionToken'),
+        parse_expiration(expiration) if expiration else None,
+        'credential_process',
+    )
+
+def _credentials_from_env():
+    access_key = os.environ.get('AWS_ACCESS_KEY_ID')
+    secret_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
+    if access_key and secret_key:
+        return AWSCredentials(access_key, secret_key, os.environ.get('AWS_SESSION_TOKEN'), source='env')
+    return None
+
+def _credentials_from_profile(profile):
+    settings = load_profile_config(profile)
+    if settings.get('aws_access_key_id') and settings.get('aws_secret_access_key'):
+        return AWSCredentials(
+            settings['aws_access_key_id'],
+            settings['aws_secret_access_key'],
+            settings.get('aws_session_token'),
+            source='profile',
+        )
+    if settings.get('credential_process'):
+        return _run_credential_process(settings['credential_process'])
+    return None
+
+def resolve_credentials(profile=None):
+    """Resolves credentials the same way the aws CLI does for static setups.
+
+    Without an explicit profile, AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY take
+    precedence, then the AWS_PROFILE (or default) profile is used. Profiles
+    can either contain static keys or a `credential_process`.
+    """
+    if not profile:
+        credentials = _credentials_from_env()
+        if credentials:
+            return credentials
+        profile = os.environ.get('AWS_PROFILE') or 'default'
+
+    files_key = credentials_files_key()
+    with _credentials_lock:
+        cached = _credentials_cache.get(profile)
+        if cached and cached[0] == files_key and not cached[1].is_expired():
+            return cached[1]
+        credentials = _credentials_from_profile(profile)
+        if not credentials:
+            raise AWSCredentialsError("Unable to locate AWS credentials for profile '{}'".format(profile))
+        _credentials_cache[profile] = (files_key, credentials)
+        return credentials
+
+def invalidate_credentials(profile=None):
+    with _credentials_lock:
+        if profile:
+            _credentials_cache.pop(profile, None)
+            _region_cache.pop(profile, None)
+        else:
+            _credentials_cache.clear()
+            _region_cache.clear()
+
+def resolve_region(profile=None, region=None):
+    if region:
+        return region
+    for name in ('AWS_REGION', 'AWS_DEFAULT_REGION'):
+        if os.environ.get(name):
+            return os.environ[name]
+    profile = profile or os.environ.get('AWS_PROFILE') or 'default'
+    files_key = credentials_files_key()
+    with _credentials_lock:
+        cached = _region_cache.get(profile)
+        if cached and cached[0] == files_key:
+            return cached[1]
+        region = load_profile_config(profile).get('region') or 'us-east-1'
+        _region_cache[profile] = (files_key, region)
+        return region
+
+# SigV4
+
+def _sha256_hex(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _hmac(key, message):
+    return hmac.new(key, message.encode('utf-8'), hashlib.sha256).digest()
+
+def _canonical_query(query):
+    if not query:
+        return ''
+    params = []
+    for pair in query.split('&'):
+        key, _, value = pair.partition('=')
+        params.append((quote(key, safe='-_.~'), quote(value, safe='-_.~')))
+    return '&'.join('{}={}'.format(key, value) for key, value in sorted(params))
+
+def sign_request(method, url, headers, body, credentials, region, service, now=None):
+    """Returns headers extended with SigV4 authentication headers.
+
+    `url` path is expected to be already URI-encoded, it is encoded once more
+    for the canonical request as AWS does for all services but S3.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    date_stamp = now.strftime('%Y%m%d')
+    parts = urlsplit(url)
+
+    signed = dict(headers)
+    signed['Host'] = parts.netloc
+    signed['X-Amz-Date'] = amz_date
+    if credentials.token:
+        signed['X-Amz-Security-Token'] = credentials.token
+
+    canonical_headers = sorted(
+        (name.lower(), ' '.join(str(value).split())) for name, value in signed.items()
+    )
+    signed_headers = ';'.join(name for name, _ in canonical_headers)
+    canonical_request = '\n'.join([
+        method,
+        quote(parts.path or '/', safe='/~'),
+        _canonical_query(parts.query),
+        ''.join('{}:{}\n'.format(name, value) for name, value in canonical_headers),
+        signed_headers,
+        _sha256_hex(body or b''),
+    ])
+
+    scope = '{}/{}/{}/aws4_request'.format(date_stamp, region, service)
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256',
+        amz_date,
+        scope,
+        _sha256_hex(canonical_request.encode('utf-8')),
+    ])
+    key = _hmac(('AWS4' + credentials.secret_key).encode('utf-8'), date_stamp)
+    key = _hmac(key, region)
+    key = _hmac(key, service)
+    key = _hmac(key, 'aws4_request')
+    signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    signed['Authorization'] = 'AWS4-HMAC-SHA256 Credential={}/{}, SignedHeaders={}, Signature={}'.format(
+        credentials.access_key, scope, signed_headers, signature,
+    )
+    return signed
+
+# connection pool
+
+_MAX_IDLE_CONNECTIONS = 4
+
+# (scheme, host, port) -> idle connections
+_connection_pool = {}
+_connection_pool_lock = threading.Lock()
+
+def _acquire_connection(pool_key, timeout):
+    with _connection_pool_lock:
+        idle = _connection_pool.get(pool_key)
+        connection = idle.pop() if idle else None
+    if connection is not None:
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        return connection, True
+    scheme, host, port = pool_key
+    connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+    return connection_class(host, port, timeout=timeout), False
+
+def _release_connection(pool_key, connection):
+    with _connection_pool_lock:
+        idle = _connection_pool.setdefault(pool_key, [])
+        if len(idle) < _MAX_IDLE_CONNECTIONS:
+            idle.append(connection)
+            return
+    connection.close()
+
+def close_connections():
+    with _connection_pool_lock:
+        connections = [c for idle in _connection_pool.values() for c in idle]
+        _connection_pool.clear()
+    for connection in connections:
+        connection.close()
+
+class AWSResponse(object):
+    """HTTP response that returns its connection to the pool once consumed"""
+
+    def __init__(self, pool_key, connection, response):
+        self._pool_key = pool_key
+        self._connection = connection
+        self._response = response
+        self.status = response.status
+        self.headers = response
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        add_request_bytes(received=len(data))
+        return data
+
+    def read1(self, amt):
+        """Returns available data without waiting for `amt` bytes if possible"""
+        read1 = getattr(self._response, 'read1', None)
+        data = read1(amt) if read1 else self._response.read(amt)
+        add_request_bytes(received=len(data))
+        return data
+
+    def close(self):
+        if self._connection is None:
+            return
+        connection = self._connection
+        self._connection = None
+        if self._response.isclosed() and not self._response.will_close:
+            _release_connection(self._pool_key, connection)
+        else:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class AWSClient(object):
+
+    def __init__(self, service, region=None, profile=None, endpoint_url=None, timeout=30):
+        self.service = service
+        self.profile = profile or None
+        self.region = resolve_region(self.profile, region)
+        self.endpoint_url = endpoint_url or 'https://{}.{}.amazonaws.com'.format(service, self.region)
+        self.timeout = timeout
+        parts = urlsplit(self.endpoint_url)
+        self._pool_key = (parts.scheme, parts.hostname, parts.port)
+        self._signing_service = 'bedrock' if service == 'bedrock-runtime' else service
+
+    def _send(self, method, path, body, headers):
+        credentials = resolve_credentials(self.profile)
+        signed_headers = sign_request(
+            method, self.endpoint_url + path, headers, body,
+            credentials, self.region, self._signing_service,
+        )
+        for attempt in range(2):
+            connection, reused = _acquire_connection(self._pool_key, self.timeout)
+            try:
+                with span('network wait', reused=reused):
+                    if connection.sock is None:
+                        connection.connect()
+                    mark_request_event('connected')
+                    connection.request(method, path, body=body, headers=signed_headers)
+                    add_request_bytes(sent=len(body))
+                    response = connection.getresponse()
+            except (http.client.BadStatusLine, ConnectionError):
+                connection.close()
+                # a pooled keep-alive connection may have been closed by the server
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            return AWSResponse(self._pool_key, connection, response)
+
+    def send(self, method, path, body, headers):
+        """Sends a signed request and returns an open AWSResponse
+
+        Raises AWSError for non 2xx responses.
+        """
+        response = self._send(method, path, body, headers)
+        if response.status >= 300:
+            with response:
+                raise self._make_error(response)
+        return response
+
+    def request(self, method, path, payload=None, headers=None):
+        with span('request serialization'):
+            body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        request_headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+        }
+        request_headers.update(headers or {})
+        return self.send(method, path, body, request_headers)
+
+    def request_json(self, method, path, payload=None, headers=None):
+        with self.request(method, path, payload, headers) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def _make_error(self, response):
+        raw = response.read().decode('utf-8', errors='replace')
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+        code = response.headers.getheader('x-amzn-ErrorType') or data.get('__type') or _xml_value(raw, 'Code') or ''
+        code = code.split(':')[0].split('#')[-1] or None
+        message = (data.get('message') or data.get('Message') or _xml_value(raw, 'Message')
+                   or raw or 'HTTP {}'.format(response.status))
+        error = AWSError(message, response.status, code)
+        if error.is_auth_error:
+            invalidate_credentials(self.profile)
+        return error
+
+# event stream (application/vnd.amazon.eventstream)
+
+_PRELUDE = struct.Struct('>III')
+_PRELUDE_LENGTH = 12
+_CRC_LENGTH = 4
+
+def _crc32(data):
+    return zlib.crc32(data) & 0xffffffff
+
+def _decode_header_value(data, offset, value_type):
+    if value_type == 0:
+        return True, offset
+    if value_type == 1:
+        return False, offset
+    if value_type == 2:
+        return struct.unpack_from('>b', data, offset)[0], offset + 1
+    if value_type == 3:
+        return struct.unpack_from('>h', data, offset)[0], offset + 2
+    if value_type == 4:
+        return struct.unpack_from('>i', data, offset)[0], offset + 4
+    if value_type in (5, 8):
+        # long and timestamp (ms since epoch)
+        return struct.unpack_from('>q', data, offset)[0], offset + 8
+    if value_type in (6, 7):
+        length = struct.unpack_from('>H', data, offset)[0]
+        offset += 2
+        value = bytes(data[offset:offset + length])
+        return (value.decode('utf-8') if value_type == 7 else value), offset + length
+    if value_type == 9:
+        return bytes(data[offset:offset + 16]), offset + 16
+    raise AWSError("Unknown event stream header type: {}".format(value_type), code='EventStreamError')
+
+def _decode_headers(data, offset, end):
+    headers = {}
+    while offset < end:
+        name_length = data[offset]
+        offset += 1
+        name = bytes(data[offset:offset + name_length]).decode('utf-8')
+        offset += name_length
+        value_type = data[offset]
+        offset += 1
+        headers[name], offset = _decode_header_value(data, offset, value_type)
+    return headers
+
+class EventStreamDecoder(object):
+    """Incremental decoder of the AWS event stream binary framing
+
+    Each message consists of a prelude (total length, headers length and
+    prelude CRC), headers, payload and CRC of the whole message. Data can be
+    fed in arbitrary pieces, complete messages are returned as
+    (headers, payload) tuples.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+    def feed(self, data):
+        buffer = self._buffer
+        buffer.extend(data)
+        messages = []
+        while len(buffer) >= _PRELUDE_LENGTH:
+            total_length, headers_length, prelude_crc = _PRELUDE.unpack_from(buffer)
+            if _crc32(bytes(buffer[:8])) != prelude_crc:
+                raise AWSError("Event stream prelude checksum mismatch", code='EventStreamError')
+            if headers_length > total_length - _PRELUDE_LENGTH - _CRC_LENGTH:
+                raise AWSError("Invalid event stream message length", code='EventStreamError')
+            if len(buffer) < total_length:
+                break
+            message = bytes(buffer[:total_length])
+            del buffer[:total_length]
+            message_crc = struct.unpack_from('>I', message, total_length - _CRC_LENGTH)[0]
+            if _crc32(message[:-_CRC_LENGTH]) != message_crc:
+                raise AWSError("Event stream message checksum mismatch", code='EventStreamError')
+            headers_end = _PRELUDE_LENGTH + headers_length
+            headers = _decode_headers(message, _PRELUDE_LENGTH, headers_end)
+            messages.append((headers, message[headers_end:-_CRC_LENGTH]))
+        return messages
+
+def iter_event_stream(response, chunk_size=8192):
+    """Yields decoded (headers, payload) messages of an AWSResponse"""
+    decoder = EventStreamDecoder()
+    with response:
+        while True:
+            data = response.read1(chunk_size)
+            if not data:
+                break
+            for message in decoder.feed(data):
+                yield message
+        if decoder.pending:
+            raise AWSError("Event stream ended with an incomplete message", code='EventStreamError')
+
+def _xml_value(raw, tag):
+    # query protocol services (STS) respond with XML errors
+    match = re.search(r"<{0}>(.*?)</{0}>".format(tag), raw, re.DOTALL)
+    return match.group(1).strip() if match else None
+
+def _model_path(model_id, action):
+    return '/model/{}/{}'.format(quote(model_id, safe=''), action)
+
+class BedrockRuntimeClient(AWSClient):
+
+    def __init__(self, region=None, profile=None, endpoint_url=None, timeout=30):
+        super().__init__('bedrock-runtime', region, profile, endpoint_url, timeout)
+
+    def converse(self, model_id, payload):
+        return self.request_json('POST', _model_path(model_id, 'converse'), payload)
+
+    def invoke_model(self, model_id, payload):
+        return self.request_json('POST', _model_path(model_id, 'invoke'), payload)
+
+    def invoke_model_stream(self, model_id, payload):
+        """Returns the open AWSResponse of InvokeModel, its body is read by the caller"""
+        return self.request('POST', _model_path(model_id, 'invoke'), payload)
+
+    def converse_stream(self, model_id, payload):
+        """Yields (event type, event) tuples of a ConverseStream response
+
+        Exceptions sent within the stream are raised as AWSError.
+        """
+        response = self.request(
+            'POST', _model_path(model_id, 'converse-stream'), payload,
+            {'Accept': 'application/vnd.amazon.eventstream'},
+        )
+        for headers, body in iter_event_stream(response):
+            message_type = headers.get(':message-type')
+            if message_type == 'event':
+                event = json.loads(body.decode('utf-8')) if body else {}
+                yield headers.get(':event-type'), event
+            elif message_type == 'exception':
+                try:
+                    data = json.loads(body.decode('utf-8'))
+                except ValueError:
+                    data = {}
+                code = headers.get(':exception-type') or 'UnknownException'
+                message = data.get('message') or data.get('Message') or body.decode('utf-8', errors='replace')
+                raise AWSError(message, code=code[:1].upper() + code[1:])
+            else:
+                raise AWSError(headers.get(':error-message') or 'Event stream error', code=headers.get(':error-code'))
+
+class STSClient(AWSClient):
+
+    def __init__(self, region=None, profile=None, endpoint_url=None, timeout=10):
+        super().__init__('sts', region, profile, endpoint_url, timeout)
+
+    def get_caller_identity(self):
+        body = b'Action=GetCallerIdentity&Version=2011-06-15'
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8',
+            'Accept': 'application/json',
+        }
+        with self.send('POST', '/', body, headers) as response:
+            return response.read()
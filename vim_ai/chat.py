@@ -5,7 +5,16 @@ import copy
 import json
 import traceback
 
-chat_py_imported = True
+from vim_ai.utils import (
+    ai_provider_utils, clear_echo_message, find_last_chat_role, get_buffer_lines,
+    handle_completion_error, load_provider, make_config, make_options,
+    parse_chat_header_config, parse_chat_messages, print_debug, render_text_chunks,
+    update_thread_shared_variables, vim_break_undo_sequence,
+)
+from vim_ai.config_snapshot import get_vim_global
+from vim_ai.metrics import instrument_chunks, start_request_metrics
+from vim_ai.profiling import profiled, stop_command_profiler
+from vim_ai.tracing import bind_trace, current_trace, finish_trace, trace_chunks
 
 def _populate_options(provider, options, default_options, show_default = False):
     vim.command("normal! O[chat]")
@@ -25,6 +34,7 @@ def _populate_options(provider, options, default_options, show_default = False):
 
         vim.command("normal! ioptions." + key + "=" + value + "\n")
 
+@profiled('chat')
 def run_ai_chat(context):
     update_thread_shared_variables()
     command_type = context['command_type']
@@ -33,11 +43,14 @@ def run_ai_chat(context):
     config_options = config['options']
     roles = context['roles']
     started_from_chat = context['started_from_chat'] == '1'
+    trace = current_trace()
+    # an async job takes over the trace, it is finished after the last lines are rendered
+    trace_handed_over = False
 
-    def initialize_chat_window():
-        file_content = vim.eval('trim(join(getline(1, "$"), "\n"))')
-        contains_user_prompt = re.search(r"^>>> (user|exec|include)", file_content, flags=re.MULTILINE)
-        lines = vim.eval('getline(1, "$")')
+    def initialize_chat_window(lines):
+        """Prepares the chat buffer, returns True if its content was modified"""
+        modified = False
+        contains_user_prompt = any(line.startswith(('>>> user', '>>> exec', '>>> include')) for line in lines)
 
         # if populate is set in config, populate once
         # it shouldn't re-populate after chat header options are modified (#158)
@@ -51,16 +64,19 @@ def run_ai_chat(context):
                 line_num = lines.index('[chat]') + 1
                 vim.command("normal! " + str(line_num) + "gg")
                 vim.command("normal! d}dd")
+                modified = True
 
         if not contains_user_prompt:
             # user role not found, put whole file content as an user prompt
             vim.command("normal! gg")
             vim.command("normal! O>>> user\n")
+            modified = True
 
         if populate or re_populate:
             vim.command("normal! gg")
+            modified = True
 
-            default_config = make_config(vim.eval('g:vim_ai_chat_default'))
+            default_config = make_config(get_vim_global('g:vim_ai_chat_default'))
             default_options = default_config['options']
 
             if is_populating_all:
@@ -69,7 +85,7 @@ def run_ai_chat(context):
                 default_provider_options = {}
                 # backward compatibility, provider does not have to implement it or it is empty
                 if hasattr(provider_class, "default_options_varname_chat") and provider_class.default_options_varname_chat:
-                    default_provider_options = make_options(vim.eval(provider_class.default_options_varname_chat))
+                    default_provider_options = make_options(get_vim_global(provider_class.default_options_varname_chat))
 
                 populated_options = default_options.copy()
                 populated_options.update(default_provider_options)
@@ -83,11 +99,12 @@ def run_ai_chat(context):
         vim_break_undo_sequence()
         vim.command("redraw")
 
-        last_role = re.match(r".*^(>>>|<<<) (\w+)", file_content, flags=re.DOTALL | re.MULTILINE)
-        if last_role and last_role.group(2) not in ('user', 'include', 'exec', 'info'):
+        last_role = find_last_chat_role(lines)
+        if last_role and last_role not in ('user', 'include', 'exec', 'info'):
             # last role is not a user role, most likely completion was cancelled before
             vim.command("normal! o")
             vim.command("normal! i\n>>> user\n\n")
+            modified = True
 
         if prompt:
             vim.command("normal! dd")
@@ -95,10 +112,17 @@ def run_ai_chat(context):
             vim_break_undo_sequence()
             vim.command("normal! G")
             vim.command("redraw")
+            modified = True
 
-    initialize_chat_window()
+        return modified
 
-    chat_config = parse_chat_header_config()
+    # single snapshot of the buffer shared by header, role and message parsing,
+    # it is only taken again if the chat window initialization changed the buffer
+    lines = get_buffer_lines()
+    if initialize_chat_window(lines):
+        lines = get_buffer_lines()
+
+    chat_config = parse_chat_header_config(lines)
     options = config_options.copy()
     options.update(chat_config['options'])
     provider = chat_config['provider'] or config['provider']
@@ -106,8 +130,8 @@ def run_ai_chat(context):
     initial_prompt = '\n'.join(options.get('initial_prompt', []))
     initial_messages = parse_chat_messages(initial_prompt)
 
-    chat_content = vim.eval('trim(join(getline(1, "$"), "\n"))')
-    print_debug("[{}] text:\n".format(command_type) + chat_content)
+    chat_content = "\n".join(lines).strip()
+    print_debug("[{}] text:\n{}", command_type, chat_content)
     chat_messages = parse_chat_messages(chat_content)
 
     messages = initial_messages + chat_messages
@@ -124,12 +148,14 @@ def run_ai_chat(context):
             print('Answering...')
             vim.command("redraw")
             provider_class = load_provider(provider)
+            request_metrics = start_request_metrics(provider, options, context)
             provider = provider_class(command_type, options, ai_provider_utils)
 
-            if vim.eval("g:vim_ai_async_chat") == "1":
-                ai_job_pool.new_job(context, messages, provider)
+            if get_vim_global("g:vim_ai_async_chat") == "1":
+                ai_job_pool.new_job(context, messages, provider, request_metrics, trace)
+                trace_handed_over = True
             else:
-                response_chunks = provider.request(messages)
+                response_chunks = trace_chunks(instrument_chunks(request_metrics, provider.request(messages)))
                 previous_type = ""
 
                 def _chunks_to_sections(chunks):
@@ -148,15 +174,26 @@ def run_ai_chat(context):
 
             return True
         else:
+            _prepare_provider(provider, command_type, options)
             return False
     except BaseException as error:
         handle_completion_error(provider, error)
-        print_debug("[{}] error: {}", command_type, traceback.format_exc())
+        print_debug("[{}] error: {}", command_type, traceback.format_exc(), level='error')
+    finally:
+        if not trace_handed_over:
+            finish_trace(trace)
+
 
+def _prepare_provider(provider_name, command_type, options):
+    """Lets the provider warm up when a chat is opened without a request"""
+    provider_class = load_provider(provider_name)
+    # backward compatibility, provider does not have to implement it
+    if hasattr(provider_class, "prepare"):
+        provider_class(command_type, options, ai_provider_utils).prepare()
 
 # wraps the AI chat job, shall be unique to a buffer
 class AI_chat_job(threading.Thread):
-    def __init__(self, context, messages, provider):
+    def __init__(self, context, messages, provider, request_metrics=None, trace=None):
         threading.Thread.__init__(self)
         self.lines = []
         self.buffer = ""
@@ -165,31 +202,36 @@ class AI_chat_job(threading.Thread):
         self.context = context
         self.cancelled = False
         self.provider = provider
+        self.request_metrics = request_metrics
+        self.trace = trace
         self.done = False
         self.lock = threading.RLock()
 
+    @profiled('chat_job', in_thread=True)
     def run(self):
         print_debug("AI_chat_job thread STARTED")
         try:
-            for chunk in self.provider.request(self.messages):
-                with self.lock:
-                    # For now, we only append whole lines to the buffer
-                    print_debug("Received chunk: '{}' => '{}'".format(chunk['type'], chunk['content']))
-                    if self.previous_type != chunk["type"] or "newsegment" in chunk:
-                        if self.previous_type != "":
-                            self.buffer += "\n"
-                        self.buffer += "\n<<< " + chunk["type"] + "\n\n"
-                        self.previous_type = chunk["type"]
-                    self.buffer += chunk["content"]
-                    if self.cancelled:
-                        self.buffer += "\n\nCANCELLED by user"
-                        print_debug("AI_chat_job cancelled during provider request")
-                    if "\n" in self.buffer:
-                        parts = self.buffer.split("\n")
-                        self.lines.extend(parts[:-1])
-                        self.buffer = parts[-1]
-                    if self.cancelled:
-                        break # Exit the loop
+            with bind_trace(self.trace):
+                chunks = trace_chunks(instrument_chunks(self.request_metrics, self.provider.request(self.messages)))
+                for chunk in chunks:
+                    with self.lock:
+                        # For now, we only append whole lines to the buffer
+                        print_debug("Received chunk: '{}' => '{}'", chunk['type'], chunk['content'])
+                        if self.previous_type != chunk["type"] or "newsegment" in chunk:
+                            if self.previous_type != "":
+                                self.buffer += "\n"
+                            self.buffer += "\n<<< " + chunk["type"] + "\n\n"
+                            self.previous_type = chunk["type"]
+                        self.buffer += chunk["content"]
+                        if self.cancelled:
+                            self.buffer += "\n\nCANCELLED by user"
+                            print_debug("AI_chat_job cancelled during provider request")
+                        if "\n" in self.buffer:
+                            parts = self.buffer.split("\n")
+                            self.lines.extend(parts[:-1])
+                            self.buffer = parts[-1]
+                        if self.cancelled:
+                            break # Exit the loop
         except Exception as e:
             with self.lock:
                 self.lines.append("")
@@ -212,10 +254,15 @@ class AI_chat_job(threading.Thread):
         print_debug("AI_chat_job thread DONE")
 
     def pickup_lines(self):
+        return self.pickup()[0]
+
+    def pickup(self):
+        """Returns new lines and whether the job is done, both taken atomically"""
         with self.lock:
             lines = copy.deepcopy(self.lines)
             self.lines = []
-        return lines
+            done = self.done
+        return lines, done
 
     def is_done(self):
         with self.lock:
@@ -231,18 +278,41 @@ class AI_chat_job(threading.Thread):
 class AI_chat_jobs_pool(object):
     def __init__(self):
         self.pool = {}
+        # traces of finished jobs waiting for the final undo cleanup
+        self.traces = {}
 
-    def new_job(self, context, messages, provider):
+    def new_job(self, context, messages, provider, request_metrics=None, trace=None):
         bufnr = context["bufnr"]
-        self.pool[bufnr] = AI_chat_job(context, messages, provider)
+        self.pool[bufnr] = AI_chat_job(context, messages, provider, request_metrics, trace)
+        # the job is profiled on its own, the streaming time belongs to it
+        stop_command_profiler()
         self.pool[bufnr].start()
         return self.pool[bufnr]
 
-    # pickup lines from a job based on bufnr
+    # pickup lines from a job based on bufnr, a finished job is released
+    # once its last lines are picked up so it does not keep the messages alive
     def pickup_lines(self, bufnr):
-        if bufnr in self.pool:
-            return self.pool[bufnr].pickup_lines()
-        return []
+        job = self.pool.get(bufnr)
+        if job is None:
+            return []
+        started = time.perf_counter()
+        lines, done = job.pickup()
+        if job.trace is not None:
+            job.trace.add_span('watcher flush', started, time.perf_counter(), lines=len(lines), done=done)
+        if done and self.pool.get(bufnr) is job:
+            del self.pool[bufnr]
+            if job.trace is not None:
+                self.traces[bufnr] = job.trace
+        return lines
+
+    def finish_trace(self, bufnr, cleanup_time=0):
+        """Records the undo cleanup (seconds measured by vim) and writes the trace of the finished job"""
+        trace = self.traces.pop(bufnr, None)
+        if trace is None:
+            return
+        ended = time.perf_counter()
+        trace.add_span('undo cleanup', ended - float(cleanup_time), ended)
+        finish_trace(trace)
 
     def is_job_done(self, bufnr):
         if bufnr in self.pool:
@@ -250,17 +320,17 @@ class AI_chat_jobs_pool(object):
         return True
 
     def cancel_job(self, bufnr):
-        print_debug("Attempting to cancel job for bufnr {}".format(bufnr))
+        print_debug("Attempting to cancel job for bufnr {}", bufnr)
         if bufnr in self.pool:
             job = self.pool[bufnr]
             if not job.is_done():
                 job.cancel()
-                print_debug("Cancellation signal sent to job for bufnr {}".format(bufnr))
+                print_debug("Cancellation signal sent to job for bufnr {}", bufnr)
                 return True
             else:
-                print_debug("Job for bufnr {} is already done.".format(bufnr))
+                print_debug("Job for bufnr {} is already done.", bufnr)
                 return False
-        print_debug("No active job found for bufnr {} to cancel.".format(bufnr))
+        print_debug("No active job found for bufnr {} to cancel.", bufnr)
         return False
 
 ai_job_pool = AI_chat_jobs_pool()
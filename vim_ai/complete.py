@@ -1,7 +1,16 @@
 import vim
-
-complete_py_imported = True
-
+import traceback
+
+from vim_ai.utils import (
+    KnownError, ai_provider_utils, clear_echo_message, handle_completion_error,
+    load_provider, make_config, parse_chat_messages, print_debug, render_text_chunks,
+    update_thread_shared_variables,
+)
+from vim_ai.metrics import instrument_chunks, start_request_metrics
+from vim_ai.profiling import profiled
+from vim_ai.tracing import finish_trace, trace_chunks
+
+@profiled('complete')
 def run_ai_completition(context):
     update_thread_shared_variables()
     command_type = context['command_type']
@@ -23,11 +32,12 @@ def run_ai_completition(context):
             initial_prompt = '\n'.join(initial_prompt)
             chat_content = "{}\n\n>>> user\n\n{}".format(initial_prompt, prompt).strip()
             messages = parse_chat_messages(chat_content)
-            print_debug("[{}] text:\n".format(command_type) + chat_content)
+            print_debug("[{}] text:\n{}", command_type, chat_content)
 
             provider_class = load_provider(config['provider'])
+            request_metrics = start_request_metrics(config['provider'], config_options, context)
             provider = provider_class(command_type, config_options, ai_provider_utils)
-            response_chunks = provider.request(messages)
+            response_chunks = trace_chunks(instrument_chunks(request_metrics, provider.request(messages)))
 
             text_chunks = map(
                 lambda c: c.get("content"),
@@ -39,4 +49,6 @@ def run_ai_completition(context):
             clear_echo_message()
     except BaseException as error:
         handle_completion_error(config['provider'], error)
-        print_debug("[{}] error: {}", command_type, traceback.format_exc())
+        print_debug("[{}] error: {}", command_type, traceback.format_exc(), level='error')
+    finally:
+        finish_trace()
@@ -0,0 +1,35 @@
+# Snapshot of g:vim_ai_* variables, pushed from Vim whenever any of them changes
+# (see s:SyncConfigSnapshot). Reading a plain dict is much cheaper than
+# vim.eval and it is safe to do from worker threads.
+import vim
+
+_MISSING = object()
+
+_snapshot = None
+_version = 0
+
+def load_config_snapshot(values):
+    global _snapshot
+    global _version
+    _snapshot = values
+    _version += 1
+
+def get_config_version():
+    return _version
+
+def get_vim_global(name, default=_MISSING):
+    """Returns the value of a global variable, e.g. `g:vim_ai_debug`.
+
+    Values are served from the snapshot, vim.eval is only used when the
+    snapshot was not pushed yet or the variable is not a g:vim_ai_* one.
+    """
+    key = name[2:] if name.startswith('g:') else name
+    snapshot = _snapshot
+    if snapshot is not None and key.startswith('vim_ai_'):
+        if key in snapshot:
+            return snapshot[key]
+        if default is not _MISSING:
+            return default
+    if default is not _MISSING and vim.eval("exists('{}')".format(name)) != '1':
+        return default
+    return vim.eval(name)
@@ -2,31 +2,44 @@ import vim
 import re
 import os
 import configparser
+import json
+import time
 
-if "PYTEST_VERSION" in os.environ:
-    from .utils import *
-else:
-    try:
-        from utils import DEFAULT_ROLE_NAME, read_role_files, parse_include_paths, enhance_roles_with_custom_function
-    except ImportError:
-        from .utils import DEFAULT_ROLE_NAME, read_role_files, parse_include_paths, enhance_roles_with_custom_function
-
-context_py_imported = True
+from vim_ai.utils import (
+    DEFAULT_ROLE_NAME, enhance_roles_with_custom_function, load_custom_roles,
+    print_debug, read_role_files,
+)
+from vim_ai.config_snapshot import get_vim_global
+from vim_ai.git_context import get_git_context
+from vim_ai.metrics import record_context_time
+from vim_ai.project_index import get_project_index
+from vim_ai.retrieval import find_relevant_chunks
+from vim_ai.tracing import span, start_trace
 
-def merge_deep_recursive(target, source = {}):
-    source = source.copy()
+def merge_deep_recursive(target, source, owned):
     for key, value in source.items():
-        if isinstance(value, dict):
-            target_child = target.setdefault(key, {})
-            merge_deep_recursive(target_child, value)
+        current = target.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            if id(current) not in owned:
+                # copy-on-write, the nested dict still belongs to one of the inputs
+                current = current.copy()
+                owned.add(id(current))
+                target[key] = current
+            merge_deep_recursive(current, value, owned)
         else:
             target[key] = value
     return target
 
 def merge_deep(objects):
+    """Deep merges dicts into a new dict in a single pass.
+
+    Nested dicts are shared with the inputs until a later object overrides
+    some of their keys, the inputs are never modified.
+    """
     result = {}
+    owned = set() # ids of nested dicts created by this merge
     for o in objects:
-        merge_deep_recursive(result, o)
+        merge_deep_recursive(result, o, owned)
     return result
 
 def is_deprecated_role_syntax(roles, role):
@@ -78,11 +91,14 @@ def parse_role_section(role):
         obj[primitive] = role.get(key)
     return result
 
-def load_role_config(role):
-    roles = read_role_files()
-    roles = dict(roles)
-
+def load_roles():
+    roles = dict(read_role_files())
     enhance_roles_with_custom_function(roles)
+    return roles
+
+def load_role_config(role, roles=None):
+    if roles is None:
+        roles = load_roles()
 
     postfixes = ["", ".complete", ".edit", ".chat", ".image"]
     if not any(["{}{}".format(role, postfix) in roles for postfix in postfixes]):
@@ -114,14 +130,74 @@ def parse_prompt_and_role_config(user_instruction, command_type):
 
     last_role = roles[-1] if roles else ''
     user_prompt = user_instruction[user_instruction.index(last_role) + len(last_role):].strip() # strip roles
-    role_results = [load_role_config(role) for role in [DEFAULT_ROLE_NAME] + roles]
+    config = resolve_role_config(roles, command_type)
+    return user_prompt, config, roles
+
+# memoized results of resolve_role_config and make_ai_context config merging,
+# they are shared between calls and must not be modified
+_role_config_cache = {}
+_final_config_cache = {}
+_CONFIG_CACHE_SIZE = 64
+
+def _cache_put(cache, key, value):
+    if len(cache) >= _CONFIG_CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+
+def resolve_role_config(roles, command_type):
+    """Merges default and given role configs for the command type.
+
+    The result is memoized until the role files or custom roles change.
+    """
+    role_files = read_role_files()
+    custom_roles = load_custom_roles()
+    key = (tuple(roles), command_type)
+    cached = _role_config_cache.get(key)
+    if cached and cached['role_files'] is role_files:
+        if cached['custom_roles'] is custom_roles:
+            return cached['config']
+        # the roles function returns a new object once its ttl expires
+        fingerprint = _custom_roles_fingerprint(custom_roles)
+        if fingerprint is not None and fingerprint == cached['custom_roles_fingerprint']:
+            cached['custom_roles'] = custom_roles
+            return cached['config']
+
+    all_roles = dict(role_files)
+    all_roles.update(custom_roles)
+    role_results = [load_role_config(role, all_roles) for role in [DEFAULT_ROLE_NAME] + roles]
     parsed_role = merge_deep(role_results)
     config = merge_deep([
         parsed_role.get('role_default', {}),
         parsed_role.get('role_' + command_type, {}),
     ])
-    role_prompt = config.get('prompt', '')
-    return user_prompt, config, roles
+    _cache_put(_role_config_cache, key, {
+        'role_files': role_files,
+        'custom_roles': custom_roles,
+        'custom_roles_fingerprint': _custom_roles_fingerprint(custom_roles),
+        'config': config,
+    })
+    return config
+
+def _config_fingerprint(config):
+    return json.dumps(config, sort_keys=True)
+
+def _custom_roles_fingerprint(custom_roles):
+    try:
+        return _config_fingerprint(custom_roles)
+    except (TypeError, ValueError):
+        return None
+
+def resolve_final_config(config_default, config_extension, role_config, roles, command_type):
+    try:
+        key = (tuple(roles), command_type, _config_fingerprint(config_default), _config_fingerprint(config_extension))
+    except (TypeError, ValueError):
+        return merge_deep([config_default, config_extension, role_config])
+    cached = _final_config_cache.get(key)
+    if cached and cached['role_config'] is role_config:
+        return cached['config']
+    config = merge_deep([config_default, config_extension, role_config])
+    _cache_put(_final_config_cache, key, { 'role_config': role_config, 'config': config })
+    return config
 
 def make_selection_boundary(user_selection, selection_boundary):
     if selection_boundary != '```':
@@ -153,8 +229,13 @@ def make_prompt(config_prompt, user_prompt, user_selection, selection_boundary):
     prompt = "{}{}{}".format(config_prompt, delimiter, prompt)
     return prompt
 
-def enhance_prompt_with_context(prompt, roles, command_type):
-    """Enhance prompt with automatic context for Kiro-like roles"""
+def enhance_prompt_with_context(prompt, roles, command_type, query=None):
+    """Enhance prompt with automatic context for Kiro-like roles
+
+    Relevant code is ranked against the query (the user's prompt and
+    selection), not the role's prompt which is the same for every request.
+    """
+    query = prompt if query is None else query
     context_roles = ['codebase', 'refactor', 'debug', 'review', 'architect', 'test', 'docs', 'project']
     
     # Check if any context-aware role is being used
@@ -192,13 +273,9 @@ def enhance_prompt_with_context(prompt, roles, command_type):
         # Add basic project structure for specific roles
         if any(role in ['codebase', 'architect', 'project'] for role in roles):
             try:
-                # Get basic file listing
-                import glob
+                # Get basic file listing from the persistent project index
                 common_patterns = ['*.py', '*.js', '*.ts', '*.java', '*.go', '*.rs', '*.cpp', '*.c', '*.h']
-                project_files = []
-                for pattern in common_patterns:
-                    files = glob.glob(os.path.join(cwd, '**', pattern), recursive=True)
-                    project_files.extend([os.path.relpath(f, cwd) for f in files[:5]])  # Limit to 5 per type
+                project_files = get_project_index(cwd).find_files(common_patterns, limit_per_pattern=5)
                 
                 if project_files:
                     context_parts.append("Key project files:")
@@ -207,16 +284,24 @@ def enhance_prompt_with_context(prompt, roles, command_type):
             except:
                 pass
         
+        # Attach the code chunks most relevant to the prompt
+        if query.strip() and get_vim_global("g:vim_ai_context_retrieval", "0") == "1":
+            try:
+                budget = int(get_vim_global("g:vim_ai_context_retrieval_budget", "1500"))
+                relevant_chunks = find_relevant_chunks(cwd, query, budget, exclude_text=prompt)
+                if relevant_chunks:
+                    context_parts.append("Relevant code:")
+                    context_parts.extend(relevant_chunks)
+            except Exception as e:
+                print_debug("Context retrieval failed: {}", e)
+        
         # Add git context for git role
         if 'git' in roles:
             try:
-                import subprocess
-                result = subprocess.run(['git', 'status', '--porcelain'], 
-                                      capture_output=True, text=True, timeout=5, cwd=cwd)
-                if result.returncode == 0 and result.stdout.strip():
-                    context_parts.append("Git status:")
-                    for line in result.stdout.strip().split('\n')[:10]:  # Limit lines
-                        context_parts.append("  {}".format(line))
+                background = get_vim_global("g:vim_ai_git_context_async", "1") == "1"
+                git_context = get_git_context(cwd, background=background)
+                if git_context:
+                    context_parts.extend(git_context)
             except:
                 pass
         
@@ -226,25 +311,32 @@ def enhance_prompt_with_context(prompt, roles, command_type):
     
     except Exception as e:
         # If context enhancement fails, just return original prompt
-        print_debug("Context enhancement failed: {}".format(e))
+        print_debug("Context enhancement failed: {}", e)
     
     return prompt
 
 def make_ai_context(params):
+    started_at = time.perf_counter()
     config_default = params['config_default']
     config_extension = params['config_extension']
     user_instruction = params['user_instruction']
     user_selection = params['user_selection']
     command_type = params['command_type']
 
-    user_prompt, role_config, roles = parse_prompt_and_role_config(user_instruction, command_type)
-    final_config = merge_deep([config_default, config_extension, role_config])
-    selection_boundary = final_config['options'].get('selection_boundary', '')
-    config_prompt = final_config.get('prompt', '')
-    prompt = make_prompt(config_prompt, user_prompt, user_selection, selection_boundary)
-    
-    # Enhance prompt with automatic context for Kiro-like roles
-    prompt = enhance_prompt_with_context(prompt, roles, command_type)
+    # every command starts here, its trace is finished once the response is rendered
+    start_trace(command_type)
+    with span('make_ai_context'):
+        with span('role loading'):
+            user_prompt, role_config, roles = parse_prompt_and_role_config(user_instruction, command_type)
+            final_config = resolve_final_config(config_default, config_extension, role_config, roles, command_type)
+        selection_boundary = final_config['options'].get('selection_boundary', '')
+        config_prompt = final_config.get('prompt', '')
+        prompt = make_prompt(config_prompt, user_prompt, user_selection, selection_boundary)
+
+        # Enhance prompt with automatic context for Kiro-like roles
+        query = '\n'.join(part for part in (user_prompt, user_selection) if part)
+        prompt = enhance_prompt_with_context(prompt, roles, command_type, query)
+    record_context_time(time.perf_counter() - started_at)
 
     return {
         'command_type': command_type,
@@ -0,0 +1,165 @@
+import atexit
+import datetime
+import os
+import re
+import queue
+import threading
+
+LEVELS = { 'debug': 10, 'info': 20, 'warning': 30, 'error': 40 }
+# longer strings are truncated in the logged payloads
+MAX_VALUE_LENGTH = 2000
+# base64 payloads (images, documents) are never written
+_BASE64_RE = re.compile(r'^(data:[\w/+.-]+;base64,)?[A-Za-z0-9+/=\r\n]{256,}$')
+# the writer thread wakes up at least this often to flush the buffer
+FLUSH_INTERVAL = 0.5
+# buffered lines written by the thread in one go
+MAX_BATCH_LINES = 256
+
+def redact(value, max_length=MAX_VALUE_LENGTH):
+    """Returns a copy of the value with base64 data replaced and long strings truncated"""
+    if isinstance(value, dict):
+        return { key: redact(item, max_length) for key, item in value.items() }
+    if isinstance(value, (list, tuple)):
+        return [redact(item, max_length) for item in value]
+    if isinstance(value, bytes):
+        return '<{} bytes>'.format(len(value))
+    if isinstance(value, str) and len(value) > max_length:
+        if _BASE64_RE.match(value):
+            return '<base64 redacted, {} chars>'.format(len(value))
+        return '{}... <truncated, {} chars>'.format(value[:max_length], len(value))
+    return value
+
+def format_message(text, args, max_length=MAX_VALUE_LENGTH):
+    """Formats the message, arguments are redacted and callables are evaluated first"""
+    if not args:
+        return text
+    values = []
+    for arg in args:
+        if callable(arg):
+            arg = arg()
+        values.append(redact(arg, max_length))
+    return text.format(*values)
+
+class DebugLogWriter(threading.Thread):
+    """Appends lines to the log file from a background thread
+
+    The file stays open between writes, it is rotated to `path.1`,
+    `path.2`, ... once it grows over max_size bytes.
+    """
+    def __init__(self, path, max_size, backups):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.max_size = max_size
+        self.backups = backups
+        self.queue = queue.Queue()
+        self.file = None
+
+    def write(self, line):
+        self.queue.put(line)
+
+    def flush(self):
+        """Blocks until all queued lines are written"""
+        if self.is_alive():
+            self.queue.join()
+
+    def _open(self):
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+        for index in range(self.backups - 1, 0, -1):
+            source = '{}.{}'.format(self.path, index)
+            if os.path.exists(source):
+                os.replace(source, '{}.{}'.format(self.path, index + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+
+    def _write_batch(self, lines):
+        try:
+            self._open()
+            self.file.write(''.join(lines))
+            self.file.flush()
+            if self.max_size and self.file.tell() >= self.max_size:
+                self._rotate()
+        except (IOError, OSError):
+            # debug logging must never break the plugin
+            if self.file is not None:
+                self.file.close()
+            self.file = None
+
+    def run(self):
+        while True:
+            try:
+                line = self.queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                continue
+            if line is None:
+                self.queue.task_done()
+                break
+            lines = [line]
+            while len(lines) < MAX_BATCH_LINES:
+                try:
+                    next_line = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if next_line is None:
+                    # keep the stop marker for the next iteration
+                    self.queue.task_done()
+                    self.queue.put(None)
+                    break
+                lines.append(next_line)
+            self._write_batch(lines)
+            for _ in lines:
+                self.queue.task_done()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def stop(self):
+        if self.is_alive():
+            self.queue.put(None)
+            self.join(5)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def _get_writer(path, max_size, backups):
+    global _writer
+    with _writer_lock:
+        writer = _writer
+        if writer is None or writer.path != path or not writer.is_alive():
+            if writer is not None:
+                writer.stop()
+            writer = DebugLogWriter(path, max_size, backups)
+            writer.start()
+            _writer = writer
+        writer.max_size = max_size
+        writer.backups = backups
+        return writer
+
+def write_log(path, level, text, args, max_size=0, backups=1, max_length=MAX_VALUE_LENGTH):
+    try:
+        message = format_message(text, args, max_length)
+    except Exception as error:
+        message = '{} <formatting failed: {}>'.format(text, error)
+    line = '[{}] {}: {}\n'.format(datetime.datetime.now(), level.upper(), message)
+    _get_writer(path, max_size, backups).write(line)
+
+def flush_log():
+    writer = _writer
+    if writer is not None:
+        writer.flush()
+
+def close_log():
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.stop()
+            _writer = None
+
+atexit.register(close_log)
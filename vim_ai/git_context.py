@@ -0,0 +1,189 @@
+import os
+import subprocess
+import threading
+import time
+
+from vim_ai.utils import print_debug
+
+# lines kept from each git command, the rest of the output is never read
+MAX_CONTEXT_LINES = 10
+# unstaged edits do not touch .git/index, cached context is recomputed after this many seconds
+MAX_CONTEXT_AGE = 30
+GIT_COMMAND_TIMEOUT = 5
+
+def find_git_dir(path):
+    """Returns (work_tree, git_dir) of the repository containing the path, or None"""
+    path = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            return path, dot_git
+        if os.path.isfile(dot_git):
+            # worktrees and submodules point to the real git dir
+            try:
+                with open(dot_git, encoding='utf-8') as f:
+                    content = f.read().strip()
+            except (IOError, OSError):
+                return None
+            if content.startswith('gitdir:'):
+                git_dir = content[len('gitdir:'):].strip()
+                return path, os.path.normpath(os.path.join(path, git_dir))
+            return None
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+def _read_head(git_dir):
+    try:
+        with open(os.path.join(git_dir, 'HEAD'), encoding='utf-8') as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return ''
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _common_dir(git_dir):
+    try:
+        with open(os.path.join(git_dir, 'commondir'), encoding='utf-8') as f:
+            return os.path.normpath(os.path.join(git_dir, f.read().strip()))
+    except (IOError, OSError):
+        return git_dir
+
+def make_cache_key(git_dir):
+    """Changes whenever the index, HEAD or the checked out branch moves"""
+    head = _read_head(git_dir)
+    ref_mtime = None
+    if head.startswith('ref:'):
+        ref = head[len('ref:'):].strip()
+        ref_mtime = _mtime(os.path.join(_common_dir(git_dir), *ref.split('/')))
+    return (
+        head,
+        _mtime(os.path.join(git_dir, 'index')),
+        _mtime(os.path.join(git_dir, 'HEAD')),
+        ref_mtime,
+    )
+
+def run_git_lines(args, cwd, max_lines=MAX_CONTEXT_LINES, timeout=GIT_COMMAND_TIMEOUT):
+    """Runs git and returns at most max_lines of its output, git is killed once they are read"""
+    try:
+        process = subprocess.Popen(
+            ['git'] + args, cwd=cwd,
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        return None
+    timer = threading.Timer(timeout, process.kill)
+    timer.start()
+    lines = []
+    try:
+        for line in process.stdout:
+            lines.append(line.decode('utf-8', errors='replace').rstrip('\n'))
+            if len(lines) >= max_lines:
+                break
+    finally:
+        timer.cancel()
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0 and len(lines) < max_lines:
+        return None
+    return lines
+
+def build_git_context(work_tree, git_dir):
+    """Returns git context lines
+
+    Only the output is bounded, git still diffs and walks the whole work
+    tree, so on large repositories this belongs in a background thread.
+    """
+    parts = []
+    head = _read_head(git_dir)
+    if head.startswith('ref: refs/heads/'):
+        parts.append("Git branch: {}".format(head[len('ref: refs/heads/'):]))
+    elif head:
+        parts.append("Git HEAD: {} (detached)".format(head[:12]))
+
+    changes = run_git_lines(
+        # files over the count are collapsed into a '...' line followed by the summary
+        ['diff', 'HEAD', '--stat=100', '--stat-count={}'.format(MAX_CONTEXT_LINES - 2)],
+        work_tree, max_lines=MAX_CONTEXT_LINES,
+    )
+    if changes:
+        parts.append("Git changes:")
+        parts.extend("  {}".format(line.strip()) for line in changes)
+
+    untracked = run_git_lines(
+        ['ls-files', '--others', '--exclude-standard', '--directory', '--no-empty-directory'],
+        work_tree, max_lines=MAX_CONTEXT_LINES,
+    )
+    if untracked:
+        parts.append("Untracked files:")
+        parts.extend("  {}".format(line) for line in untracked)
+    return parts
+
+class _CachedGitContext(object):
+    def __init__(self):
+        self.key = None
+        self.lines = None
+        self.created_at = 0
+        self.refreshing = False
+
+_git_context_cache = {}
+_git_context_lock = threading.Lock()
+
+def _refresh(work_tree, git_dir, entry):
+    key = make_cache_key(git_dir)
+    try:
+        lines = build_git_context(work_tree, git_dir)
+    except Exception as error:
+        print_debug("[git] context failed: {}", error)
+        lines = []
+    with _git_context_lock:
+        entry.key = key
+        entry.lines = lines
+        entry.created_at = time.time()
+        entry.refreshing = False
+    return lines
+
+def _refresh_in_background(work_tree, git_dir, entry):
+    thread = threading.Thread(target=_refresh, args=(work_tree, git_dir, entry))
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def get_git_context(cwd, background=False):
+    """Returns cached git context lines of the repository containing cwd
+
+    The cache is valid until .git/index, HEAD or the current branch ref
+    changes. With background=True a stale entry is returned as it is (or
+    None when there is none yet) and the refresh runs in a thread.
+    """
+    found = find_git_dir(cwd)
+    if not found:
+        return None
+    work_tree, git_dir = found
+    key = make_cache_key(git_dir)
+    with _git_context_lock:
+        entry = _git_context_cache.get(work_tree)
+        if entry is None:
+            entry = _CachedGitContext()
+            _git_context_cache[work_tree] = entry
+        is_fresh = entry.key == key and time.time() - entry.created_at < MAX_CONTEXT_AGE
+        if is_fresh or (background and entry.refreshing):
+            return entry.lines
+        if background:
+            entry.refreshing = True
+            lines = entry.lines
+    if background:
+        _refresh_in_background(work_tree, git_dir, entry)
+        return lines
+    return _refresh(work_tree, git_dir, entry)
+
+def invalidate_git_context():
+    with _git_context_lock:
+        _git_context_cache.clear()
@@ -1,39 +1,199 @@
 import vim
 import datetime
 import os
+import threading
+import traceback
 
-image_py_imported = True
+from vim_ai.utils import (
+    ai_provider_utils, clear_echo_message, format_completion_error, handle_completion_error,
+    load_provider, print_debug, save_b64_to_file, update_thread_shared_variables,
+)
+from vim_ai.config_snapshot import get_vim_global
+from vim_ai.metrics import instrument_chunks, start_request_metrics
+from vim_ai.profiling import profiled
+from vim_ai.tracing import bind_trace, current_trace, finish_trace, trace_chunks
 
-def make_image_path(ui):
+def make_image_path(ui, timestamp=None, index=0):
     download_dir = ui.get('download_dir', vim.eval('getcwd()'))
-    
+
+    if timestamp is None:
+        timestamp = make_image_timestamp()
+    # images of a single request share the timestamp, the first one keeps the plain name
+    suffix = '_{}'.format(index + 1) if index else ''
+    filename = 'vim_ai_{}{}.png'.format(timestamp, suffix)
+    return os.path.join(download_dir, filename)
+
+def make_image_timestamp():
     try:
         utc = datetime.UTC  # Python 3.11+
     except AttributeError:
         utc = datetime.timezone.utc  # Older versions
-    timestamp = datetime.datetime.now(utc).strftime("%Y%m%dT%H%M%SZ")
-    filename = 'vim_ai_{}.png'.format(timestamp)
-    return os.path.join(download_dir, filename)
+    return datetime.datetime.now(utc).strftime("%Y%m%dT%H%M%SZ")
+
+# wraps a single image request, runs in a background thread
+class AI_image_job(threading.Thread):
+    def __init__(self, batch, prompt, provider, request_metrics=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.batch = batch
+        self.prompt = prompt
+        self.provider = provider
+        self.request_metrics = request_metrics
+
+    def run(self):
+        print_debug("AI_image_job thread STARTED")
+        try:
+            with bind_trace(self.batch.trace):
+                chunks = trace_chunks(instrument_chunks(self.request_metrics, self.provider.request_image(self.prompt)))
+                for image in chunks:
+                    path = self.batch.reserve_path()
+                    save_b64_to_file(path, image['b64_data'])
+                    self.batch.add_message("Image: {}".format(path))
+        except Exception as error:
+            message = format_completion_error(self.batch.provider_name, error)
+            if message is None:
+                message = "Error generating image: {}".format(error)
+                print_debug("[image] error: {}", traceback.format_exc(), level='error')
+            self.batch.add_message(message, is_error=True)
+        finally:
+            self.batch.job_finished()
+        print_debug("AI_image_job thread DONE")
+
+# images generated for the prompt of a single :AIImage command, one job per variation,
+# the jobs and the batches of other commands run concurrently
+class AI_image_batch(object):
+    def __init__(self, ui, provider_name, jobs_count, trace=None):
+        self.ui = ui
+        self.provider_name = provider_name
+        self.trace = trace
+        self.timestamp = make_image_timestamp()
+        self.jobs_count = jobs_count
+        self.finished_jobs = 0
+        self.images_count = 0
+        self.messages = []
+        self.paths = []
+        self.has_error = False
+        self.lock = threading.Lock()
+
+    def reserve_path(self):
+        # concurrent batches may share the timestamp, skip names that are already taken
+        with self.lock:
+            while True:
+                path = make_image_path(self.ui, self.timestamp, self.images_count)
+                self.images_count += 1
+                if not _reserve_image_path(path):
+                    continue
+                self.paths.append(path)
+                return path
+
+    def add_message(self, message, is_error=False):
+        with self.lock:
+            self.messages.append(message)
+            self.has_error = self.has_error or is_error
+
+    def job_finished(self):
+        with self.lock:
+            self.finished_jobs += 1
 
+    def get_status(self):
+        with self.lock:
+            return {
+                'done': 1 if self.finished_jobs == self.jobs_count else 0,
+                'finished': self.finished_jobs,
+                'total': self.jobs_count,
+                'messages': list(self.messages),
+                'error': 1 if self.has_error else 0,
+            }
+
+_reserved_image_paths = set()
+_reserved_image_paths_lock = threading.Lock()
+
+def _reserve_image_path(path):
+    with _reserved_image_paths_lock:
+        if path in _reserved_image_paths or os.path.exists(path):
+            return False
+        _reserved_image_paths.add(path)
+        return True
+
+def _release_image_paths(paths):
+    # the images exist on disk by now, os.path.exists keeps them taken
+    with _reserved_image_paths_lock:
+        _reserved_image_paths.difference_update(paths)
+
+# Pool of image batches accessible by an id returned to the Vim timer
+class AI_image_jobs_pool(object):
+    def __init__(self):
+        self.pool = {}
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def new_batch(self, ui, provider_name, prompt, providers, request_metrics=None, trace=None):
+        batch = AI_image_batch(ui, provider_name, len(providers), trace)
+        with self.lock:
+            self.last_id += 1
+            batch_id = self.last_id
+            self.pool[batch_id] = batch
+        for index, provider in enumerate(providers):
+            metrics = request_metrics[index] if request_metrics else None
+            AI_image_job(batch, prompt, provider, metrics).start()
+        return batch_id
+
+    def get_status(self, batch_id):
+        """Returns progress of a batch, the batch is forgotten once reported done"""
+        with self.lock:
+            batch = self.pool.get(batch_id)
+        if batch is None:
+            return { 'done': 1, 'finished': 0, 'total': 0, 'messages': [], 'error': 0 }
+        status = batch.get_status()
+        if status['done']:
+            with self.lock:
+                self.pool.pop(batch_id, None)
+            _release_image_paths(batch.paths)
+            if batch.trace is not None:
+                finish_trace(batch.trace)
+        return status
+
+ai_image_job_pool = AI_image_jobs_pool()
+
+@profiled('image')
 def run_ai_image(context):
+    """Generates images, returns id of the background batch or 0 if there is none"""
+    update_thread_shared_variables()
     prompt = context['prompt']
     config = context['config']
     config_options = config['options']
-    ui = config['ui']
+    ui = dict(config['ui'])
     command_type = context['command_type']
+    trace = current_trace()
+    # background jobs take over the trace, it is finished once the batch is reported done
+    trace_handed_over = False
 
     try:
         if prompt:
             print('Generating...')
-            print_debug("[image] text:\n" + prompt)
+            print_debug("[image] text:\n{}", prompt)
 
             provider_class = load_provider(config['provider'])
+
+            if get_vim_global("g:vim_ai_async_image", "1") == "1":
+                # resolve the directory now, jobs must not call vim
+                ui['download_dir'] = ui.get('download_dir') or vim.eval('getcwd()')
+                variations = max(int(ui.get('variations') or 1), 1)
+                providers = [provider_class(command_type, config_options, ai_provider_utils) for _ in range(variations)]
+                request_metrics = [start_request_metrics(config['provider'], config_options, context) for _ in providers]
+                batch_id = ai_image_job_pool.new_batch(ui, config['provider'], prompt, providers, request_metrics, trace)
+                trace_handed_over = True
+                return batch_id
+
+            request_metrics = start_request_metrics(config['provider'], config_options, context)
             provider = provider_class(command_type, config_options, ai_provider_utils)
-            response_chunks = provider.request_image(prompt)
+            response_chunks = trace_chunks(instrument_chunks(request_metrics, provider.request_image(prompt)))
 
             info_messages = []
-            for image in response_chunks:
-                path = make_image_path(ui)
+            timestamp = make_image_timestamp()
+            # each image is written as soon as the provider yields it
+            for index, image in enumerate(response_chunks):
+                path = make_image_path(ui, timestamp, index)
                 save_b64_to_file(path, image['b64_data'])
                 info_messages.append("Image: {}".format(path))
 
@@ -41,4 +201,8 @@ def run_ai_image(context):
             print("\n".join(info_messages))
     except BaseException as error:
         handle_completion_error(config['provider'], error)
-        print_debug("[{}] error: {}", command_type, traceback.format_exc())
+        print_debug("[{}] error: {}", command_type, traceback.format_exc(), level='error')
+    finally:
+        if not trace_handed_over:
+            finish_trace(trace)
+    return 0
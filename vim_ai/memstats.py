@@ -0,0 +1,193 @@
+import os
+import sys
+import tracemalloc
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+TRACEBACK_FRAMES = 10
+DEFAULT_TOP = 15
+# bounds the walk over a single structure, its size is reported as a lower bound beyond it
+MAX_SIZE_OBJECTS = 200000
+
+# the last snapshot, new snapshots are compared to it
+_last_snapshot = None
+
+def deep_sizeof(obj, max_objects=MAX_SIZE_OBJECTS):
+    """Approximate size of the object and the containers/instances it references
+
+    Returns (bytes, complete), complete is False when the walk was cut short.
+    Modules, classes, functions and threads' internals are not followed.
+    Containers are copied before they are followed, other threads may still
+    change them, RuntimeError is raised if that happens during the copy.
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        if len(seen) >= max_objects:
+            return total, False
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current, 0)
+        if isinstance(current, dict):
+            for key, value in list(current.items()):
+                stack.append(key)
+                stack.append(value)
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(list(current))
+        elif isinstance(current, (str, bytes, bytearray, int, float, type(None))):
+            continue
+        elif hasattr(current, '__dict__') and not isinstance(current, type) and not callable(current):
+            stack.append(current.__dict__)
+    return total, True
+
+def _module(name):
+    # only modules that were already loaded are inspected, nothing is imported
+    return sys.modules.get(name)
+
+def _snapshot(obj):
+    if isinstance(obj, dict):
+        return dict(list(obj.items()))
+    return list(obj)
+
+class _NoLock(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NO_LOCK = _NoLock()
+
+def _internal_structures():
+    """Yields (name, lock, read) of the plugin's long-lived structures
+
+    read() returns (count, snapshot of the structure), it is called under
+    the lock of the owning module, lock is None when there is none.
+    """
+    chat = _module('vim_ai.chat')
+    if chat:
+        pool = chat.ai_job_pool
+        yield 'chat job pool', None, lambda: (len(pool.pool), _snapshot(pool.pool))
+    image = _module('vim_ai.image')
+    if image:
+        image_pool = image.ai_image_job_pool
+        yield 'image job pool', image_pool.lock, lambda: (len(image_pool.pool), _snapshot(image_pool.pool))
+        paths = image._reserved_image_paths
+        yield 'reserved image paths', image._reserved_image_paths_lock, lambda: (len(paths), _snapshot(paths))
+    context = _module('vim_ai.context')
+    if context:
+        role_configs = context._role_config_cache
+        final_configs = context._final_config_cache
+        yield 'role config cache', None, lambda: (len(role_configs), _snapshot(role_configs))
+        yield 'final config cache', None, lambda: (len(final_configs), _snapshot(final_configs))
+    utils = _module('vim_ai.utils')
+    if utils:
+        role_files = utils._role_files_cache
+        registry = utils._provider_registry
+        yield 'role files cache', None, lambda: (1 if role_files['roles'] else 0, _snapshot(role_files))
+        yield 'provider registry', None, lambda: (len(registry), _snapshot(registry))
+    project_index = _module('vim_ai.project_index')
+    if project_index:
+        def read_project_indexes():
+            indexes = _snapshot(project_index._project_indexes)
+            return sum(i.files_count for i in indexes.values()), indexes
+        yield 'project indexes (files)', project_index._project_indexes_lock, read_project_indexes
+    retrieval = _module('vim_ai.retrieval')
+    if retrieval:
+        def read_retrieval_indexes():
+            indexes = _snapshot(retrieval._retrieval_indexes)
+            return sum(len(i.chunks) for i in indexes.values()), indexes
+        yield 'retrieval indexes (chunks)', retrieval._retrieval_indexes_lock, read_retrieval_indexes
+    git_context = _module('vim_ai.git_context')
+    if git_context:
+        git_cache = git_context._git_context_cache
+        yield 'git context cache', git_context._git_context_lock, lambda: (len(git_cache), _snapshot(git_cache))
+    aws = _module('vim_ai.aws')
+    if aws:
+        credentials = aws._credentials_cache
+        yield 'aws credentials cache', aws._credentials_lock, lambda: (len(credentials), _snapshot(credentials))
+        def read_connection_pool():
+            connections = _snapshot(aws._connection_pool)
+            return sum(len(c) for c in connections.values()), connections
+        yield 'aws connection pool', aws._connection_pool_lock, read_connection_pool
+    bedrock = _module('vim_ai.providers.bedrock')
+    if bedrock:
+        availability = bedrock._availability_cache
+        yield 'bedrock availability cache', bedrock._availability_lock, lambda: (len(availability), _snapshot(availability))
+    amazonq = _module('vim_ai.providers.amazonq')
+    if amazonq:
+        sessions = amazonq._sessions
+        yield 'amazon q sessions', amazonq._sessions_lock, lambda: (len(sessions), _snapshot(sessions))
+
+def format_structures():
+    lines = ['Internal structures:']
+    for name, lock, read in _internal_structures():
+        try:
+            with lock or _NO_LOCK:
+                count, obj = read()
+            # nested objects are walked without the lock, background threads may change them
+            size, complete = deep_sizeof(obj)
+        except RuntimeError:
+            lines.append('  {:<28} changed while measured, run again'.format(name))
+            continue
+        lines.append('  {:<28} {:>8} items {:>12} bytes{}'.format(name, count, size, '' if complete else '+'))
+    return lines
+
+def _package_filter():
+    return [tracemalloc.Filter(True, os.path.join(PACKAGE_DIR, '*'))]
+
+def _format_stat(stat):
+    frame = stat.traceback[0]
+    filename = os.path.relpath(frame.filename, os.path.dirname(PACKAGE_DIR))
+    return '{}:{}'.format(filename, frame.lineno)
+
+def take_snapshot(top=DEFAULT_TOP):
+    """Snapshots vim_ai allocations, returns report lines with the top sites and the diff"""
+    global _last_snapshot
+    snapshot = tracemalloc.take_snapshot().filter_traces(_package_filter())
+    current, peak = tracemalloc.get_traced_memory()
+    lines = ['Traced memory: {} bytes (peak {} bytes)'.format(current, peak), '', 'Top allocation sites in vim_ai:']
+    for stat in snapshot.statistics('lineno')[:top]:
+        lines.append('  {:>12} bytes {:>8} blocks  {}'.format(stat.size, stat.count, _format_stat(stat)))
+    if _last_snapshot is not None:
+        lines.extend(['', 'Growth since the previous snapshot:'])
+        diff = [stat for stat in snapshot.compare_to(_last_snapshot, 'lineno') if stat.size_diff]
+        for stat in diff[:top]:
+            lines.append('  {:>+12} bytes {:>+8} blocks  {}'.format(stat.size_diff, stat.count_diff, _format_stat(stat)))
+        if not diff:
+            lines.append('  no change')
+    _last_snapshot = snapshot
+    return lines
+
+def start():
+    global _last_snapshot
+    _last_snapshot = None
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEBACK_FRAMES)
+
+def stop():
+    global _last_snapshot
+    _last_snapshot = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def run_mem_stats(action=''):
+    """Runs :AIUtilMemStats, returns lines of the report
+
+    start/stop control tracing, snapshot (the default while tracing)
+    reports allocations and their growth since the previous snapshot.
+    """
+    action = action or ('snapshot' if tracemalloc.is_tracing() else 'start')
+    if action == 'stop':
+        stop()
+        return ['tracemalloc stopped'] + [''] + format_structures()
+    if action == 'start':
+        start()
+        return ['tracemalloc started, run :AIUtilMemStats again to take a snapshot', ''] + format_structures()
+    if action == 'snapshot':
+        if not tracemalloc.is_tracing():
+            return ['tracemalloc is not running, start it with :AIUtilMemStats start', ''] + format_structures()
+        return take_snapshot() + [''] + format_structures()
+    return ['Unknown action: {}, use start, snapshot or stop'.format(action)]
@@ -0,0 +1,234 @@
+import collections
+import json
+import math
+import os
+import threading
+import time
+
+from vim_ai.config_snapshot import get_vim_global
+
+# metrics of the request running in the current thread, providers report into it
+_current = threading.local()
+_write_lock = threading.Lock()
+# duration of the last make_ai_context, both run in the main thread right before the request
+_last_context_time = None
+# the file is rotated to `path.1` once it grows over this size
+MAX_METRICS_FILE_SIZE = 5 * 1024 * 1024
+
+class RequestMetrics(object):
+    """Timings and sizes of a single provider request
+
+    Event times are seconds since the request started, events reported
+    more than once keep the first time.
+    """
+    def __init__(self, provider, model, command_type, context_time=None, path=None):
+        self.provider = provider
+        self.model = model
+        self.command_type = command_type
+        self.context_time = context_time
+        self.path = path
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.events = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.output_chars = 0
+        self.output_tokens = None
+        self.input_tokens = None
+        self.error = None
+
+    def mark(self, event):
+        if event not in self.events:
+            self.events[event] = time.perf_counter() - self._start
+
+    def add_bytes(self, sent=0, received=0):
+        self.request_bytes += sent
+        self.response_bytes += received
+        if received:
+            self.mark('first_byte')
+
+    def set_usage(self, input_tokens=None, output_tokens=None):
+        if input_tokens is not None:
+            self.input_tokens = input_tokens
+        if output_tokens is not None:
+            self.output_tokens = output_tokens
+
+    def to_record(self):
+        total = self.events.get('done')
+        first_token = self.events.get('first_token')
+        output_tokens = self.output_tokens
+        tokens_estimated = output_tokens is None
+        if tokens_estimated:
+            # roughly 4 characters per token for English text and code
+            output_tokens = (self.output_chars + 3) // 4
+        tokens_per_second = None
+        if total is not None and first_token is not None and total > first_token and output_tokens:
+            tokens_per_second = output_tokens / (total - first_token)
+        return {
+            'timestamp': self.started_at,
+            'provider': self.provider,
+            'model': self.model,
+            'command_type': self.command_type,
+            'context_time': self.context_time,
+            'connect_time': self.events.get('connected'),
+            'first_byte_time': self.events.get('first_byte'),
+            'first_token_time': first_token,
+            'total_time': total,
+            'tokens_per_second': tokens_per_second,
+            'input_tokens': self.input_tokens,
+            'output_tokens': output_tokens,
+            'tokens_estimated': tokens_estimated,
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            'error': self.error,
+        }
+
+def record_context_time(seconds):
+    global _last_context_time
+    _last_context_time = seconds
+
+def start_request_metrics(provider, options, context):
+    """Creates metrics of a request, must be called from the main thread
+
+    Returns None when metrics are disabled.
+    """
+    global _last_context_time
+    context_time = _last_context_time
+    _last_context_time = None
+    if get_vim_global("g:vim_ai_metrics", "0") != "1":
+        return None
+    path = os.path.expanduser(get_vim_global("g:vim_ai_metrics_file", ""))
+    if not path:
+        return None
+    return RequestMetrics(
+        provider, options.get('model', ''), context.get('command_type', ''),
+        context_time=context_time, path=path,
+    )
+
+def current_request_metrics():
+    return getattr(_current, 'metrics', None)
+
+def mark_request_event(event):
+    metrics = current_request_metrics()
+    if metrics is not None:
+        metrics.mark(event)
+
+def add_request_bytes(sent=0, received=0):
+    metrics = current_request_metrics()
+    if metrics is not None:
+        metrics.add_bytes(sent, received)
+
+def set_request_usage(input_tokens=None, output_tokens=None):
+    metrics = current_request_metrics()
+    if metrics is not None:
+        metrics.set_usage(input_tokens, output_tokens)
+
+def instrument_chunks(metrics, chunks):
+    """Yields response chunks while metrics of the request are collected
+
+    Provider code runs while the chunks are pulled, so the metrics are
+    available to it through the thread local for the whole iteration.
+    """
+    if metrics is None:
+        yield from chunks
+        return
+    _current.metrics = metrics
+    try:
+        for chunk in chunks:
+            content = chunk.get('content') if isinstance(chunk, dict) else None
+            if content or (isinstance(chunk, dict) and chunk.get('b64_data')):
+                metrics.mark('first_token')
+                if content:
+                    metrics.output_chars += len(content)
+            yield chunk
+    except GeneratorExit:
+        # the consumer stopped reading, e.g. a cancelled chat
+        metrics.error = 'cancelled'
+        raise
+    except BaseException as error:
+        metrics.error = type(error).__name__
+        raise
+    finally:
+        _current.metrics = None
+        metrics.mark('done')
+        write_metrics(metrics)
+
+def write_metrics(metrics, max_size=MAX_METRICS_FILE_SIZE):
+    line = json.dumps(metrics.to_record()) + '\n'
+    with _write_lock:
+        try:
+            with open(metrics.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                size = f.tell()
+            if max_size and size >= max_size:
+                os.replace(metrics.path, metrics.path + '.1')
+        except (IOError, OSError):
+            pass
+
+def read_metrics(path, limit=10000):
+    """Returns the last records of the metrics file, only they are kept in memory"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = collections.deque(f, maxlen=limit)
+    except (IOError, OSError):
+        return []
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of non-empty values"""
+    values = sorted(values)
+    index = max(int(math.ceil(fraction * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+STATS_COLUMNS = (
+    ('first_token_time', 'first token'),
+    ('total_time', 'total'),
+    ('tokens_per_second', 'tok/s'),
+)
+
+def _format_value(key, value):
+    if value is None:
+        return '-'
+    if key == 'tokens_per_second':
+        return '{:.1f}'.format(value)
+    return '{:.2f}s'.format(value)
+
+def summarize_metrics(records):
+    """Returns lines with p50/p95 of the records grouped by provider, model and command type"""
+    groups = {}
+    for record in records:
+        key = (record.get('provider') or '', record.get('model') or '', record.get('command_type') or '')
+        groups.setdefault(key, []).append(record)
+    if not groups:
+        return ['No metrics recorded yet']
+
+    header = ['provider', 'model', 'command', 'count', 'errors']
+    for _, title in STATS_COLUMNS:
+        header.extend([title + ' p50', title + ' p95'])
+    rows = [header]
+    for key in sorted(groups):
+        group = groups[key]
+        row = list(key) + [str(len(group)), str(sum(1 for r in group if r.get('error')))]
+        for column, _ in STATS_COLUMNS:
+            values = [r[column] for r in group if r.get(column) is not None and not r.get('error')]
+            if values:
+                row.extend([_format_value(column, percentile(values, 0.5)), _format_value(column, percentile(values, 0.95))])
+            else:
+                row.extend(['-', '-'])
+        rows.append(row)
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return ['  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+
+def get_stats_lines():
+    path = os.path.expanduser(get_vim_global("g:vim_ai_metrics_file", ""))
+    records = read_metrics(path)
+    if not records and get_vim_global("g:vim_ai_metrics", "0") != "1":
+        return ['No metrics recorded yet, turn them on with `let g:vim_ai_metrics = 1`']
+    return summarize_metrics(records)
@@ -0,0 +1,104 @@
+import cProfile
+import functools
+import glob
+import io
+import itertools
+import os
+import pstats
+import threading
+import time
+
+from vim_ai.config_snapshot import get_vim_global
+from vim_ai.utils import print_debug
+
+DEFAULT_REPORT_LIMIT = 30
+
+# refreshed by every command entry point, background jobs use the value of the command that started them
+_profile_dir = None
+_counter = itertools.count(1)
+# profiler of the command running in the main thread
+_command_profiler = None
+
+def _read_profile_dir():
+    if get_vim_global("g:vim_ai_profile", "0") != "1":
+        return None
+    return os.path.expanduser(get_vim_global("g:vim_ai_profile_dir", "")) or None
+
+def make_profile_path(profile_dir, name):
+    timestamp = time.strftime("%Y%m%dT%H%M%S")
+    filename = '{}_{}_{}_{}.prof'.format(timestamp, name, os.getpid(), next(_counter))
+    return os.path.join(profile_dir, filename)
+
+def run_profiled(profile_dir, name, fn, *args, **kwargs):
+    """Calls the function under cProfile, the stats are written to a new file in profile_dir"""
+    global _command_profiler
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ allows a single active profiler
+        print_debug("profiling: {} runs unprofiled, another profiler is active", name, level='warning')
+        return fn(*args, **kwargs)
+    is_command = threading.current_thread() is threading.main_thread()
+    if is_command:
+        _command_profiler = profiler
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+        if is_command:
+            _command_profiler = None
+        try:
+            if not os.path.isdir(profile_dir):
+                os.makedirs(profile_dir)
+            profiler.dump_stats(make_profile_path(profile_dir, name))
+        except (IOError, OSError):
+            pass
+
+def stop_command_profiler():
+    """Stops profiling the running command before it starts a background job
+
+    The command's setup and the job are saved as separate profiles, Python
+    3.12+ would not let the job start a profiler while the command has one.
+    """
+    if _command_profiler is not None:
+        _command_profiler.disable()
+
+def profiled(name, in_thread=False):
+    """Profiles the decorated command entry point when g:vim_ai_profile is on
+
+    Entry points running in a background thread (in_thread=True) must not
+    touch vim, they reuse the setting read by the command that started them.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            global _profile_dir
+            if not in_thread:
+                _profile_dir = _read_profile_dir()
+            profile_dir = _profile_dir
+            if not profile_dir:
+                return fn(*args, **kwargs)
+            return run_profiled(profile_dir, name, fn, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def find_latest_profile(profile_dir):
+    paths = glob.glob(os.path.join(profile_dir, '*.prof'))
+    if not paths:
+        return None
+    return max(paths, key=os.path.getmtime)
+
+def format_profile_report(path, limit=DEFAULT_REPORT_LIMIT):
+    """Returns lines of the top functions by cumulative time"""
+    stream = io.StringIO()
+    stats = pstats.Stats(path, stream=stream)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return ['Profile: {}'.format(path)] + stream.getvalue().splitlines()
+
+def get_profile_report_lines(limit=DEFAULT_REPORT_LIMIT):
+    profile_dir = os.path.expanduser(get_vim_global("g:vim_ai_profile_dir", ""))
+    path = find_latest_profile(profile_dir) if profile_dir else None
+    if not path:
+        return ['No profiles found in {}, turn profiling on with :AIUtilProfileOn'.format(profile_dir)]
+    return format_profile_report(path, int(limit or DEFAULT_REPORT_LIMIT))
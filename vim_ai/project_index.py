@@ -0,0 +1,272 @@
+import fnmatch
+import os
+import re
+import threading
+import time
+
+# directories that are never indexed, hidden directories are skipped as well
+ALWAYS_IGNORED_DIRS = ('node_modules', '__pycache__')
+# seconds during which the index is served without checking directory mtimes
+REFRESH_INTERVAL = 2
+# bounds memory and build time on huge trees, files over the limit are not indexed
+MAX_INDEXED_FILES = 200000
+
+def _list_dir(path):
+    """Returns (name, is_dir) of entries, symlinked directories are not followed"""
+    scandir = getattr(os, 'scandir', None)
+    if scandir:
+        entries = scandir(path)
+        try:
+            return [(entry.name, entry.is_dir(follow_symlinks=False)) for entry in entries]
+        finally:
+            # scandir iterator is a context manager only since Python 3.6
+            close = getattr(entries, 'close', None)
+            if close:
+                close()
+    # Python 3.4
+    return [(name, os.path.isdir(os.path.join(path, name)) and not os.path.islink(os.path.join(path, name)))
+            for name in os.listdir(path)]
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _translate_gitignore_pattern(pattern):
+    """Translates a gitignore glob into a regex matching a slash separated path"""
+    result = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            result += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('/**', i) and i + 3 == len(pattern):
+            result += '/.*'
+            i += 3
+            continue
+        if c == '*':
+            result += '[^/]*'
+        elif c == '?':
+            result += '[^/]'
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                result += re.escape(c)
+            else:
+                content = pattern[i + 1:end]
+                if content.startswith('!'):
+                    content = '^' + content[1:]
+                result += '[' + content.replace('\\', '\\\\') + ']'
+                i = end
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            result += re.escape(pattern[i])
+        else:
+            result += re.escape(c)
+        i += 1
+    return re.compile(result + r'\Z')
+
+class GitignoreRule(object):
+    def __init__(self, base, line):
+        self.base = base # directory of the .gitignore relative to the index root
+        self.negated = line.startswith('!')
+        if self.negated:
+            line = line[1:]
+        self.dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        # a slash at the beginning or in the middle anchors the pattern to the base
+        self.anchored = '/' in line
+        self.regex = _translate_gitignore_pattern(line.lstrip('/'))
+
+    def matches(self, rel_path, name, is_dir):
+        if self.dir_only and not is_dir:
+            return False
+        if not self.anchored:
+            return bool(self.regex.match(name))
+        if self.base:
+            if not rel_path.startswith(self.base + '/'):
+                return False
+            rel_path = rel_path[len(self.base) + 1:]
+        return bool(self.regex.match(rel_path))
+
+def parse_gitignore(base, content):
+    rules = []
+    for line in content.splitlines():
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('\\'):
+            line = line[1:]
+        rules.append(GitignoreRule(base, line))
+    return rules
+
+def is_ignored(rules, rel_path, name, is_dir):
+    ignored = False
+    # the last matching rule wins, it may be a negation
+    for rule in rules:
+        if rule.negated == ignored and rule.matches(rel_path, name, is_dir):
+            ignored = not rule.negated
+    return ignored
+
+class _DirEntry(object):
+    def __init__(self, signature, rules, files, subdirs):
+        self.signature = signature
+        self.rules = rules
+        self.files = files
+        self.subdirs = subdirs
+
+class ProjectIndex(object):
+    """Listing of files under a project root, honouring .gitignore
+
+    The tree is walked once, later refreshes only stat the indexed
+    directories and rescan those whose mtime (or .gitignore) changed.
+    """
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.dirs = {}
+        self.files_count = 0
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def _abs(self, rel):
+        return os.path.join(self.root, rel) if rel else self.root
+
+    def _signature(self, rel):
+        path = self._abs(rel)
+        dir_mtime = _mtime(path)
+        if dir_mtime is None:
+            return None
+        return (dir_mtime, _mtime(os.path.join(path, '.gitignore')))
+
+    def _read_rules(self, rel, parent_rules):
+        try:
+            with open(os.path.join(self._abs(rel), '.gitignore'), encoding='utf-8', errors='replace') as f:
+                own_rules = parse_gitignore(rel, f.read())
+        except (IOError, OSError):
+            return parent_rules
+        return parent_rules + own_rules
+
+    def _scan(self, rel, parent_rules, known_subdirs=None):
+        """Indexes a directory, subdirectories not in known_subdirs are scanned recursively"""
+        signature = self._signature(rel)
+        if signature is None:
+            self._drop(rel)
+            return
+        rules = self._read_rules(rel, parent_rules)
+        try:
+            entries = _list_dir(self._abs(rel))
+        except OSError:
+            self._drop(rel)
+            return
+
+        previous = self.dirs.get(rel)
+        if previous:
+            self.files_count -= len(previous.files)
+        files = []
+        subdirs = []
+        for name, is_dir in sorted(entries):
+            if name.startswith('.'):
+                continue
+            child_rel = rel + '/' + name if rel else name
+            if is_dir and name in ALWAYS_IGNORED_DIRS:
+                continue
+            if is_ignored(rules, child_rel, name, is_dir):
+                continue
+            if is_dir:
+                subdirs.append(name)
+            elif self.files_count + len(files) < MAX_INDEXED_FILES:
+                files.append(name)
+        self.files_count += len(files)
+        self.dirs[rel] = _DirEntry(signature, rules, files, subdirs)
+
+        if previous:
+            for name in set(previous.subdirs) - set(subdirs):
+                self._drop(rel + '/' + name if rel else name)
+        for name in subdirs:
+            if known_subdirs is None or name not in known_subdirs:
+                self._scan(rel + '/' + name if rel else name, rules)
+
+    def _drop(self, rel):
+        entry = self.dirs.pop(rel, None)
+        if entry is None:
+            return
+        self.files_count -= len(entry.files)
+        for name in entry.subdirs:
+            self._drop(rel + '/' + name if rel else name)
+
+    def _refresh(self):
+        if not self.dirs:
+            self._scan('', [])
+            return
+        # parents first, so that a rescanned parent drops vanished children before they are checked
+        for rel in sorted(self.dirs, key=lambda rel: rel.count('/') if rel else -1):
+            entry = self.dirs.get(rel)
+            if entry is None:
+                continue
+            signature = self._signature(rel)
+            if signature == entry.signature:
+                continue
+            parent_rules = self._parent_rules(rel)
+            if signature is not None and signature[1] != entry.signature[1]:
+                # .gitignore changed, rules of the whole subtree are different
+                self._drop(rel)
+                self._scan(rel, parent_rules)
+            else:
+                self._scan(rel, parent_rules, known_subdirs=set(entry.subdirs))
+
+    def _parent_rules(self, rel):
+        if not rel:
+            return []
+        parent = rel.rsplit('/', 1)[0] if '/' in rel else ''
+        entry = self.dirs.get(parent)
+        return entry.rules if entry else []
+
+    def refresh(self, force=False):
+        with self.lock:
+            now = time.time()
+            if not force and self.checked_at is not None and now - self.checked_at < REFRESH_INTERVAL:
+                return
+            self._refresh()
+            self.checked_at = time.time()
+
+    def list_files(self):
+        """Returns sorted paths relative to the root"""
+        self.refresh()
+        with self.lock:
+            result = []
+            for rel, entry in self.dirs.items():
+                prefix = rel + '/' if rel else ''
+                result.extend(prefix + name for name in entry.files)
+        return sorted(result)
+
+    def find_files(self, patterns, limit_per_pattern=None):
+        """Returns files with basename matching any of the patterns, in the order of the patterns"""
+        files = self.list_files()
+        result = []
+        for pattern in patterns:
+            matches = [f for f in files if fnmatch.fnmatchcase(f.rsplit('/', 1)[-1], pattern)]
+            result.extend(matches[:limit_per_pattern] if limit_per_pattern else matches)
+        return result
+
+_project_indexes = {}
+_MAX_PROJECT_INDEXES = 8
+_project_indexes_lock = threading.Lock()
+
+def get_project_index(root):
+    """Returns the persistent index of the root, it is built on the first use"""
+    root = os.path.abspath(root)
+    with _project_indexes_lock:
+        index = _project_indexes.get(root)
+        if index is None:
+            if len(_project_indexes) >= _MAX_PROJECT_INDEXES:
+                _project_indexes.clear()
+            index = ProjectIndex(root)
+            _project_indexes[root] = index
+    return index
+
+def invalidate_project_indexes():
+    with _project_indexes_lock:
+        _project_indexes.clear()
@@ -1,14 +1,375 @@
-import urllib.request
+import atexit
+import codecs
 import os
-import json
-import vim
+import re
+import select
+import shlex
 import subprocess
-import sys
+import threading
+import time
+import vim
+
+try:
+    import pty
+except ImportError:
+    # pseudo-terminals are not available on Windows, one-shot `q chat` is used
+    pty = None
 
 from vim_ai.provider_imports import setup_provider_imports
 _imports = setup_provider_imports()
 globals().update(_imports)
 from vim_ai.ai_typing import Any, Sequence, Mapping, Iterator
+from vim_ai.config_snapshot import get_vim_global
+
+DEFAULT_Q_CHAT_COMMAND = 'q chat'
+AVAILABILITY_TTL = 300
+SESSION_IDLE_TIMEOUT = 30 * 60
+MAX_SESSIONS = 8
+# q keeps quiet after printing the prompt, this distinguishes it from "> " answers,
+# a session that prints more after its prompt was detected is discarded
+PROMPT_QUIET_PERIOD = 0.2
+
+_CONTROL_RE = re.compile(r"[\x1b\r]")
+_CSI_FINAL_RE = re.compile(r"[@-~]")
+_OSC_END_RE = re.compile(r"[\x07\x1b]")
+# interactive prompt, e.g. "> ", "!> " or "[profile] > "
+_PROMPT_LINE_RE = re.compile(r"(?:\[[^\]\n]*\] ?)?!?> ?\Z")
+# partial line that may still turn into the prompt
+_PROMPT_PREFIX_RE = re.compile(r"(?:\[[^\]\n]*(?:\] ?)?)?!?>? ?\Z")
+_ANSWER_PREFIX_RE = re.compile(r"[\r\n]*(?:> ?)?")
+# "⠋ Thinking..." shown before the answer starts
+_SPINNER_RE = re.compile(r"[ \t]*[\u2800-\u28ff][^\n]*(?:\n|\Z)")
+
+_availability = {}
+_availability_lock = threading.Lock()
+
+def invalidate_q_cli_availability():
+    with _availability_lock:
+        _availability.clear()
+
+def _normalize_text(text):
+    return ' '.join(text.split())
+
+class QSessionError(Exception):
+    pass
+
+_TEXT, _CR, _ESC, _CSI, _OSC, _OSC_ESC, _CHARSET = range(7)
+
+class AnsiStripper(object):
+    """Incrementally removes terminal escape sequences from q output
+
+    The parser state is kept between calls, so sequences split across reads
+    are removed as well. CR LF is normalized to LF, a lone CR is kept so
+    that spinner redraws can be recognized.
+    """
+
+    def __init__(self):
+        self._state = _TEXT
+
+    def feed(self, text):
+        out = []
+        state = self._state
+        i = 0
+        length = len(text)
+        while i < length:
+            if state == _TEXT:
+                match = _CONTROL_RE.search(text, i)
+                if not match:
+                    out.append(text[i:])
+                    break
+                out.append(text[i:match.start()])
+                i = match.end()
+                state = _ESC if match.group() == '\x1b' else _CR
+            elif state == _CR:
+                if text[i] != '\n':
+                    out.append('\r')
+                state = _TEXT
+            elif state == _ESC:
+                char = text[i]
+                i += 1
+                if char == '[':
+                    state = _CSI
+                elif char == ']':
+                    state = _OSC
+                elif char in '()*+':
+                    state = _CHARSET
+                else:
+                    state = _TEXT
+            elif state == _CSI:
+                match = _CSI_FINAL_RE.search(text, i)
+                if not match:
+                    break
+                i = match.end()
+                state = _TEXT
+            elif state == _OSC:
+                match = _OSC_END_RE.search(text, i)
+                if not match:
+                    break
+                i = match.end()
+                state = _TEXT if match.group() == '\x07' else _OSC_ESC
+            else:
+                # string terminator after OSC or a character set designation
+                i += 1
+                state = _TEXT
+        self._state = state
+        return ''.join(out)
+
+class AnswerFilter(object):
+    """Turns cleaned q output into answer text
+
+    Drops spinner lines redrawn before the answer starts and the "> " marker
+    in front of it. With `hold_prompt`, a trailing line that may turn out to
+    be the prompt of the next turn is held back until more output arrives.
+    """
+
+    def __init__(self, hold_prompt=False):
+        self.hold_prompt = hold_prompt
+        self.started = False
+        self._pending = ''
+        self._line_start = True
+
+    def _prompt_line_start(self, pending, pattern):
+        newline = pending.rfind('\n')
+        if newline == -1 and not self._line_start:
+            return None
+        if pattern.match(pending, newline + 1):
+            return newline + 1
+        return None
+
+    def _emit(self, pending, end):
+        start = 0
+        if not self.started:
+            start = _ANSWER_PREFIX_RE.match(pending, 0, end).end()
+            if start == end:
+                self._pending = pending
+                return ''
+            self.started = True
+        self._pending = pending[end:]
+        chunk = pending[start:end]
+        if chunk:
+            self._line_start = chunk.endswith('\n')
+        return chunk
+
+    def feed(self, text):
+        if self.started:
+            text = text.replace('\r', '')
+        pending = self._pending + text
+        if not self.started:
+            # a spinner redraws its line until the answer starts
+            pending = pending[pending.rfind('\r') + 1:]
+            spinner = _SPINNER_RE.match(pending)
+            while spinner and spinner.group().endswith('\n'):
+                pending = pending[spinner.end():]
+                spinner = _SPINNER_RE.match(pending)
+            if spinner:
+                self._pending = pending
+                return ''
+        end = len(pending)
+        if self.hold_prompt:
+            prompt_start = self._prompt_line_start(pending, _PROMPT_PREFIX_RE)
+            if prompt_start is not None:
+                end = prompt_start
+            # newlines in front of the prompt are not part of the answer
+            end = len(pending[:end].rstrip('\n'))
+        return self._emit(pending, end)
+
+    def finish(self):
+        pending = self._pending.replace('\r', '')
+        end = len(pending)
+        if self.hold_prompt:
+            prompt_start = self._prompt_line_start(pending, _PROMPT_LINE_RE)
+            if prompt_start is not None:
+                end = prompt_start
+            end = len(pending[:end].rstrip('\n'))
+        chunk = self._emit(pending, end)
+        self._pending = ''
+        return chunk
+
+class QChatSession(object):
+    """Long-lived interactive `q chat` process driven through a pseudo-terminal
+
+    `transcript` holds (role, text) pairs of the conversation the process
+    already knows about, so that follow-up turns send only the new prompt.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        master_fd, slave_fd = pty.openpty()
+        try:
+            self.process = subprocess.Popen(
+                command, stdin=slave_fd, stdout=slave_fd, stderr=slave_fd,
+                close_fds=True, start_new_session=True,
+            )
+        except BaseException:
+            os.close(master_fd)
+            raise
+        finally:
+            os.close(slave_fd)
+        self.fd = master_fd
+        self.transcript = []
+        self.busy = False
+        self.ready = False
+        self.last_used = time.time()
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._stripper = AnsiStripper()
+
+    def is_alive(self):
+        return self.fd is not None and self.process.poll() is None
+
+    def close(self):
+        if self.fd is None:
+            return
+        try:
+            self.process.kill()
+            self.process.wait()
+        except OSError:
+            pass
+        os.close(self.fd)
+        self.fd = None
+
+    def _read(self, timeout):
+        """Returns output available within the timeout, '' on timeout and None on exit"""
+        ready, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if not ready:
+            return ''
+        try:
+            data = os.read(self.fd, 4096)
+        except OSError:
+            # EIO once the child side of the terminal is closed
+            data = b''
+        if not data:
+            return None
+        return self._stripper.feed(self._decoder.decode(data))
+
+    def _read_until_prompt(self, timeout):
+        """Yields cleaned output until q shows the prompt and keeps quiet"""
+        output = ''
+        while True:
+            last_line = output[max(output.rfind('\n'), output.rfind('\r')) + 1:]
+            waiting_for_input = _PROMPT_LINE_RE.match(last_line) is not None
+            text = self._read(PROMPT_QUIET_PERIOD if waiting_for_input else timeout)
+            if text is None:
+                raise QSessionError('q chat exited unexpectedly')
+            if text == '':
+                if waiting_for_input:
+                    return
+                raise QSessionError('q chat did not respond within {} seconds'.format(timeout))
+            output = (output + text)[-1024:]
+            yield text
+
+    def has_stray_output(self):
+        """True if q printed more since its prompt, e.g. an answer paused at a "> " quote line
+
+        The session is then out of sync with the conversation.
+        """
+        while True:
+            text = self._read(0)
+            if text is None:
+                return True
+            if text == '':
+                return False
+            if text.strip():
+                return True
+
+    def wait_ready(self, timeout):
+        if not self.ready:
+            for _ in self._read_until_prompt(timeout):
+                pass
+            self.ready = True
+
+    def _write(self, data):
+        data = data.encode('utf-8')
+        while data:
+            written = os.write(self.fd, data)
+            data = data[written:]
+
+    def ask(self, prompt, timeout):
+        """Sends a prompt and yields the answer as it is printed"""
+        self.wait_ready(timeout)
+        if '\n' in prompt:
+            # bracketed paste keeps multi-line prompts from being submitted line by line
+            self._write('\x1b[200~' + prompt + '\x1b[201~\r')
+        else:
+            self._write(prompt + '\r')
+
+        echo_lines = prompt.count('\n') + 1
+        answer_filter = AnswerFilter(hold_prompt=True)
+        for text in self._read_until_prompt(timeout):
+            while echo_lines and text:
+                newline = text.find('\n')
+                if newline == -1:
+                    text = ''
+                else:
+                    text = text[newline + 1:]
+                    echo_lines -= 1
+            chunk = answer_filter.feed(text) if text else ''
+            if chunk:
+                yield chunk
+        chunk = answer_filter.finish()
+        if chunk:
+            yield chunk
+        self.last_used = time.time()
+
+_sessions = []
+_sessions_lock = threading.Lock()
+
+def _take_session(command, history):
+    """Returns an idle session that continues `history`, it is marked busy"""
+    while True:
+        now = time.time()
+        found = None
+        with _sessions_lock:
+            expired = [s for s in _sessions
+                       if not s.busy and (not s.is_alive() or now - s.last_used > SESSION_IDLE_TIMEOUT)]
+            for session in expired:
+                _sessions.remove(session)
+            for session in _sessions:
+                if not session.busy and session.command == command and session.transcript == history:
+                    session.busy = True
+                    found = session
+                    break
+        for session in expired:
+            session.close()
+        if found is None or not found.ready or not found.has_stray_output():
+            return found
+        # its last answer was cut short, the leftover output would leak into the next turn
+        with _sessions_lock:
+            _sessions.remove(found)
+        found.close()
+
+def _add_session(session):
+    with _sessions_lock:
+        _sessions.append(session)
+        idle = [s for s in _sessions if not s.busy]
+        evicted = sorted(idle, key=lambda s: s.last_used)[:max(0, len(_sessions) - MAX_SESSIONS)]
+        for s in evicted:
+            _sessions.remove(s)
+    for s in evicted:
+        s.close()
+
+def close_sessions():
+    with _sessions_lock:
+        sessions = list(_sessions)
+        del _sessions[:]
+    for session in sessions:
+        session.close()
+
+# q chat children must not outlive vim
+atexit.register(close_sessions)
+
+def _drain_pipe(pipe, chunks):
+    fd = pipe.fileno()
+    while True:
+        data = os.read(fd, 4096)
+        if not data:
+            break
+        chunks.append(data)
+
+def _start_session(command):
+    session = QChatSession(command)
+    session.busy = True
+    _add_session(session)
+    return session
 
 class AmazonQProvider():
 
@@ -21,7 +382,7 @@ class AmazonQProvider():
         self.utils = utils
         self.command_type = command_type
         config_varname = getattr(self, "default_options_varname_{}".format(command_type))
-        raw_default_options = vim.eval(config_varname) if vim.eval("exists('{}')".format(config_varname)) else {}
+        raw_default_options = get_vim_global(config_varname, {})
         merged_options = raw_default_options.copy()
         merged_options.update(raw_options)
         self.options = self._parse_raw_options(merged_options)
@@ -33,23 +394,125 @@ class AmazonQProvider():
         if not self._is_q_cli_available():
             return iter([{'type': 'assistant', 'content': 'Amazon Q CLI not found. Please install Q CLI and run "q login" to authenticate.'}])
         
+        if self._use_persistent_session():
+            self.utils.print_debug("amazonq: Using persistent Q CLI session")
+            return self._request_via_q_session(messages)
         self.utils.print_debug("amazonq: Using Q CLI")
         return self._request_via_q_cli(messages)
 
+    def prepare(self):
+        """Called when a chat is opened, starts a q chat session in the background"""
+        if not self._use_persistent_session():
+            return
+
+        def _start():
+            try:
+                if not self._is_q_cli_available():
+                    return
+                command = self._q_chat_command()
+                session = _take_session(command, [])
+                if session is None:
+                    session = _start_session(command)
+                try:
+                    session.wait_ready(self._request_timeout())
+                finally:
+                    session.busy = False
+            except Exception as e:
+                self.utils.print_debug("amazonq: Q CLI session warm up failed: {}", str(e))
+
+        thread = threading.Thread(target=_start)
+        thread.daemon = True
+        thread.start()
+
+    def _q_chat_command(self):
+        return shlex.split(self.options.get('q_chat_command') or DEFAULT_Q_CHAT_COMMAND)
+
+    def _request_timeout(self):
+        return float(self.options.get('request_timeout') or 30)
+
+    def _use_persistent_session(self):
+        return (pty is not None and self.command_type == 'chat'
+                and str(self.options.get('persistent_session', 1)) == '1')
+
     def _is_q_cli_available(self):
-        """Check if Q CLI command is available"""
+        """Check if Q CLI command is available, the result is cached"""
+        executable = self._q_chat_command()[0]
+        now = time.time()
+        with _availability_lock:
+            cached = _availability.get(executable)
+        if cached and cached['expires_at'] > now:
+            return cached['available']
         try:
-            result = subprocess_run_compat(['q', '--help'], 
+            result = subprocess_run_compat([executable, '--help'], 
                                   capture_output=True, text=True, timeout=5)
-            return result.returncode == 0
+            available = result.returncode == 0
         except (subprocess.TimeoutExpired, FileNotFoundError):
-            return False
+            available = False
+        with _availability_lock:
+            _availability[executable] = { 'available': available, 'expires_at': now + AVAILABILITY_TTL }
+        return available
 
     def _is_q_cli_environment(self):
         """Check if we're running in Amazon Q CLI environment"""
         return (os.getenv('AWS_EXECUTION_ENV', '').startswith('AmazonQ-For-CLI') or 
                 os.getenv('Q_SET_PARENT_CHECK') == '1')
 
+    def _make_transcript(self, messages):
+        """Returns (role, text) pairs of the conversation, system messages excluded"""
+        transcript = []
+        for message in messages:
+            if message['role'] not in ('user', 'assistant'):
+                continue
+            content = message.get('content', [])
+            if isinstance(content, str):
+                text = content
+            else:
+                text = '\n'.join([c['text'] for c in content if c['type'] == 'text'])
+            transcript.append((message['role'], _normalize_text(text), text))
+        return transcript
+
+    def _request_via_q_session(self, messages):
+        """Sends only the new prompt to the q chat process of this conversation"""
+        transcript = self._make_transcript(messages)
+        if not transcript or transcript[-1][0] != 'user' or not transcript[-1][2].strip():
+            yield {'type': 'assistant', 'content': 'No user prompt found'}
+            return
+        history = [(role, normalized) for role, normalized, _ in transcript[:-1]]
+        prompt = transcript[-1][2]
+
+        command = self._q_chat_command()
+        session = None
+        answer = ''
+        try:
+            session = _take_session(command, history)
+            if session is None:
+                # a new (or edited) conversation, q starts with just the last prompt
+                self.utils.print_debug("amazonq: Starting Q CLI session")
+                session = _take_session(command, []) or _start_session(command)
+            else:
+                self.utils.print_debug("amazonq: Reusing Q CLI session")
+            self.utils.print_debug("amazonq: Sending prompt to Q CLI: {}", prompt[:50] + "...")
+            self.utils.record_request_bytes(sent=len(prompt.encode('utf-8')))
+            for chunk in session.ask(prompt, self._request_timeout()):
+                self.utils.record_request_bytes(received=len(chunk.encode('utf-8')))
+                answer += chunk
+                yield {'type': 'assistant', 'content': chunk}
+            session.transcript = history + [('user', _normalize_text(prompt)), ('assistant', _normalize_text(answer))]
+        except (OSError, QSessionError) as e:
+            self.utils.print_debug("amazonq: Q CLI session failed: {}", str(e))
+            if session is not None:
+                session.close()
+            if isinstance(e, FileNotFoundError):
+                invalidate_q_cli_availability()
+            if not answer:
+                yield {'type': 'assistant', 'content': 'Q Error: {}'.format(str(e))}
+        finally:
+            if session is not None:
+                if not session.is_alive() or session.transcript[-1:] != [('assistant', _normalize_text(answer))]:
+                    # cancelled or failed in the middle of an answer, the process state is unknown
+                    session.close()
+                session.busy = False
+
     def _request_via_q_cli(self, messages):
         """Use Q CLI's chat functionality with streaming support"""
         try:
@@ -67,36 +530,35 @@ class AmazonQProvider():
             self.utils.print_debug("amazonq: Sending prompt to Q CLI: {}", user_prompt[:50] + "...")
             
             # Use q chat command with proper arguments
-            cmd = ['q', 'chat', '--no-interactive']
+            cmd = self._q_chat_command() + ['--no-interactive']
             
             # Stream responses from Q CLI
             process = subprocess.Popen(cmd + [user_prompt], 
-                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                                     text=True, bufsize=1, universal_newlines=True)
-            
-            # Stream output line by line, yielding incremental deltas
-            import re
-            response_content = ""
-            while True:
-                line = process.stdout.readline()
-                if not line:
-                    break
-                
-                # Clean ANSI codes and prompt markers from this line
-                clean_line = re.sub(r'\x1b\[[0-9;]*m', '', line)
-                clean_line = re.sub(r'^>\s*', '', clean_line)
-                
-                # Accumulate response content
-                response_content += clean_line
-                
-                # Yield the cleaned line as an incremental delta
-                if clean_line.strip():
-                    yield {'type': 'assistant', 'content': clean_line}
-            
-            process.wait()
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self.utils.record_request_event('connected')
+            self.utils.record_request_bytes(sent=len(user_prompt.encode('utf-8')))
+            try:
+                # stderr is drained concurrently, a full pipe would block q
+                stderr_chunks = []
+                stderr_thread = threading.Thread(target=_drain_pipe, args=(process.stderr, stderr_chunks))
+                stderr_thread.daemon = True
+                stderr_thread.start()
+
+                response_content = ""
+                for chunk in self._read_q_output(process.stdout):
+                    response_content += chunk
+                    yield {'type': 'assistant', 'content': chunk}
+
+                process.wait()
+                stderr_thread.join()
+            finally:
+                if process.poll() is None:
+                    # cancelled or timed out
+                    process.kill()
+                    process.wait()
             
             if process.returncode != 0:
-                stderr_output = process.stderr.read()
+                stderr_output = b''.join(stderr_chunks).decode('utf-8', errors='replace')
                 error_msg = stderr_output.strip() if stderr_output else "Unknown Q CLI error"
                 self.utils.print_debug("amazonq: Q CLI error (code {}): {}", process.returncode, error_msg)
                 
@@ -108,6 +570,29 @@ class AmazonQProvider():
             self.utils.print_debug("amazonq: Q CLI request failed: {}", str(e))
             yield {'type': 'assistant', 'content': 'Error connecting to Amazon Q: {}'.format(str(e))}
 
+    def _read_q_output(self, stdout):
+        """Yields answer text as soon as q writes it, without waiting for whole lines"""
+        fd = stdout.fileno()
+        timeout = self._request_timeout()
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        stripper = AnsiStripper()
+        answer_filter = AnswerFilter()
+        while True:
+            if os.name != 'nt':
+                ready, _, _ = select.select([fd], [], [], timeout)
+                if not ready:
+                    raise QSessionError('q chat did not respond within {} seconds'.format(timeout))
+            data = os.read(fd, 4096)
+            if not data:
+                break
+            self.utils.record_request_bytes(received=len(data))
+            chunk = answer_filter.feed(stripper.feed(decoder.decode(data)))
+            if chunk:
+                yield chunk
+        chunk = answer_filter.finish()
+        if chunk:
+            yield chunk
+
     def request_image(self, prompt: str):
         raise self.utils.make_known_error("Image generation is not supported by Amazon Q")
 
@@ -1,17 +1,77 @@
-import urllib.request
 import os
 import json
-import base64
-import subprocess
-import sys
-import tempfile
+import socket
+import threading
+import time
 import vim
 
 from vim_ai.provider_imports import setup_provider_imports
 _imports = setup_provider_imports()
 globals().update(_imports)
 from vim_ai.ai_typing import Any, Sequence, Mapping, Iterator, List
-from vim_ai.utils import subprocess_run_compat
+from vim_ai.aws import (
+    AWSError, AWSCredentialsError, BedrockRuntimeClient, STSClient, resolve_credentials, resolve_region,
+    credentials_files_key,
+)
+from vim_ai.config_snapshot import get_vim_global
+from vim_ai.utils import iter_json_strings
+
+DEFAULT_AVAILABILITY_TTL = 300
+IMAGE_READ_SIZE = 65536
+
+def _is_image_path(path):
+    # Nova Canvas/Titan {"images": ["..."]}, Stability {"artifacts": [{"base64": "..."}]}
+    return (len(path) == 2 and path[0] == 'images') or (len(path) == 3 and path[0] == 'artifacts' and path[2] == 'base64')
+
+class _StreamedString(object):
+    """Pieces of a JSON string value, pulled from the shared scanner events"""
+    def __init__(self, events, piece, last):
+        self._events = events
+        self._piece = piece
+        self._last = last
+
+    def __iter__(self):
+        while True:
+            if self._piece:
+                piece, self._piece = self._piece, ''
+                yield piece
+            if self._last:
+                return
+            event = next(self._events, None)
+            if event is None:
+                raise AWSError('Bedrock image response ended early')
+            _, self._piece, self._last = event
+
+    def drain(self):
+        for _ in self:
+            pass
+
+# (profile, region) -> { 'files_key', 'expires_at', 'available' }
+_availability_cache = {}
+_availability_probes = set()
+_availability_lock = threading.Lock()
+
+def get_cached_availability(key):
+    with _availability_lock:
+        entry = _availability_cache.get(key)
+    if entry and entry['expires_at'] > time.time() and entry['files_key'] == credentials_files_key():
+        return entry['available']
+    return None
+
+def set_cached_availability(key, available, ttl):
+    with _availability_lock:
+        _availability_cache[key] = {
+            'files_key': credentials_files_key(),
+            'expires_at': time.time() + ttl,
+            'available': available,
+        }
+
+def invalidate_availability(key=None):
+    with _availability_lock:
+        if key:
+            _availability_cache.pop(key, None)
+        else:
+            _availability_cache.clear()
 
 class BedrockProvider():
 
@@ -28,38 +88,111 @@ class BedrockProvider():
         raw_default_options = {}
         if hasattr(self, "default_options_varname_{}".format(command_type)):
             varname = getattr(self, "default_options_varname_{}".format(command_type))
-            if vim.eval("exists('{}')".format(varname)) == "1":
-                raw_default_options = vim.eval(varname)
+            raw_default_options = get_vim_global(varname, {})
         
         merged_options = raw_default_options.copy()
         merged_options.update(raw_options)
         self.options = self._parse_raw_options(merged_options)
+        # token usage of the last request, e.g. {'inputTokens': 1, 'outputTokens': 2, 'totalTokens': 3}
+        self.usage = None
 
     def request(self, messages):
         """Main request method that routes to appropriate implementation"""
         
-        if self._is_aws_cli_available():
-            # Don't yield debug here, let _request_via_aws_cli handle all yields
-            for response in self._request_via_aws_cli(messages):
+        if self._is_aws_available():
+            # Don't yield debug here, let _request_via_runtime_api handle all yields
+            for response in self._request_via_runtime_api(messages):
                 yield response
         else:
             # Fallback error message
-            yield {'type': 'assistant', 'content': 'Bedrock provider requires AWS CLI with bedrock-runtime access.'}
+            yield {'type': 'assistant', 'content': 'Bedrock provider requires AWS credentials with bedrock-runtime access.'}
+
+    def prepare(self):
+        """Called when a chat is opened, probes AWS availability in the background"""
+        key = self._availability_key()
+        if get_cached_availability(key) is not None:
+            return
+        with _availability_lock:
+            if key in _availability_probes:
+                return
+            _availability_probes.add(key)
+        thread = threading.Thread(target=self._probe_availability, args=(key,))
+        thread.daemon = True
+        thread.start()
+
+    def _availability_key(self):
+        profile = self.options.get('profile') or ''
+        return (profile, resolve_region(profile, self.options.get('region')))
+
+    def _availability_ttl(self):
+        return float(self.options.get('availability_ttl', DEFAULT_AVAILABILITY_TTL))
 
-    def _is_aws_cli_available(self):
-        """Check if AWS CLI is available and configured"""
+    def _probe_availability(self, key):
+        """Verifies credentials with STS GetCallerIdentity and caches the result
+
+        The regional STS endpoint is used unless `sts_endpoint_url` is set,
+        `endpoint_url` points to Bedrock and cannot answer STS requests.
+        Only a success or a rejection of the credentials is cached, network
+        errors and auth errors of a custom STS endpoint leave the availability
+        unknown so the next request checks again.
+        """
+        sts_endpoint_url = self.options.get('sts_endpoint_url') or None
         try:
-            result = subprocess_run_compat(['aws', 'sts', 'get-caller-identity'], 
-                                  capture_output=True, text=True, timeout=10)
-            available = result.returncode == 0
-            self.utils.print_debug("bedrock: AWS CLI check - returncode: {}, available: {}".format(result.returncode, available))
+            profile, region = key
+            STSClient(region=region, profile=profile, endpoint_url=sts_endpoint_url).get_caller_identity()
+            available = True
+            self.utils.print_debug("bedrock: AWS probe succeeded for {}", key)
+        except Exception as e:
+            self.utils.print_debug("bedrock: AWS probe failed for {}: {}", key, e)
+            if not self._is_credentials_rejection(e, sts_endpoint_url):
+                return None
+            available = False
+        finally:
+            with _availability_lock:
+                _availability_probes.discard(key)
+        set_cached_availability(key, available, self._availability_ttl())
+        return available
+
+    def _is_credentials_rejection(self, error, sts_endpoint_url):
+        if isinstance(error, AWSCredentialsError):
+            return True
+        # a custom endpoint may reject the signature on its own, e.g. a proxy
+        return isinstance(error, AWSError) and error.is_auth_error and not sts_endpoint_url
+
+    def _is_aws_available(self):
+        """Check if AWS credentials can be resolved for the configured profile
+
+        The result is cached per profile and region, requests themselves
+        confirm or invalidate it so no network round trip is made here.
+        """
+        key = self._availability_key()
+        available = get_cached_availability(key)
+        if available is not None:
             return available
-        except (subprocess.TimeoutExpired, FileNotFoundError) as e:
-            self.utils.print_debug("bedrock: AWS CLI check failed: {}".format(str(e)))
-            return False
+        try:
+            credentials = resolve_credentials(self.options.get('profile'))
+            self.utils.print_debug("bedrock: AWS credentials resolved from {}", credentials.source)
+            available = True
+        except AWSError as e:
+            self.utils.print_debug("bedrock: AWS credentials check failed: {}", e)
+            available = False
+        set_cached_availability(key, available, self._availability_ttl())
+        return available
+
+    def _handle_aws_error(self, error):
+        if error.is_auth_error:
+            invalidate_availability(self._availability_key())
+
+    def _make_client(self):
+        return BedrockRuntimeClient(
+            region=self.options.get('region'),
+            profile=self.options.get('profile'),
+            endpoint_url=self.options.get('endpoint_url'),
+            timeout=float(self.options.get('request_timeout', 30)),
+        )
 
-    def _request_via_aws_cli(self, messages):
-        """Use AWS CLI to call Bedrock using the converse API"""
+    def _request_via_runtime_api(self, messages):
+        """Call Bedrock using the converse API"""
         try:
             # Convert messages to Bedrock converse format
             converse_messages = self._format_messages_for_converse(messages)
@@ -69,7 +202,6 @@ class BedrockProvider():
             
             # Prepare converse API payload
             payload = {
-                "modelId": model_id,
                 "messages": converse_messages,
                 "inferenceConfig": {
                     "maxTokens": int(self.options.get('max_tokens', 4000)),
@@ -92,61 +224,78 @@ class BedrockProvider():
                     if system_text.strip():
                         payload["system"] = [{"text": system_text}]
             
-            # Use converse API
-            cmd = [
-                'aws', 'bedrock-runtime', 'converse',
-                '--cli-input-json', json.dumps(payload),
-                '--region', self.options.get('region', os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
-            ]
+            client = self._make_client()
+            stream = self._is_stream_enabled()
+            self.utils.print_debug("bedrock: Converse {} in {} (stream: {})", model_id, client.region, stream)
+            self.utils.print_debug("bedrock: Payload: {}", payload)
             
-            # Add profile if specified
-            if 'profile' in self.options and self.options['profile']:
-                cmd.extend(['--profile', self.options['profile']])
-            
-            self.utils.print_debug("bedrock: Running command: {}".format(' '.join(cmd)))
-            self.utils.print_debug("bedrock: Payload: {}".format(json.dumps(payload, indent=2)))
-            
-            result = subprocess_run_compat(cmd, capture_output=True, text=True, timeout=30)
-            
-            if result.returncode != 0:
-                error_msg = result.stderr
-                self.utils.print_debug("bedrock: Error response: {}".format(error_msg))
+            has_content = False
+            try:
+                if stream:
+                    chunks = self._converse_stream(client, model_id, payload)
+                else:
+                    chunks = self._converse(client, model_id, payload)
+                for chunk in chunks:
+                    has_content = True
+                    yield chunk
+            except AWSError as e:
+                self._handle_aws_error(e)
+                error_msg = e.message
+                self.utils.print_debug("bedrock: Error response: {} {}", e.code, error_msg)
                 
                 # Handle specific error cases
                 if "isn't supported" in error_msg and "inference profile" in error_msg:
                     yield {'type': 'assistant', 'content': 'Model {} requires an inference profile. Try using amazon.nova-micro-v1:0 or amazon.nova-lite-v1:0 instead.'.format(model_id)}
                 elif "modify the prompt and retry" in error_msg.lower():
                     yield {'type': 'assistant', 'content': 'Bedrock content policy violation. Please modify your prompt to comply with content guidelines and try again.'}
-                elif "validation" in error_msg.lower() and "error" in error_msg.lower():
+                elif e.code == 'ValidationException':
                     yield {'type': 'assistant', 'content': 'Bedrock validation error: {}. Check your model ID and parameters.'.format(error_msg)}
                 else:
                     yield {'type': 'assistant', 'content': 'Bedrock error: {}'.format(error_msg)}
                 return
             
-            # Parse response
-            try:
-                response = json.loads(result.stdout)
-            except json.JSONDecodeError as e:
-                yield {'type': 'assistant', 'content': 'Error parsing Bedrock response: {}. Raw stdout: {}'.format(str(e), result.stdout)}
-                return
-            
-            # Extract content from converse API response
-            content = ""
-            if 'output' in response and 'message' in response['output']:
-                message = response['output']['message']
-                if 'content' in message and len(message['content']) > 0:
-                    content = message['content'][0].get('text', '')
-            
-            if content:
-                yield {'type': 'assistant', 'content': content}
-            else:
+            if not has_content:
                 yield {'type': 'assistant', 'content': 'No response content from Bedrock'}
                 
-        except subprocess.TimeoutExpired:
+        except socket.timeout:
             yield {'type': 'assistant', 'content': 'Bedrock request timed out. The model may be processing a complex query.'}
         except Exception as e:
             yield {'type': 'assistant', 'content': 'Error connecting to Bedrock: {}'.format(str(e))}
 
+    def _is_stream_enabled(self):
+        return str(self.options.get('stream', 1)).lower() in ('1', 'true')
+
+    def _set_usage(self, usage):
+        self.usage = usage
+        self.utils.record_request_usage(usage.get('inputTokens'), usage.get('outputTokens'))
+        self.utils.print_debug("bedrock: usage: {}", usage)
+
+    def _converse(self, client, model_id, payload):
+        """Yields content blocks of a converse API response"""
+        response = client.converse(model_id, payload)
+        if response.get('usage'):
+            self._set_usage(response['usage'])
+        message = response.get('output', {}).get('message', {})
+        for block in message.get('content', []):
+            reasoning = block.get('reasoningContent', {}).get('reasoningText', {})
+            if reasoning.get('text'):
+                yield {'type': 'thinking', 'content': reasoning['text']}
+            if block.get('text'):
+                yield {'type': 'assistant', 'content': block['text']}
+
+    def _converse_stream(self, client, model_id, payload):
+        """Yields text deltas of a converse-stream API response as they arrive"""
+        for event_type, event in client.converse_stream(model_id, payload):
+            if event_type == 'contentBlockDelta':
+                delta = event.get('delta', {})
+                reasoning = delta.get('reasoningContent', {})
+                if reasoning.get('text'):
+                    yield {'type': 'thinking', 'content': reasoning['text']}
+                if delta.get('text'):
+                    yield {'type': 'assistant', 'content': delta['text']}
+            elif event_type == 'metadata' and event.get('usage'):
+                self._set_usage(event['usage'])
+
     def _format_messages_for_converse(self, messages):
         """Convert vim-ai messages to Bedrock converse format"""
         converse_messages = []
@@ -206,73 +355,76 @@ class BedrockProvider():
         return bedrock_messages
 
     def request_image(self, prompt: str):
-        """Generate image using Bedrock image models"""
-        if not self._is_aws_cli_available():
-            yield {'type': 'error', 'content': 'Bedrock provider requires AWS CLI with bedrock-runtime access.'}
-            return
-            
+        """Generate images using Bedrock image models
+
+        Images are yielded one by one as `b64_data` chunks, each of them is
+        an iterable of base64 pieces read from the response stream, so the
+        caller decodes it to disk before the next one is read.
+        """
+        if not self._is_aws_available():
+            raise self.utils.make_known_error('Bedrock provider requires AWS credentials with bedrock-runtime access.')
+
+        model_id = self.options.get('model', os.environ.get('BEDROCK_IMAGE_MODEL', 'amazon.nova-canvas-v1:0'))
+        payload = self._make_image_payload(model_id, prompt)
+        self.utils.print_debug("bedrock: [image] request: {}", payload)
+
         try:
-            # Use Stability AI SDXL model for image generation
-            model_id = self.options.get('model', 
-                os.environ.get('BEDROCK_IMAGE_MODEL', 'amazon.nova-canvas-v1:0'))
-            
-            payload = {
-                "text_prompts": [{"text": prompt}],
-                "cfg_scale": self.options.get('cfg_scale', 10),
-                "seed": self.options.get('seed', 0),
-                "steps": self.options.get('steps', 50),
-                "width": self.options.get('width', 1024),
-                "height": self.options.get('height', 1024)
+            response = self._make_client().invoke_model_stream(model_id, payload)
+            with response:
+                images_count = 0
+                error = []
+                events = iter_json_strings(iter(lambda: response.read(IMAGE_READ_SIZE), b''))
+                for path, piece, last in events:
+                    if _is_image_path(path):
+                        if last and not piece:
+                            continue
+                        image = _StreamedString(events, piece, last)
+                        yield { 'b64_data': image }
+                        # the caller may stop early, the rest of the image is skipped
+                        image.drain()
+                        images_count += 1
+                    elif path == ('error',):
+                        error.append(piece)
+        except AWSError as e:
+            self._handle_aws_error(e)
+            raise self.utils.make_known_error('Bedrock image error: {}'.format(e.message))
+        except socket.timeout:
+            raise self.utils.make_known_error('Bedrock image generation timed out. Large images may take longer to generate.')
+
+        self.utils.print_debug("bedrock: [image] response: {}", { 'images_count': images_count })
+        if error:
+            raise self.utils.make_known_error('Bedrock image error: {}'.format(''.join(error)))
+        if not images_count:
+            raise self.utils.make_known_error('No image data in Bedrock response')
+
+    def _make_image_payload(self, model_id, prompt):
+        options = self.options
+        number_of_images = int(options.get('number_of_images', 1))
+        if model_id.startswith(('amazon.nova-canvas', 'amazon.titan-image')):
+            generation_config = {
+                "numberOfImages": number_of_images,
+                "width": int(options.get('width', 1024)),
+                "height": int(options.get('height', 1024)),
+                "cfgScale": float(options.get('cfg_scale', 8)),
+                "seed": int(options.get('seed', 0)),
             }
-            
-            # Create temporary file for response
-            temp_fd, temp_path = tempfile.mkstemp(suffix='_bedrock_image_response.json')
-            os.close(temp_fd)  # Close the file descriptor, we'll use the path
-            
-            try:
-                cmd = [
-                    'aws', 'bedrock-runtime', 'invoke-model',
-                    '--model-id', model_id,
-                    '--body', json.dumps(payload),
-                    '--region', self.options.get('region', os.environ.get('AWS_DEFAULT_REGION', 'us-east-1')),
-                    temp_path
-                ]
-            
-                # Add profile if specified
-                if 'profile' in self.options and self.options['profile']:
-                    cmd.extend(['--profile', self.options['profile']])
-                
-                result = subprocess_run_compat(cmd, capture_output=True, text=True, timeout=60)
-                
-                if result.returncode != 0:
-                    yield {'type': 'error', 'content': 'Bedrock image error: {}'.format(result.stderr)}
-                    return
-                
-                # Read response
-                with open(temp_path, 'r') as f:
-                    response = json.load(f)
-                
-                # Extract image data
-                if 'artifacts' in response and len(response['artifacts']) > 0:
-                    image_data = response['artifacts'][0].get('base64', '')
-                    if image_data:
-                        yield {'type': 'image', 'content': image_data, 'format': 'base64'}
-                    else:
-                        yield {'type': 'error', 'content': 'No image data in Bedrock response'}
-                else:
-                    yield {'type': 'error', 'content': 'No image artifacts in Bedrock response'}
-                    
-            finally:
-                # Clean up temporary file
-                try:
-                    os.unlink(temp_path)
-                except OSError:
-                    pass
-                
-        except subprocess.TimeoutExpired:
-            yield {'type': 'error', 'content': 'Bedrock image generation timed out. Large images may take longer to generate.'}
-        except Exception as e:
-            yield {'type': 'error', 'content': 'Error generating image with Bedrock: {}'.format(str(e))}
+            if options.get('quality'):
+                generation_config['quality'] = options['quality']
+            return {
+                "taskType": "TEXT_IMAGE",
+                "textToImageParams": {"text": prompt},
+                "imageGenerationConfig": generation_config,
+            }
+        # Stability AI SDXL
+        return {
+            "text_prompts": [{"text": prompt}],
+            "cfg_scale": float(options.get('cfg_scale', 10)),
+            "seed": int(options.get('seed', 0)),
+            "steps": int(options.get('steps', 50)),
+            "width": int(options.get('width', 1024)),
+            "height": int(options.get('height', 1024)),
+            "samples": number_of_images,
+        }
 
     def _parse_raw_options(self, raw_options):
         return raw_options.copy()
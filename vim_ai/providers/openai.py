@@ -7,6 +7,8 @@ from vim_ai.provider_imports import setup_provider_imports
 _imports = setup_provider_imports()
 globals().update(_imports)
 from vim_ai.ai_typing import List
+from vim_ai.utils import JSONBodyStream
+from vim_ai.config_snapshot import get_vim_global
 
 class OpenAIProvider():
 
@@ -19,7 +21,7 @@ class OpenAIProvider():
         self.utils = utils
         self.command_type = command_type
         config_varname = getattr(self, "default_options_varname_{}".format(command_type))
-        raw_default_options = vim.eval(config_varname)
+        raw_default_options = get_vim_global(config_varname)
         merged_options = raw_default_options.copy()
         merged_options.update(raw_options)
         self.options = self._parse_raw_options(merged_options)
@@ -194,8 +196,7 @@ class OpenAIProvider():
         url = options['endpoint_url']
         response, *_ = self._openai_request(url, request, http_options)
         self.utils.print_debug("openai: [{}] response: {}", self.command_type, { 'images_count': len(response['data']) })
-        b64_data = response['data'][0]['b64_json']
-        return [{ 'b64_data': b64_data }]
+        return [{ 'b64_data': image['b64_json'] } for image in response['data']]
 
     def _openai_request(self, url, data, options):
         RESP_DATA_PREFIX = 'data: '
@@ -218,19 +219,31 @@ class OpenAIProvider():
             (OPENAI_API_KEY, _) = self._load_api_key()
             headers['api-key'] = "{}".format(OPENAI_API_KEY)
 
+        # stream the body in chunks instead of materializing the whole payload
+        with self.utils.trace_span('request serialization'):
+            body = JSONBodyStream(data)
+            headers["Content-Length"] = str(len(body))
+
         request_timeout=options['request_timeout']
         req = urllib.request.Request(
             url,
-            data=json.dumps(data).encode("utf-8"),
+            data=body,
             headers=headers,
             method="POST",
         )
 
-        with urllib.request.urlopen(req, timeout=request_timeout) as response:
+        self.utils.record_request_bytes(sent=len(body))
+        with self.utils.trace_span('network wait'):
+            response = urllib.request.urlopen(req, timeout=request_timeout)
+        self.utils.record_request_event('connected')
+        with response:
             if not data.get('stream', 0):
-                yield json.loads(response.read().decode())
+                response_bytes = response.read()
+                self.utils.record_request_bytes(received=len(response_bytes))
+                yield json.loads(response_bytes.decode())
                 return
             for line_bytes in response:
+                self.utils.record_request_bytes(received=len(line_bytes))
                 line = line_bytes.decode("utf-8", errors="replace")
                 if line.startswith(RESP_DATA_PREFIX):
                     line_data = line[len(RESP_DATA_PREFIX):-1]
@@ -0,0 +1,387 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+
+try:
+    import numpy
+except ImportError:
+    # scores are accumulated in a dict, numpy only speeds up large indexes
+    numpy = None
+
+from vim_ai.project_index import get_project_index
+from vim_ai.utils import print_debug
+
+INDEX_VERSION = 2
+INDEXED_EXTENSIONS = (
+    '.py', '.js', '.jsx', '.ts', '.tsx', '.java', '.kt', '.go', '.rs', '.c', '.h', '.cc',
+    '.cpp', '.hpp', '.cs', '.rb', '.php', '.swift', '.scala', '.lua', '.sh', '.vim',
+    '.md', '.rst', '.txt',
+)
+PROSE_EXTENSIONS = ('.md', '.rst', '.txt')
+MAX_FILE_SIZE = 256 * 1024
+MAX_INDEXED_FILES = 20000
+MAX_CHUNK_LINES = 60
+MIN_PARAGRAPH_LINES = 5
+# nested definitions (methods) only start a chunk once it has this many lines
+MIN_NESTED_CHUNK_LINES = 15
+# seconds during which files are not checked for changes again
+REFRESH_INTERVAL = 10
+TOP_K = 8
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# a line starting a function, class or similar definition near the left margin
+_DEFINITION_RE = re.compile(
+    r'^(\s{0,4})(?:export\s+)?(?:default\s+)?(?:pub(?:\([\w:]+\))?\s+)?(?:async\s+)?(?:static\s+)?'
+    r'(?:def|class|function!?|func|fn|impl|interface|struct|enum|trait|module)\b'
+)
+_WORD_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|[0-9]+')
+_CAMEL_RE = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+')
+_STOPWORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'if', 'in', 'is', 'it',
+    'of', 'on', 'or', 'that', 'the', 'this', 'to', 'with', 'me', 'my', 'can', 'you', 'do',
+))
+
+def tokenize(text):
+    """Splits text into lowercase terms, identifiers also yield their snake/camel case parts"""
+    terms = []
+    for word in _WORD_RE.findall(text):
+        lower = word.lower()
+        if len(lower) > 1 and lower not in _STOPWORDS:
+            terms.append(lower)
+        parts = [part for piece in word.split('_') for part in _CAMEL_RE.findall(piece)]
+        if len(parts) > 1:
+            for part in parts:
+                part = part.lower()
+                if len(part) > 1 and part not in _STOPWORDS:
+                    terms.append(part)
+    return terms
+
+def chunk_lines(lines, is_prose=False):
+    """Splits lines into (start, end) ranges by definitions (code) or paragraphs (prose)"""
+    chunks = []
+    start = 0
+    for i, line in enumerate(lines):
+        size = i - start
+        if size == 0:
+            continue
+        if is_prose:
+            is_boundary = not line.strip() and size >= MIN_PARAGRAPH_LINES
+        else:
+            match = _DEFINITION_RE.match(line)
+            is_boundary = bool(match) and (not match.group(1) or size >= MIN_NESTED_CHUNK_LINES)
+        if is_boundary or size >= MAX_CHUNK_LINES:
+            chunks.append((start, i))
+            start = i
+    if start < len(lines):
+        chunks.append((start, len(lines)))
+    return [(start, end) for start, end in chunks if any(line.strip() for line in lines[start:end])]
+
+def chunk_file(content, is_prose=False):
+    lines = content.splitlines()
+    chunks = []
+    for start, end in chunk_lines(lines, is_prose):
+        terms = {}
+        for term in tokenize('\n'.join(lines[start:end])):
+            terms[term] = terms.get(term, 0) + 1
+        if terms:
+            # line numbers are 1-based and inclusive, the text is read again when a chunk is found
+            chunks.append({ 'start': start + 1, 'end': end, 'terms': terms })
+    return chunks
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def get_index_dir():
+    index_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(index_dir, 'vim-ai', 'retrieval')
+
+class RetrievalIndex(object):
+    """BM25 index of project file chunks, persisted between sessions
+
+    Chunks keep only their line range and term frequencies, the text of
+    the matching chunks is read from the files when searching. Updates run
+    in a background thread, only files that changed (mtime or size) are
+    chunked again and appended to the index log. Nothing is found until
+    the first update finishes.
+    """
+    def __init__(self, root, index_path=None):
+        self.root = os.path.abspath(root)
+        if index_path is None:
+            digest = hashlib.sha1(self.root.encode('utf-8')).hexdigest()[:16]
+            index_path = os.path.join(get_index_dir(), digest + '.jsonl')
+        self.index_path = index_path
+        self.files = None
+        self.log_records = 0
+        self.chunks = []
+        self.postings = {}
+        self.average_length = 0
+        self.ready = False
+        self._numpy_postings = {}
+        self._numpy_lengths = None
+        self.checked_at = None
+        self._refresh_thread = None
+        # lock guards the postings, update_lock the files and the index log
+        self.lock = threading.Lock()
+        self.update_lock = threading.Lock()
+
+    def _load(self):
+        """Replays the index log, later records of a file replace earlier ones"""
+        files = {}
+        self.log_records = 0
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                if header.get('version') != INDEX_VERSION or header.get('root') != self.root:
+                    return {}
+                for line in f:
+                    record = json.loads(line)
+                    self.log_records += 1
+                    if record.get('deleted'):
+                        files.pop(record['path'], None)
+                    else:
+                        files[record.pop('path')] = record
+        except (IOError, OSError, ValueError, KeyError):
+            # a missing or broken log is rebuilt from scratch
+            self.log_records = 0
+            return {}
+        return files
+
+    def _write_log(self, records, rewrite):
+        try:
+            if not os.path.isdir(os.path.dirname(self.index_path)):
+                os.makedirs(os.path.dirname(self.index_path))
+            if rewrite:
+                tmp_path = self.index_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(json.dumps({ 'version': INDEX_VERSION, 'root': self.root }) + '\n')
+                    for record in records:
+                        f.write(json.dumps(record) + '\n')
+                os.replace(tmp_path, self.index_path)
+                self.log_records = len(records)
+            else:
+                with open(self.index_path, 'a', encoding='utf-8') as f:
+                    for record in records:
+                        f.write(json.dumps(record) + '\n')
+                self.log_records += len(records)
+        except (IOError, OSError) as error:
+            print_debug("[retrieval] cannot save index: {}", error)
+
+    def _save(self, changed_records):
+        """Appends the changed records, the log is compacted once it is mostly stale"""
+        if not os.path.exists(self.index_path) or self.log_records + len(changed_records) > 2 * len(self.files) + 100:
+            records = [dict(record, path=path) for path, record in sorted(self.files.items())]
+            self._write_log(records, rewrite=True)
+        elif changed_records:
+            self._write_log(changed_records, rewrite=False)
+
+    def _list_files(self):
+        paths = [path for path in get_project_index(self.root).list_files() if path.endswith(INDEXED_EXTENSIONS)]
+        return paths[:MAX_INDEXED_FILES]
+
+    def _update(self):
+        if self.files is None:
+            self.files = self._load()
+        changed_records = []
+        paths = self._list_files()
+        for path in set(self.files) - set(paths):
+            del self.files[path]
+            changed_records.append({ 'path': path, 'deleted': True })
+        for path in paths:
+            try:
+                stat = os.stat(os.path.join(self.root, path))
+            except OSError:
+                continue
+            record = self.files.get(path)
+            if record and record['mtime'] == stat.st_mtime_ns and record['size'] == stat.st_size:
+                continue
+            chunks = []
+            if stat.st_size <= MAX_FILE_SIZE:
+                try:
+                    with open(os.path.join(self.root, path), encoding='utf-8') as f:
+                        chunks = chunk_file(f.read(), path.endswith(PROSE_EXTENSIONS))
+                except (IOError, OSError, UnicodeDecodeError):
+                    chunks = []
+            record = { 'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'chunks': chunks }
+            self.files[path] = record
+            changed_records.append(dict(record, path=path))
+        if changed_records or not self.ready:
+            self._build_postings()
+        self._save(changed_records)
+
+    def _build_postings(self):
+        chunks = []
+        postings = {}
+        total_length = 0
+        for path in sorted(self.files):
+            record = self.files[path]
+            for chunk in record['chunks']:
+                chunk_id = len(chunks)
+                length = sum(chunk['terms'].values())
+                chunks.append((path, chunk, length, record['mtime']))
+                total_length += length
+                for term, frequency in chunk['terms'].items():
+                    postings.setdefault(term, ([], []))
+                    postings[term][0].append(chunk_id)
+                    postings[term][1].append(frequency)
+        with self.lock:
+            self.chunks = chunks
+            self.postings = postings
+            self.average_length = float(total_length) / len(chunks) if chunks else 0
+            self._numpy_postings = {}
+            self._numpy_lengths = None
+            self.ready = True
+
+    def refresh(self, force=False):
+        """Updates the index in the calling thread"""
+        with self.update_lock:
+            now = time.time()
+            if not force and self.checked_at is not None and now - self.checked_at < REFRESH_INTERVAL:
+                return
+            self._update()
+            self.checked_at = time.time()
+
+    def _run_refresh(self):
+        try:
+            self.refresh()
+        except Exception as error:
+            print_debug("[retrieval] index update failed: {}", error, level='error')
+
+    def refresh_in_background(self):
+        """Starts an update unless one is running or the index was checked recently"""
+        with self.lock:
+            thread = self._refresh_thread
+            if thread is not None and thread.is_alive():
+                return thread
+            if self.checked_at is not None and time.time() - self.checked_at < REFRESH_INTERVAL:
+                return None
+            thread = threading.Thread(target=self._run_refresh)
+            thread.daemon = True
+            self._refresh_thread = thread
+        thread.start()
+        return thread
+
+    def _idf(self, term):
+        frequency = len(self.postings[term][0])
+        return math.log(1 + (len(self.chunks) - frequency + 0.5) / (frequency + 0.5))
+
+    def _score_python(self, terms):
+        scores = {}
+        for term in terms:
+            idf = self._idf(term)
+            chunk_ids, frequencies = self.postings[term]
+            for chunk_id, frequency in zip(chunk_ids, frequencies):
+                length = self.chunks[chunk_id][2]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.average_length)
+                scores[chunk_id] = scores.get(chunk_id, 0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def _score_numpy(self, terms):
+        if self._numpy_lengths is None:
+            self._numpy_lengths = numpy.array([chunk[2] for chunk in self.chunks], dtype=numpy.float64)
+        scores = numpy.zeros(len(self.chunks))
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * self._numpy_lengths / self.average_length)
+        for term in terms:
+            arrays = self._numpy_postings.get(term)
+            if arrays is None:
+                chunk_ids, frequencies = self.postings[term]
+                arrays = (numpy.array(chunk_ids, dtype=numpy.int64), numpy.array(frequencies, dtype=numpy.float64))
+                self._numpy_postings[term] = arrays
+            chunk_ids, frequencies = arrays
+            scores[chunk_ids] += self._idf(term) * frequencies * (BM25_K1 + 1) / (frequencies + norms[chunk_ids])
+        matched = numpy.nonzero(scores)[0]
+        order = matched[numpy.lexsort((matched, -scores[matched]))]
+        return [(int(chunk_id), float(scores[chunk_id])) for chunk_id in order]
+
+    def _read_chunk_text(self, path, chunk, mtime, cache):
+        """Returns text of the chunk, None if the file changed since it was indexed"""
+        if path not in cache:
+            full_path = os.path.join(self.root, path)
+            try:
+                if os.stat(full_path).st_mtime_ns != mtime:
+                    cache[path] = None
+                else:
+                    with open(full_path, encoding='utf-8') as f:
+                        cache[path] = f.read().splitlines()
+            except (IOError, OSError, UnicodeDecodeError):
+                cache[path] = None
+        lines = cache[path]
+        if lines is None:
+            return None
+        return '\n'.join(lines[chunk['start'] - 1:chunk['end']]).strip('\n')
+
+    def search(self, query, top_k=TOP_K):
+        """Returns up to top_k best matching chunks as dicts with path, start, end, text and score
+
+        The index is updated in the background, an empty list is returned
+        until it is built for the first time.
+        """
+        self.refresh_in_background()
+        with self.lock:
+            if not self.ready:
+                return []
+            terms = sorted(set(term for term in tokenize(query) if term in self.postings))
+            if not terms:
+                return []
+            if numpy is not None:
+                ranked = self._score_numpy(terms)
+            else:
+                ranked = self._score_python(terms)
+            matches = [self.chunks[chunk_id] + (score,) for chunk_id, score in ranked[:top_k]]
+        results = []
+        file_lines = {}
+        for path, chunk, _, mtime, score in matches:
+            text = self._read_chunk_text(path, chunk, mtime, file_lines)
+            if text is None:
+                continue
+            results.append({
+                'path': path,
+                'start': chunk['start'],
+                'end': chunk['end'],
+                'text': text,
+                'score': score,
+            })
+        return results
+
+def select_within_budget(results, budget_tokens, exclude_text=''):
+    """Keeps the best results that fit into the token budget, skipping text already present"""
+    selected = []
+    used = 0
+    for result in results:
+        if result['text'].strip() in exclude_text:
+            continue
+        tokens = estimate_tokens(result['text'])
+        if used + tokens > budget_tokens:
+            continue
+        selected.append(result)
+        used += tokens
+    return selected
+
+def format_chunks(results):
+    # same header as the >>> include blocks
+    return ['==> {}:{}-{} <==\n{}'.format(r['path'], r['start'], r['end'], r['text']) for r in results]
+
+_retrieval_indexes = {}
+_MAX_RETRIEVAL_INDEXES = 4
+_retrieval_indexes_lock = threading.Lock()
+
+def get_retrieval_index(root):
+    root = os.path.abspath(root)
+    with _retrieval_indexes_lock:
+        index = _retrieval_indexes.get(root)
+        if index is None:
+            if len(_retrieval_indexes) >= _MAX_RETRIEVAL_INDEXES:
+                _retrieval_indexes.clear()
+            index = RetrievalIndex(root)
+            _retrieval_indexes[root] = index
+    return index
+
+def find_relevant_chunks(root, query, budget_tokens, top_k=TOP_K, exclude_text=None):
+    """Returns formatted chunks best matching the query, chunks found in exclude_text are skipped"""
+    results = get_retrieval_index(root).search(query, top_k)
+    exclude_text = query if exclude_text is None else exclude_text
+    return format_chunks(select_within_budget(results, budget_tokens, exclude_text=exclude_text))
@@ -1,22 +1,16 @@
 import vim
-import os
+from bisect import bisect_left
 
-if "PYTEST_VERSION" in os.environ:
-    from .utils import *
-else:
-    try:
-        from utils import read_role_files, DEFAULT_ROLE_NAME, enhance_roles_with_custom_function
-    except ImportError:
-        from .utils import read_role_files, DEFAULT_ROLE_NAME, enhance_roles_with_custom_function
+from vim_ai.utils import read_role_files, DEFAULT_ROLE_NAME, load_custom_roles
 
-roles_py_imported = True
+ROLE_COMMAND_TYPES = ['complete', 'edit', 'chat', 'image']
 
-def load_ai_role_names(command_type):
-    roles = read_role_files()
-    enhance_roles_with_custom_function(roles)
+# sorted role names per command type, rebuilt only when role files or custom roles change
+_role_names_index = { 'role_files': None, 'custom_names': None, 'names': {}, 'folded_names': {} }
 
+def _make_role_names(section_names, command_type):
     role_names = set()
-    for name in roles.sections():
+    for name in section_names:
         parts = name.split('.')
         if command_type == 'image':
             # special case - image type have to be explicitely defined
@@ -26,7 +20,58 @@ def load_ai_role_names(command_type):
             if len(parts) == 1 or parts[-1] == command_type:
                 role_names.add(parts[0])
 
-    role_names = [name for name in role_names if name != DEFAULT_ROLE_NAME]
-    role_names.sort()
+    role_names.discard(DEFAULT_ROLE_NAME)
+    return sorted(role_names)
+
+def _get_role_names_index():
+    role_files = read_role_files()
+    custom_roles = load_custom_roles()
+    custom_names = sorted(custom_roles.keys())
+
+    index = _role_names_index
+    if index['role_files'] is not role_files or index['custom_names'] != custom_names:
+        section_names = set(role_files.sections())
+        section_names.update(custom_names)
+        index['names'] = {}
+        index['folded_names'] = {}
+        for command_type in ROLE_COMMAND_TYPES:
+            index['names'][command_type] = _make_role_names(section_names, command_type)
+        index['role_files'] = role_files
+        index['custom_names'] = custom_names
+    return index
+
+def _get_role_names(command_type):
+    index = _get_role_names_index()
+    if command_type not in index['names']:
+        section_names = set(index['role_files'].sections())
+        section_names.update(index['custom_names'])
+        index['names'][command_type] = _make_role_names(section_names, command_type)
+    return index['names'][command_type]
+
+def _get_folded_role_names(command_type):
+    role_names = _get_role_names(command_type)
+    folded_names = _role_names_index['folded_names']
+    if command_type not in folded_names:
+        folded_names[command_type] = sorted((name.lower(), name) for name in role_names)
+    return folded_names[command_type]
+
+def load_ai_role_names(command_type):
+    return list(_get_role_names(command_type))
 
-    return list(role_names)
+def complete_ai_role_names(command_type, prefix, ignore_case=False):
+    if ignore_case:
+        # matches the 'ignorecase' option like the former =~ filter did
+        prefix = prefix.lower()
+        role_names = _get_folded_role_names(command_type)
+        start = bisect_left(role_names, (prefix, ''))
+        key = lambda item: item[0]
+    else:
+        role_names = _get_role_names(command_type)
+        start = bisect_left(role_names, prefix)
+        key = lambda item: item
+    matches = []
+    for i in range(start, len(role_names)):
+        if not key(role_names[i]).startswith(prefix):
+            break
+        matches.append(role_names[i][1] if ignore_case else role_names[i])
+    return matches
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from vim_ai.config_snapshot import get_vim_global
+
+# trace of the command running in the main thread, set by make_ai_context
+_active_trace = None
+# trace bound to a background job thread
+_current = threading.local()
+
+class Trace(object):
+    """Spans of a single command, exported as Chrome trace event JSON
+
+    Timestamps are microseconds since the trace started, every event is
+    tagged with the request id. Events may be added from any thread.
+    """
+    def __init__(self, command_type, trace_dir):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.command_type = command_type
+        self.trace_dir = trace_dir
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.events = []
+        self.thread_names = {}
+        self.finished = False
+        self.lock = threading.Lock()
+
+    def timestamp(self, at=None):
+        at = time.perf_counter() if at is None else at
+        return int(round((at - self._start) * 1000000))
+
+    def _add(self, event, args):
+        thread = threading.current_thread()
+        event_args = { 'request_id': self.request_id }
+        event_args.update(args)
+        event.update({ 'cat': 'vim_ai', 'pid': os.getpid(), 'tid': thread.ident, 'args': event_args })
+        with self.lock:
+            if self.finished:
+                return
+            self.thread_names[thread.ident] = thread.name
+            self.events.append(event)
+
+    def add_span(self, name, started, ended, **args):
+        """Adds a complete event, started and ended are time.perf_counter() values"""
+        ts = self.timestamp(started)
+        self._add({ 'name': name, 'ph': 'X', 'ts': ts, 'dur': max(self.timestamp(ended) - ts, 0) }, args)
+
+    def add_instant(self, name, **args):
+        self._add({ 'name': name, 'ph': 'i', 's': 't', 'ts': self.timestamp() }, args)
+
+    def to_json(self):
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+        metadata = [
+            { 'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': { 'name': name } }
+            for tid, name in thread_names.items()
+        ]
+        return {
+            'traceEvents': metadata + events,
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'request_id': self.request_id,
+                'command_type': self.command_type,
+                'started_at': self.started_at,
+            },
+        }
+
+    def make_path(self):
+        timestamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(self.started_at))
+        filename = '{}_{}_{}.json'.format(timestamp, self.command_type or 'command', self.request_id)
+        return os.path.join(self.trace_dir, filename)
+
+    def write(self):
+        """Writes the trace once, later events are ignored, returns the path or None"""
+        with self.lock:
+            if self.finished:
+                return None
+            self.finished = True
+        path = self.make_path()
+        try:
+            if not os.path.isdir(self.trace_dir):
+                os.makedirs(self.trace_dir)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.to_json(), f)
+        except (IOError, OSError):
+            return None
+        return path
+
+class _Span(object):
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.trace.add_span(self.name, self.started, time.perf_counter(), **self.args)
+        return False
+
+class _NoSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def start_trace(command_type):
+    """Starts tracing a command, must be called from the main thread
+
+    Returns None when tracing is disabled.
+    """
+    global _active_trace
+    _active_trace = None
+    if get_vim_global("g:vim_ai_trace", "0") != "1":
+        return None
+    trace_dir = os.path.expanduser(get_vim_global("g:vim_ai_trace_dir", ""))
+    if not trace_dir:
+        return None
+    _active_trace = Trace(command_type, trace_dir)
+    return _active_trace
+
+def current_trace():
+    trace = getattr(_current, 'trace', None)
+    if trace is None and threading.current_thread() is threading.main_thread():
+        trace = _active_trace
+    return trace
+
+def finish_trace(trace=None):
+    """Writes the trace (the active one by default), returns its path or None"""
+    global _active_trace
+    trace = trace or _active_trace
+    if trace is None:
+        return None
+    if trace is _active_trace:
+        _active_trace = None
+    return trace.write()
+
+def span(name, trace=None, **args):
+    """Context manager recording a span into the given or the current trace"""
+    trace = trace or current_trace()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, args)
+
+def instant(name, trace=None, **args):
+    trace = trace or current_trace()
+    if trace is not None:
+        trace.add_instant(name, **args)
+
+class bind_trace(object):
+    """Makes the trace current in a background job thread"""
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self.previous = getattr(_current, 'trace', None)
+        _current.trace = self.trace
+        return self.trace
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        _current.trace = self.previous
+        return False
+
+def trace_chunks(chunks, trace=None):
+    """Yields response chunks inside a `provider request` span, marks the first chunk"""
+    trace = trace or current_trace()
+    if trace is None:
+        yield from chunks
+        return
+    with span('provider request', trace) as request_span:
+        request_span.args['chunks'] = 0
+        for chunk in chunks:
+            if not request_span.args['chunks']:
+                trace.add_instant('first chunk')
+            request_span.args['chunks'] += 1
+            yield chunk
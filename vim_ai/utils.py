@@ -3,8 +3,10 @@ import datetime
 import glob
 import os
 import json
+import re
 import socket
 import subprocess
+import time
 from urllib.error import URLError
 from urllib.error import HTTPError
 import traceback
@@ -75,34 +77,51 @@ def subprocess_run_compat(*args, **kwargs):
         raise
 import configparser
 import base64
-
-utils_py_imported = True
+import codecs
+import importlib
+from vim_ai.config_snapshot import load_config_snapshot, get_config_version, get_vim_global
+from vim_ai import debug_log
+from vim_ai import metrics
+from vim_ai import tracing
 
 DEFAULT_ROLE_NAME = 'default'
 
-_vimai_thread_is_debug_active = vim.eval("g:vim_ai_debug") == "1"
-_vimai_thread_log_file_path = vim.eval("g:vim_ai_debug_log_file")
-_vimai_thread_token_file_path = vim.eval("g:vim_ai_token_file_path")
-_vimai_thread_token_load_fn = vim.eval("g:vim_ai_token_load_fn")
+def _read_debug_level():
+    return debug_log.LEVELS.get(get_vim_global("g:vim_ai_debug_level", "debug"), debug_log.LEVELS['debug'])
+
+_vimai_thread_is_debug_active = get_vim_global("g:vim_ai_debug", "0") == "1"
+_vimai_thread_log_file_path = get_vim_global("g:vim_ai_debug_log_file", "")
+_vimai_thread_debug_level = _read_debug_level()
+_vimai_thread_log_max_size = int(get_vim_global("g:vim_ai_debug_log_max_size", "0") or 0)
+_vimai_thread_token_file_path = get_vim_global("g:vim_ai_token_file_path", "")
+_vimai_thread_token_load_fn = get_vim_global("g:vim_ai_token_load_fn", "")
 
 def update_thread_shared_variables():
     global _vimai_thread_is_debug_active
     global _vimai_thread_log_file_path
+    global _vimai_thread_debug_level
+    global _vimai_thread_log_max_size
     global _vimai_thread_token_file_path
     global _vimai_thread_token_load_fn
-    _vimai_thread_is_debug_active = vim.eval("g:vim_ai_debug") == "1"
-    _vimai_thread_log_file_path = vim.eval("g:vim_ai_debug_log_file")
-    _vimai_thread_token_file_path = vim.eval("g:vim_ai_token_file_path")
-    _vimai_thread_token_load_fn = vim.eval("g:vim_ai_token_load_fn")
-
-def print_debug(text, *args):
-    global _vimai_thread_is_debug_active
-    global _vimai_thread_log_file_path
-    if not _vimai_thread_is_debug_active:
+    _vimai_thread_is_debug_active = get_vim_global("g:vim_ai_debug", "0") == "1"
+    _vimai_thread_log_file_path = get_vim_global("g:vim_ai_debug_log_file", "")
+    _vimai_thread_debug_level = _read_debug_level()
+    _vimai_thread_log_max_size = int(get_vim_global("g:vim_ai_debug_log_max_size", "0") or 0)
+    _vimai_thread_token_file_path = get_vim_global("g:vim_ai_token_file_path", "")
+    _vimai_thread_token_load_fn = get_vim_global("g:vim_ai_token_load_fn", "")
+
+def is_debug_enabled(level='debug'):
+    return _vimai_thread_is_debug_active and debug_log.LEVELS[level] >= _vimai_thread_debug_level
+
+def print_debug(text, *args, level='debug'):
+    """Logs the message when debugging is on, nothing is formatted otherwise
+
+    Large payloads in the arguments are redacted, callables are called
+    first, so expensive values can be passed as `lambda: ...`.
+    """
+    if not is_debug_enabled(level):
         return
-    with open(_vimai_thread_log_file_path, "a") as file:
-        message = text.format(*args) if len(args) else text
-        file.write("[" + str(datetime.datetime.now()) + "] " + message + "\n")
+    debug_log.write_log(_vimai_thread_log_file_path, level, text, args, max_size=_vimai_thread_log_max_size)
 
 class KnownError(Exception):
     pass
@@ -122,8 +141,22 @@ def load_token_from_fn(expression):
     return vim.eval(expression).strip()
 
 class AIProviderUtils():
-    def print_debug(self, text, *args):
-        print_debug(text, *args)
+    def print_debug(self, text, *args, level='debug'):
+        print_debug(text, *args, level=level)
+
+    def record_request_event(self, event: str):
+        """Marks a point of the running request, e.g. `connected` or `first_byte`"""
+        metrics.mark_request_event(event)
+
+    def record_request_bytes(self, sent: int = 0, received: int = 0):
+        metrics.add_request_bytes(sent, received)
+
+    def record_request_usage(self, input_tokens=None, output_tokens=None):
+        metrics.set_request_usage(input_tokens, output_tokens)
+
+    def trace_span(self, name: str, **args):
+        """Context manager recording a span of the request when tracing is on"""
+        return tracing.span(name, **args)
 
     def make_known_error(self, message: str):
         return KnownError(message)
@@ -151,13 +184,16 @@ ai_provider_utils = AIProviderUtils()
 def unwrap(input_var):
     return vim.eval(input_var)
 
+# NOTE: configs can be shared (memoized by make_ai_context), do not modify them in place
 def make_options(options):
     # initial prompt can be both a string and a list of strings, normalize it to list
     if 'initial_prompt' in options and isinstance(options['initial_prompt'], str):
+        options = options.copy()
         options['initial_prompt'] = options['initial_prompt'].split('\n')
     return options
 
 def make_config(config):
+    config = config.copy()
     config['options'] = make_options(config['options'])
     return config
 
@@ -297,12 +333,14 @@ def parse_chat_messages(chat_content):
             elif current_type == 'include':
                 paths = parse_include_paths(line)
                 for path in paths:
-                    content = make_image_message(path) if is_image_path(path) else make_text_file_message(path)
+                    with tracing.span('include', path=path):
+                        content = make_image_message(path) if is_image_path(path) else make_text_file_message(path)
                     messages[-1]['content'].append(content)
             elif current_type == 'exec':
                 cmd = line.strip()
                 if cmd:
-                    messages[-1]['content'].append(make_exec_output_message(cmd))
+                    with tracing.span('exec', cmd=cmd):
+                        messages[-1]['content'].append(make_exec_output_message(cmd))
             elif current_type in ('tool_call', 'tool_response'):
                 l = line.strip()
                 if l:
@@ -319,9 +357,25 @@ def parse_chat_messages(chat_content):
 
     return messages
 
-def parse_chat_header_config():
+# reads all lines of the current buffer in a single call, cheaper than
+# vim.eval('getline(1, "$")') which converts the list through vimscript
+def get_buffer_lines():
+    return vim.current.buffer[:]
+
+_chat_role_line_re = re.compile(r"(>>>|<<<) (\w+)")
+
+def find_last_chat_role(lines):
+    # scan from the end, the last role is usually just a few lines away
+    for line in reversed(lines):
+        match = _chat_role_line_re.match(line)
+        if match:
+            return match.group(2)
+    return None
+
+def parse_chat_header_config(lines=None):
     config = { 'provider': '', 'options': {}, 'ui': {} }
-    lines = vim.eval('getline(1, "$")')
+    if lines is None:
+        lines = get_buffer_lines()
 
     is_derpecated_syntax = '[chat-options]' in lines
     if is_derpecated_syntax:
@@ -369,74 +423,339 @@ def parse_error_message(error):
     except:
         pass
 
-def handle_completion_error(provider, error):
+def format_completion_error(provider, error):
+    """Returns a user facing message of a known error, None for unexpected errors"""
     # nvim throws - pynvim.api.common.NvimError: Keyboard interrupt
     is_nvim_keyboard_interrupt = "Keyboard interrupt" in str(error)
     if isinstance(error, KeyboardInterrupt) or is_nvim_keyboard_interrupt:
-        print_info_message("Completion cancelled...")
+        return "Completion cancelled..."
     elif isinstance(error, HTTPError):
         status_code = error.getcode()
         error_message = parse_error_message(error)
         msg = "{}: HTTPError {}".format(provider, status_code)
         if error_message:
             msg += ": {}".format(error_message)
-        print_info_message(msg)
+        return msg
     elif isinstance(error, URLError) and isinstance(error.reason, socket.timeout):
-        print_info_message("Request timeout...")
+        return "Request timeout..."
     elif isinstance(error, URLError):
-        print_info_message("URLError: {}".format(error.reason))
+        return "URLError: {}".format(error.reason)
     elif isinstance(error, KnownError):
-        print_info_message(str(error))
-    else:
+        return str(error)
+    return None
+
+def handle_completion_error(provider, error):
+    msg = format_completion_error(provider, error)
+    if msg is None:
         raise error
+    print_info_message(msg)
 
 # clears "Completing..." message from the status line
 def clear_echo_message():
     # https://neovim.discourse.group/t/how-to-clear-the-echo-message-in-the-command-line/268/3
     vim.command("call feedkeys(':','nx')")
 
+# result of g:vim_ai_roles_config_function, kept for g:vim_ai_roles_config_function_ttl seconds
+_roles_config_function_cache = { 'name': None, 'expires_at': 0, 'roles': {} }
+
+_no_custom_roles = {}
+
+def load_custom_roles():
+    """Returns roles defined by g:vim_ai_roles_config_function.
+
+    The same object is returned until the ttl expires, so it can be used to
+    detect that custom roles have changed. Do not modify it.
+    """
+    roles_config_function = get_vim_global("g:vim_ai_roles_config_function", None)
+    if roles_config_function is None:
+        return _no_custom_roles
+    cache = _roles_config_function_cache
+    if cache['name'] == roles_config_function and time.time() < cache['expires_at']:
+        return cache['roles']
+    if not vim.eval("exists('*" + roles_config_function + "')"):
+        raise Exception("Role config function does not exist: {}".format(roles_config_function))
+    custom_roles = vim.eval(roles_config_function + "()")
+    ttl = float(get_vim_global("g:vim_ai_roles_config_function_ttl", 0) or 0)
+    cache['name'] = roles_config_function
+    cache['expires_at'] = time.time() + ttl
+    cache['roles'] = custom_roles
+    return custom_roles
+
 def enhance_roles_with_custom_function(roles):
-    if vim.eval("exists('g:vim_ai_roles_config_function')") == '1':
-        roles_config_function = vim.eval("g:vim_ai_roles_config_function")
-        if not vim.eval("exists('*" + roles_config_function + "')"):
-            raise Exception("Role config function does not exist: {}".format(roles_config_function))
-        else:
-            roles.update(vim.eval(roles_config_function + "()"))
+    roles.update(load_custom_roles())
+
+def _file_cache_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (path, None, None)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+# parsed role files, invalidated when mtime or size of any of the files changes
+_role_files_cache = { 'key': None, 'roles': None }
 
 def read_role_files():
+    """Returns parsed role files. The parser is cached and shared, do not modify it."""
     plugin_root = vim.eval("s:plugin_root")
     default_roles_config_path = str(os.path.join(plugin_root, "roles-default.ini"))
-    roles_config_path = os.path.expanduser(vim.eval("g:vim_ai_roles_config_file"))
+    roles_config_path = os.path.expanduser(get_vim_global("g:vim_ai_roles_config_file"))
     if not os.path.exists(roles_config_path):
         raise Exception("Role config file does not exist: {}".format(roles_config_path))
 
+    paths = [default_roles_config_path, roles_config_path]
+    cache_key = tuple(_file_cache_key(path) for path in paths)
+    if _role_files_cache['key'] == cache_key:
+        return _role_files_cache['roles']
+
     roles = configparser.ConfigParser()
-    roles.read([default_roles_config_path, roles_config_path])
+    roles.read(paths)
+    _role_files_cache['key'] = cache_key
+    _role_files_cache['roles'] = roles
     return roles
 
+# multiple of 4, so that each block decodes on its own
+B64_DECODE_BLOCK_SIZE = 4 * 16384
+
+def _iter_b64_blocks(pieces):
+    pending = ''
+    for piece in pieces:
+        if '\n' in piece or '\r' in piece:
+            piece = ''.join(piece.split())
+        pending += piece
+        end = len(pending) - len(pending) % B64_DECODE_BLOCK_SIZE
+        for start in range(0, end, B64_DECODE_BLOCK_SIZE):
+            yield pending[start:start + B64_DECODE_BLOCK_SIZE]
+        pending = pending[end:]
+    if pending:
+        yield pending
+
 def save_b64_to_file(path, b64_data):
-    f = open(path, "wb")
-    f.write(base64.b64decode(b64_data))
-    f.close()
+    """Decodes base64 data to a file block by block
+
+    b64_data is a string or an iterable of its pieces, e.g. read from a
+    response stream. The file is written under a temporary name and
+    renamed once complete, so a partially written image is never visible.
+    """
+    if isinstance(b64_data, str):
+        b64_data = (b64_data,)
+    tmp_path = path + '.part'
+    try:
+        with open(tmp_path, "wb") as f:
+            for block in _iter_b64_blocks(b64_data):
+                f.write(base64.b64decode(block))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class JSONBodyStream(object):
+    """Request body that serializes JSON lazily in bounded chunks.
+
+    Produces the same bytes as `json.dumps(obj).encode('utf-8')` without ever
+    holding a full copy of the document. Long strings (base64 images, big
+    includes) are sliced straight from the original object.
+    """
+    _SAFE_STRING_RE = re.compile(r'[ !#-\[\]-~]*\Z')
+    LARGE_STRING = 4096
+
+    def __init__(self, obj, chunk_size=65536):
+        self.obj = obj
+        self.chunk_size = chunk_size
+        self._length = None
+
+    def _iter_pieces(self, obj):
+        if isinstance(obj, str):
+            if len(obj) < self.LARGE_STRING:
+                yield json.dumps(obj)
+                return
+            yield '"'
+            is_safe = self._SAFE_STRING_RE.match(obj) is not None
+            for i in range(0, len(obj), self.chunk_size):
+                part = obj[i:i + self.chunk_size]
+                # escaping is per character, so slices can be escaped independently
+                yield part if is_safe else json.dumps(part)[1:-1]
+            yield '"'
+        elif isinstance(obj, dict):
+            yield '{'
+            for i, (key, value) in enumerate(obj.items()):
+                if i:
+                    yield ', '
+                # json.dumps turns non-string keys (numbers, booleans) into strings
+                yield json.dumps(key if isinstance(key, str) else json.dumps(key))
+                yield ': '
+                for piece in self._iter_pieces(value):
+                    yield piece
+            yield '}'
+        elif isinstance(obj, (list, tuple)):
+            yield '['
+            for i, value in enumerate(obj):
+                if i:
+                    yield ', '
+                for piece in self._iter_pieces(value):
+                    yield piece
+            yield ']'
+        else:
+            yield json.dumps(obj)
+
+    def __len__(self):
+        if self._length is None:
+            # with ensure_ascii all pieces are ascii, so characters == bytes
+            self._length = sum(len(piece) for piece in self._iter_pieces(self.obj))
+        return self._length
+
+    def __iter__(self):
+        buffer = []
+        buffered = 0
+        for piece in self._iter_pieces(self.obj):
+            buffer.append(piece)
+            buffered += len(piece)
+            if buffered >= self.chunk_size:
+                yield ''.join(buffer).encode('ascii')
+                buffer = []
+                buffered = 0
+        if buffer:
+            yield ''.join(buffer).encode('ascii')
+
+class JSONStringScanner(object):
+    """Incremental JSON scanner returning string values in pieces
+
+    Long strings (base64 images) are never held in full. feed() returns
+    (path, piece, last) tuples for string values, path holds the object keys
+    and array indexes leading to the value, e.g. ('images', 0). Strings are
+    returned at most once per fed chunk, other values are skipped. The input
+    is expected to be valid JSON.
+    """
+    _ESCAPES = { '"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t' }
+    _STRING_SPECIAL_RE = re.compile(r'["\\]')
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._text = ''
+        # [type, key or index, expecting a key]
+        self._frames = []
+        self._in_string = False
+        self._is_key = False
+        self._path = None
+        self._parts = []
+
+    def _start_string(self):
+        frame = self._frames[-1] if self._frames else None
+        self._in_string = True
+        self._is_key = frame is not None and frame[0] == '{' and frame[2]
+        if not self._is_key:
+            self._path = tuple(frame[1] for frame in self._frames)
+
+    def _end_string(self, events):
+        value = ''.join(self._parts)
+        self._parts = []
+        self._in_string = False
+        if self._is_key:
+            self._frames[-1][1] = value
+        else:
+            events.append((self._path, value, True))
+
+    def _read_string(self, text, pos, events):
+        """Reads string characters from pos, returns the position to continue from"""
+        length = len(text)
+        while pos < length:
+            match = self._STRING_SPECIAL_RE.search(text, pos)
+            end = match.start() if match else length
+            if end > pos:
+                self._parts.append(text[pos:end])
+            if match is None:
+                return length
+            if text[end] == '"':
+                self._end_string(events)
+                return end + 1
+            # escape sequences split between chunks wait for the next chunk
+            if end + 1 >= length:
+                return end
+            char = text[end + 1]
+            if char == 'u':
+                if end + 6 > length:
+                    return end
+                self._parts.append(chr(int(text[end + 2:end + 6], 16)))
+                pos = end + 6
+            else:
+                self._parts.append(self._ESCAPES.get(char, char))
+                pos = end + 2
+        return pos
+
+    def feed(self, data):
+        text = self._text + self._decoder.decode(data)
+        events = []
+        pos = 0
+        length = len(text)
+        while pos < length:
+            if self._in_string:
+                pos = self._read_string(text, pos, events)
+                if self._in_string and pos < length:
+                    # an escape sequence is incomplete
+                    break
+                continue
+            char = text[pos]
+            pos += 1
+            if char == '"':
+                self._start_string()
+            elif char == '{':
+                self._frames.append(['{', None, True])
+            elif char == '[':
+                self._frames.append(['[', 0, False])
+            elif char in '}]':
+                if self._frames:
+                    self._frames.pop()
+            elif char == ',' and self._frames:
+                frame = self._frames[-1]
+                if frame[0] == '[':
+                    frame[1] += 1
+                else:
+                    frame[2] = True
+            elif char == ':' and self._frames:
+                self._frames[-1][2] = False
+        self._text = text[pos:]
+        if self._in_string and not self._is_key and self._parts:
+            events.append((self._path, ''.join(self._parts), False))
+            self._parts = []
+        return events
+
+def iter_json_strings(chunks):
+    """Yields (path, piece, last) of string values in a JSON document read in chunks"""
+    scanner = JSONStringScanner()
+    for chunk in chunks:
+        for event in scanner.feed(chunk):
+            yield event
+
+# provider classes by provider name, each script is imported once and
+# re-imported only when it changes on disk
+_provider_registry = {}
+
+def _import_provider_module(provider_name, provider_path, is_reload):
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    relative_path = os.path.relpath(os.path.abspath(provider_path), package_dir)
+    if relative_path.startswith('..') or not relative_path.endswith('.py'):
+        return load_module_compat('vim_ai_provider_' + provider_name, provider_path)
+    # built-in providers are imported as part of the package
+    module_name = 'vim_ai.' + relative_path[:-3].replace(os.sep, '.')
+    module = sys.modules.get(module_name)
+    if module is None:
+        return importlib.import_module(module_name)
+    return importlib.reload(module) if is_reload else module
 
 def load_provider(provider_name):
     try:
-        # Ensure Python path is set for provider loading
-        plugin_root = vim.eval("s:plugin_root")
-        vim.command("py3 import sys")
-        vim.command("py3 plugin_py_path = '{}/vim_ai'".format(plugin_root))
-        vim.command("py3 if plugin_py_path not in sys.path: sys.path.insert(0, plugin_py_path)")
-        # Also add parent directory so vim_ai can be imported as a package
-        vim.command("py3 parent_path = '{}'".format(plugin_root))
-        vim.command("py3 if parent_path not in sys.path: sys.path.insert(0, parent_path)")
-        
-        providers = vim.eval("g:vim_ai_providers")
+        providers = get_vim_global("g:vim_ai_providers")
         provider_config = providers[provider_name]
         provider_path = provider_config['script_path']
         provider_class_name = provider_config['class_name']
-        vim.command("py3file {}".format(provider_path))
-        provider_class = globals()[provider_class_name]
-    except KeyError as error:
+        cache_key = (_file_cache_key(provider_path), provider_class_name)
+        cached = _provider_registry.get(provider_name)
+        if cached and cached['key'] == cache_key:
+            return cached['class']
+        provider_module = _import_provider_module(provider_name, provider_path, cached is not None)
+        provider_class = getattr(provider_module, provider_class_name)
+        _provider_registry[provider_name] = { 'key': cache_key, 'class': provider_class }
+    except (KeyError, AttributeError) as error:
         print_debug("[load-provider] provider: {}", error)
         raise error
     return provider_class